@@ -1,18 +1,19 @@
 from anytree import NodeMixin
 import numpy as np
 import chess
-from random import sample
+import time
+from random import sample, choice
 
 
 class node(NodeMixin):
 
     def __init__(self,move=None,parent=None):
-        self.move = move 
+        self.move = move
         self.N = 0
         self.W = 0
         self.parent = parent
 
-    def uct(self,white_to_play): # compute uct 
+    def uct(self,white_to_play): # compute uct
         if white_to_play:
             relative_W = self.W
         else:
@@ -20,11 +21,47 @@ class node(NodeMixin):
         return relative_W/(self.N or 1) + np.sqrt(2)*np.sqrt(np.log((self.parent.N or 1))/(self.N or 1))
 
 
+def rollout(position): # random game from position, position is restored with pop() at the end
+    nb_pushed = 0
+    while True:
+        legal_moves = list(position.legal_moves) # génération des coups légaux, nécessaire pour le tirage de toute façon
+        if not legal_moves: # mat ou pat
+            if position.is_check():
+                result = "0-1" if position.turn else "1-0"
+            else:
+                result = "1/2-1/2"
+            break
+        # same draws as position.outcome(), but each one is only tested when it can have changed
+        if (nb_pushed == 0 or position.halfmove_clock == 0) and position.is_insufficient_material(): # le matériel ne change qu'après une prise ou une promotion
+            result = "1/2-1/2"
+            break
+        if position.halfmove_clock >= 150: # règle des 75 coups
+            result = "1/2-1/2"
+            break
+        if position.halfmove_clock >= 16 and position.is_fivefold_repetition(): # impossible en moins de 16 demi-coups réversibles
+            result = "1/2-1/2"
+            break
+        position.push(choice(legal_moves)) # tirage aléatoire du prochain coup
+        nb_pushed += 1
+    for i in range(nb_pushed): # retour à la position de départ
+        position.pop()
+    return result
+
+
+def rollouts(position, nb): # nb random games from position, can be sent to a worker process
+    return [rollout(position) for i in range(nb)]
+
+
 class mcts():
-    def __init__(self,position):
-        self.initial_position = position.copy() # initial_position and current_position are chess.Board() objects 
+    def __init__(self,position,nb_rollouts=1,pool=None,nb_workers=None):
+        self.initial_position = position.copy() # initial_position and current_position are chess.Board() objects
         self.current_position = position.copy()
         self.root = node() # create the tree root, that correspond to initial_position
+        self.nb_rollouts = nb_rollouts # number of random games played from each new leaf
+        self.pool = pool # optional multiprocessing.Pool() used to share the random games of a leaf between processes
+        self.nb_workers = nb_workers if nb_workers is not None or pool is None else pool._processes # size of the pool, not of the machine
+        self.rollouts_done = 0
+        self.rollout_time = 0.
 
     def selection(self): # we reach a leaf using UCT selection
         current_node = self.root # we start from the root
@@ -41,38 +78,51 @@ class mcts():
 
         outcome = self.current_position.outcome() # résultat actuel de la partie
         #EXPANSION
-        legal_moves = self.current_position.legal_moves # génération des coups légaux
+        legal_moves = list(self.current_position.legal_moves) # génération des coups légaux
         child_node = None # juste pour ne pas bugger la fin de partie
 
-        if outcome is None: # si la partie n'est pas terminée
-            chosen_move = sample(list(legal_moves),1)[0] # tirage aléatoire d'un coup légal
-            for move in legal_moves: # création des nouveaux noeuds correspondants aux coups légaux
-                if move == chosen_move:
-                    child_node = node(move=move,parent=leaf) # On garde le noeud enfant dans une variable, on en aura besoin dans la rétropropagation
-                else:
-                    node(move=move,parent=leaf)
-            self.current_position.push(chosen_move) # mise à jour de la position courante avec le nouveau coup
-            outcome = self.current_position.outcome() # mise à jour de l'issue de la partie
+        if outcome is not None:
+            return child_node, [outcome.result()] * self.nb_rollouts
+
+        chosen_move = choice(legal_moves) # tirage aléatoire d'un coup légal
+        for move in legal_moves: # création des nouveaux noeuds correspondants aux coups légaux
+            if move == chosen_move:
+                child_node = node(move=move,parent=leaf) # On garde le noeud enfant dans une variable, on en aura besoin dans la rétropropagation
+            else:
+                node(move=move,parent=leaf)
+        self.current_position.push(chosen_move) # mise à jour de la position courante avec le nouveau coup
+
         #SIMULATION
-        while outcome is None : # tant que la partie n'est pas terminée
-            legal_moves = self.current_position.legal_moves # génération des coups légaux
-            random_move = sample(list(legal_moves),1)[0] # tirage aléatoire du prochain coup
-            self.current_position.push(random_move) # mise à jour de la position courante avec le nouveau coup
-            outcome = self.current_position.outcome() # mise à jour de l'issue de la partie
-        result = outcome.result() 
-
-        return child_node, result
-
-    def backpropagation(self, child_node, result): # we backpropagate information through the tree
-        if result == "1-0":
-            inc = 1
-        elif result == "0-1":
-            inc = -1
-        else:
-            inc = 0
-        if child_node is not None :  
+        start = time.perf_counter()
+        if self.pool is None or self.nb_rollouts == 1:
+            results = rollouts(self.current_position, self.nb_rollouts)
+        else: # les parties aléatoires sont réparties entre les processus
+            nb_chunks = min(self.nb_rollouts, 2 * self.nb_workers) # deux morceaux par processus pour équilibrer la charge
+            chunks = [self.nb_rollouts // nb_chunks + (i < self.nb_rollouts % nb_chunks) for i in range(nb_chunks)]
+            results = sum(self.pool.starmap(rollouts, [(self.current_position, nb) for nb in chunks]), [])
+        self.rollout_time += time.perf_counter() - start
+        self.rollouts_done += len(results)
+
+        return child_node, results
+
+    def backpropagation(self, child_node, results): # we backpropagate information through the tree
+        inc = results.count("1-0") - results.count("0-1")
+        if child_node is not None :
             for ancestor in child_node.iter_path_reverse(): # rétropropagation du résultat issu de la simulation
-                ancestor.N += 1
+                ancestor.N += len(results)
                 ancestor.W += inc
-        self.current_position = self.initial_position.copy()
-        return
\ No newline at end of file
+        while len(self.current_position.move_stack) > len(self.initial_position.move_stack): # retour à la position initiale sans copie
+            self.current_position.pop()
+        return
+
+    def simulate(self, nb_simul):
+        for i in range(nb_simul):
+            self.backpropagation(*self.expansion_simulation(self.selection()))
+        return
+
+    def root_stats(self): # moves, visit counts and sums of results (white's point of view) of the root's children
+        children = self.root.children
+        return [child.move for child in children], np.array([child.N for child in children]), np.array([child.W for child in children])
+
+    def rollouts_per_second(self):
+        return self.rollouts_done / self.rollout_time if self.rollout_time > 0 else 0.
@@ -0,0 +1,456 @@
+import numpy as np
+import chess
+import chess.polyglot # hash de Zobrist des positions
+from random import choice # tirage aléatoire
+from numpy.random import dirichlet # tirage selon une loi de Dirichlet
+from MCTS_nn import * # recherche arborescente Monte Carlo guidée par le réseau de neurones
+
+
+'''
+MCTS_dag.py
+
+Contient les classes graph_nn et mcts_nn_dag qui permettent d'effectuer la recherche de mcts_nn dans un graphe
+plutôt que dans un arbre : une position atteinte par plusieurs ordres de coups (transposition) n'est évaluée
+qu'une fois et ses statistiques sont partagées.
+
+Les arêtes (les coups) portent leurs propres nombres de visites et sommes de valuations. Le chemin suivi pendant la
+sélection est conservé, la rétropropagation met donc à jour les bons parents même quand un noeud en a plusieurs.
+
+Une position qui se répète sur le chemin est comptée comme nulle (ce qui empêche aussi les cycles) et n'est jamais
+enregistrée dans un noeud. Mais la valuation d'une position dépend aussi de son historique : le réseau de neurones
+lit le compteur des 50 coups, et les nulles par répétition trouvées sous un noeud dépendent des positions qui le
+précèdent. Un noeud est donc identifié par le hash de Zobrist de sa position combiné avec celui de son historique
+réversible, l'ensemble des positions atteintes depuis la dernière prise ou le dernier coup de pion (cf node_key) :
+seules les transpositions qui ont le même historique réversible, et donc le même compteur des 50 coups, sont
+fusionnées. C'est le cas de la plupart des transpositions utiles, qui se rejoignent après un coup de pion ou une
+prise.
+'''
+
+
+'''
+Fonctions history_signature(position) et node_key(zobrist, signature)
+
+Description :
+    history_signature combine (ou exclusif) les hash de Zobrist des positions de l'historique réversible de position,
+    les halfmove_clock positions qui la précèdent : ce sont les seules qu'une suite de la partie peut répéter. Pendant
+    la sélection la signature est mise à jour à chaque coup (cf mcts_nn_dag.select_path). node_key combine le hash
+    de la position et cette signature en la clé du noeud.
+'''
+
+def history_signature(position):
+
+    board = position.copy()
+    signature = 0
+
+    for i in range(min(position.halfmove_clock, len(position.move_stack))):
+        board.pop()
+        signature ^= chess.polyglot.zobrist_hash(board)
+
+    return signature
+
+def node_key(zobrist, signature):
+
+    return (zobrist ^ (signature * 0x9E3779B97F4A7C15)) & 0xFFFFFFFFFFFFFFFF # la signature est mélangée avant d'être combinée
+
+
+def outcome_value(outcome):
+
+    '''
+    Sortie : valuation (perspective des blancs) de outcome (chess.Outcome), None si la partie n'est pas finie
+    '''
+
+    if outcome is None:
+        return None
+
+    if outcome.winner is None:
+        return 0.
+
+    return 1. if outcome.winner == chess.WHITE else -1.
+
+
+class graph_nn():
+
+    '''
+    Classe graph_nn
+
+    Cette classe correspond au graphe de recherche, stocké sous forme de tableaux numpy. Les arêtes qui partent
+    d'un noeud occupent un bloc contigu. Elle est caractérisée par 15 attributs :
+
+        - N : entiers, nombre de fois où chaque noeud a été visité (tous parents confondus)
+        - V : réels, somme des valuations de chaque noeud (perspective des blancs)
+        - first_edge : entiers, indice de la première arête de chaque noeud (-1 si le noeud n'est pas développé)
+        - nb_edges : entiers, nombre d'arêtes de chaque noeud
+        - nb_nodes : entier, nombre de noeuds utilisés
+        - edge_N : entiers, nombre de fois où chaque arête a été empruntée
+        - edge_W : réels, somme des valuations rétropropagées par chaque arête (perspective des blancs)
+        - prior : réels, probabilité du coup donnée par le réseau de neurones
+        - prob : réels, probabilité bruitée du coup
+        - move : entiers, coup correspondant à chaque arête (cf encode_move)
+        - child : entiers, noeud atteint par chaque arête (-1 s'il n'a pas encore été créé)
+        - nb_edges_used : entier, nombre d'arêtes utilisées
+        - table : dictionnaire, clé -> noeud (cf node_key)
+        - key : entiers, clé de chaque noeud : position et historique réversible
+        - zobrist : entiers, hash de Zobrist de la position de chaque noeud
+    '''
+
+    node_fields = (("N", 0), ("V", 0), ("first_edge", -1), ("nb_edges", 0), ("key", 0), ("zobrist", 0))
+    edge_fields = (("edge_N", 0), ("edge_W", 0), ("prior", 0), ("prob", 0), ("move", 0), ("child", -1))
+
+    def __init__(self, capacity=1024):
+
+        self.N = np.zeros(capacity, dtype=np.int64)
+        self.V = np.zeros(capacity, dtype=np.float64)
+        self.first_edge = np.full(capacity, -1, dtype=np.int64)
+        self.nb_edges = np.zeros(capacity, dtype=np.int64)
+        self.key = np.zeros(capacity, dtype=np.uint64)
+        self.zobrist = np.zeros(capacity, dtype=np.uint64)
+        self.nb_nodes = 0
+
+        self.edge_N = np.zeros(capacity, dtype=np.int64)
+        self.edge_W = np.zeros(capacity, dtype=np.float64)
+        self.prior = np.zeros(capacity, dtype=np.float64)
+        self.prob = np.zeros(capacity, dtype=np.float64)
+        self.move = np.zeros(capacity, dtype=np.int64)
+        self.child = np.full(capacity, -1, dtype=np.int64)
+        self.nb_edges_used = 0
+
+        self.table = {}
+
+    '''
+    Fonction grow(graph_nn(), fields, used, nb)
+
+    Description :
+        Double la taille des tableaux de fields jusqu'à pouvoir accueillir nb éléments supplémentaires.
+    '''
+
+    def grow(self, fields, used, nb):
+
+        capacity = len(getattr(self, fields[0][0]))
+
+        if used + nb <= capacity:
+            return
+
+        while used + nb > capacity:
+            capacity *= 2
+
+        for name, fill in fields:
+            old = getattr(self, name)
+            new = np.full(capacity, fill, dtype=old.dtype)
+            new[:used] = old[:used]
+            setattr(self, name, new)
+
+    def add_node(self, key, zobrist):
+
+        self.grow(self.node_fields, self.nb_nodes, 1)
+        node = self.nb_nodes
+        self.key[node] = key
+        self.zobrist[node] = zobrist
+        self.table[key] = node
+        self.nb_nodes += 1
+
+        return node
+
+    def add_edges(self, node, moves, priors, probs):
+
+        nb = len(moves)
+        self.grow(self.edge_fields, self.nb_edges_used, nb)
+        first = self.nb_edges_used
+
+        self.prior[first:first+nb] = priors
+        self.prob[first:first+nb] = probs
+        self.move[first:first+nb] = [encode_move(move) for move in moves]
+        self.first_edge[node] = first
+        self.nb_edges[node] = nb
+        self.nb_edges_used += nb
+
+        return
+
+    def edges(self, node):
+
+        return np.arange(self.first_edge[node], self.first_edge[node] + self.nb_edges[node])
+
+    def node_bytes(self):
+
+        return sum(getattr(self, name).itemsize for name, fill in self.node_fields) # mémoire d'un noeud, sans ses arêtes
+
+    def edge_bytes(self):
+
+        return sum(getattr(self, name).itemsize for name, fill in self.edge_fields)
+
+    def nbytes(self):
+
+        return sum(getattr(self, name).nbytes for name, fill in self.node_fields + self.edge_fields) # mémoire allouée
+
+    '''
+    Fonction score(graph_nn(), node, white_to_play)
+
+    Sortie :
+        - Scores des arêtes de node, calculés avec les statistiques des arêtes et le nombre de visites de node
+    '''
+
+    def score(self, node, white_to_play):
+
+        first = self.first_edge[node]
+        last = first + self.nb_edges[node]
+        N = self.edge_N[first:last]
+
+        if white_to_play:
+            relative_W = self.edge_W[first:last]
+
+        else:
+            relative_W = -self.edge_W[first:last]
+
+        return relative_W/np.maximum(N, 1) + 1.5 * self.prob[first:last] * np.sqrt(self.N[node]) / (1 + N)
+
+    '''
+    Fonction subgraph(graph_nn(), node)
+
+    Sortie :
+        - un nouveau graphe graph_nn() ne contenant que les noeuds accessibles depuis node, node ayant l'indice 0
+    '''
+
+    def subgraph(self, node):
+
+        new_index = {node: 0}
+        order = [node]
+        k = 0
+
+        while k < len(order): # parcours en largeur des noeuds accessibles
+
+            for edge in self.edges(order[k]):
+                child = self.child[edge]
+                if child != -1 and child not in new_index:
+                    new_index[child] = len(order)
+                    order.append(child)
+
+            k += 1
+
+        nb_edges = int(self.nb_edges[order].sum())
+        graph = graph_nn(capacity=max(1024, 2 * len(order), 2 * nb_edges))
+
+        for old in order:
+
+            new = graph.add_node(int(self.key[old]), int(self.zobrist[old]))
+            graph.N[new] = self.N[old]
+            graph.V[new] = self.V[old]
+
+            if self.nb_edges[old] > 0: # les arêtes sont recopiées en bloc, les enfants sont renumérotés
+                edges = self.edges(old)
+                first = graph.nb_edges_used
+                last = first + len(edges)
+                for name, fill in self.edge_fields:
+                    getattr(graph, name)[first:last] = getattr(self, name)[edges]
+                graph.child[first:last] = [new_index[child] if child != -1 else -1 for child in self.child[edges]]
+                graph.first_edge[new] = first
+                graph.nb_edges[new] = len(edges)
+                graph.nb_edges_used = last
+
+        return graph
+
+
+
+
+
+class mcts_nn_dag(mcts_nn):
+
+    '''
+    Classe mcts_nn_dag
+
+    Recherche de mcts_nn effectuée dans un graphe graph_nn(). Le lot de feuilles (batch_size) n'est pas utilisé :
+    les simulations sont effectuées une par une. Le profiler éventuel mesure les mêmes phases que pour mcts_nn, et
+    snapshot donne les statistiques du graphe (cf profiler.graph_stats).
+
+    L'attribut root_signature est la signature de l'historique réversible de initial_position (cf history_signature).
+
+    Une feuille sélectionnée est un quadruplet (noeud, chemin, valuation, clé) :
+        - noeud : noeud non développé (la racine au début), ou None pour une position qui n'est pas encore dans le graphe
+        - chemin : liste des arêtes empruntées depuis la racine
+        - valuation : résultat de la partie si le chemin aboutit à une position terminale (ou si la racine est
+                      elle-même terminale, avec un chemin vide), None sinon
+        - clé : (clé du noeud, hash de Zobrist) de la nouvelle position quand noeud vaut None
+    '''
+
+    def __init__(self,position,model=None,cache=None,digest=None,profiler=None):
+
+        super().__init__(position, model=model, cache=cache, digest=digest, profiler=profiler)
+        self.tree = graph_nn()
+        self.root_signature = history_signature(position)
+        zobrist = chess.polyglot.zobrist_hash(position)
+        self.root = self.tree.add_node(node_key(zobrist, self.root_signature), zobrist)
+
+    '''
+    Fonction terminal_value(mcts_nn_dag())
+
+    Sortie :
+        - valuation (perspective des blancs) de current_position si elle termine la partie sur ce chemin, None sinon
+    '''
+
+    def terminal_value(self):
+
+        position = self.current_position
+        outcome = position.outcome() # mat, pat, matériel insuffisant, règle des 75 coups, quintuple répétition
+
+        if outcome is None and position.is_repetition(2): # position déjà rencontrée sur ce chemin ou dans la partie
+            return 0.
+
+        return outcome_value(outcome)
+
+    def selection(self):
+
+        start = self.clock()
+        leaf = self.select_path()
+
+        if self.profiler is not None:
+            self.profiler.add("selection", start)
+
+        return leaf
+
+    def select_path(self):
+
+        graph = self.tree
+        node = self.root
+        path = []
+        signature = self.root_signature
+
+        if graph.nb_edges[node] == 0: # racine non développée : elle n'est évaluée que si la partie continue
+            value = outcome_value(self.initial_position.outcome())
+            if value is not None:
+                return (node, path, value, None)
+
+        while graph.nb_edges[node] > 0: # tant qu'on est dans un noeud développé
+
+            white_to_play = self.current_position.turn
+            score = graph.score(node, white_to_play)
+            edge = graph.first_edge[node] + choice(np.flatnonzero(score == score.max()))
+            path.append(edge)
+            self.current_position.push(decode_move(graph.move[edge]))
+
+            if self.current_position.halfmove_clock == 0: # prise ou coup de pion : l'historique réversible est vide
+                signature = 0
+            else:
+                signature ^= int(graph.zobrist[node])
+
+            value = self.terminal_value()
+
+            if value is not None: # fin de partie sur ce chemin
+                return (None, path, value, None)
+
+            if graph.child[edge] == -1:
+                zobrist = chess.polyglot.zobrist_hash(self.current_position)
+                key = node_key(zobrist, signature)
+                child = graph.table.get(key, -1)
+                if child == -1: # nouvelle position
+                    return (None, path, None, (key, zobrist))
+                graph.child[edge] = child # transposition : l'arête rejoint un noeud de même position et même historique
+
+            node = graph.child[edge]
+
+        return (node, path, None, None)
+
+    def expansion_backprop(self, leaf):
+
+        graph = self.tree
+        node, path, value, key = leaf
+
+        if value is None:
+
+            legal_moves, prior, value = self.evaluate([self.current_position])[0] # évaluation de la position
+
+            if node is None:
+                node = graph.add_node(*key)
+                graph.child[path[-1]] = node
+
+            self.expansion(node, legal_moves, prior)
+
+        self.backprop(path, value)
+        self.current_position = self.initial_position.copy()
+
+        return
+
+    def expansion(self, node, legal_moves, prior):
+
+        start = self.clock()
+        dirichlet_noise = dirichlet([0.03]*len(legal_moves)) # bruit tiré selon une loi de dirichlet
+        prob = 0.75 * prior + 0.25 * dirichlet_noise # ajout du bruit
+
+        self.tree.add_edges(node, legal_moves, prior, prob)
+
+        if self.profiler is not None:
+            self.profiler.add("expansion", start, nb=len(legal_moves))
+
+        return
+
+    '''
+    Fonction backprop(mcts_nn_dag(), path, v)
+
+    Arguments :
+        - path : liste des arêtes empruntées depuis la racine
+        - v : réel, valuation de la feuille (perspective des blancs)
+
+    Description :
+        Met à jour les arêtes du chemin et les noeuds qu'elles relient, sans passer par d'autres parents.
+    '''
+
+    def backprop(self, path, v):
+
+        start = self.clock()
+        graph = self.tree
+        children = graph.child[path]
+        nodes = [self.root] + list(children[children != -1])
+
+        graph.edge_N[path] += 1
+        graph.edge_W[path] += v
+        graph.N[nodes] += 1
+        graph.V[nodes] += v
+
+        if self.profiler is not None:
+            self.profiler.add("backup", start, nb=len(path))
+
+        return
+
+    def simulate(self, nb_simul):
+
+        for i in range(nb_simul):
+            self.expansion_backprop(self.selection())
+            if self.profiler is not None:
+                self.profiler.tick(self)
+
+        return
+
+    def update_root(self, position):
+
+        self.root_signature = history_signature(position)
+        zobrist = chess.polyglot.zobrist_hash(position)
+        key = node_key(zobrist, self.root_signature)
+        node = self.tree.table.get(key, -1)
+
+        if node == -1:
+            self.tree = graph_nn()
+            self.tree.add_node(key, zobrist)
+
+        else: # on ne garde que les noeuds accessibles depuis la nouvelle position
+            self.tree = self.tree.subgraph(node)
+
+        self.root = 0
+        self.initial_position = position.copy()
+        self.current_position = position.copy()
+        self.add_root_noise()
+
+        return
+
+    def add_root_noise(self):
+
+        graph = self.tree
+        edges = graph.edges(self.root)
+
+        if len(edges) > 0:
+            dirichlet_noise = dirichlet([0.03]*len(edges))
+            graph.prob[edges] = 0.75 * graph.prior[edges] + 0.25 * dirichlet_noise
+
+        return
+
+    def root_stats(self):
+
+        edges = self.tree.edges(self.root)
+
+        return [decode_move(move) for move in self.tree.move[edges]], self.tree.edge_N[edges], self.tree.edge_W[edges]
@@ -1,62 +1,396 @@
-from anytree import NodeMixin # librairie pour les structures d'arbre
-import numpy as np 
+import time
+import warnings
+import numpy as np
 import chess # librairie d'échec, affichage, règles, coups légaux...
-from random import sample # tirage aléatoire
-from utils import * # fonctions utilitaires, cf 
+from random import sample, choice # tirage aléatoire
+from utils import * # fonctions utilitaires, cf
 from nn import * # appel au réseau de neurones pré-entraîné pour l'évaluation des positions
+from eval_cache import eval_cache # cache des évaluations du réseau de neurones
+from profiler import search_profiler, tree_stats # mesure du temps passé dans chaque phase de la recherche
 from numpy.random import dirichlet # tirage selon une loi de Dirichlet
 
 
 '''
 MCTS_nn.py
 
-Contient les classes node_nn et mcts_nn qui permettent d'implémenter 
-une recherche arborescente Monte Carlo améliorée par un réseau de neurone 
+Contient les classes tree_nn et mcts_nn qui permettent d'implémenter
+une recherche arborescente Monte Carlo améliorée par un réseau de neurone
 pré-entraîné qui fournit une politique d'expert.
 '''
 
-class node_nn(NodeMixin):
 
-    '''
-    Classe node_nn
+'''
+Fonctions encode_move(chess.Move()) et decode_move(entier)
+
+    Un coup est stocké dans l'arbre sous la forme d'un entier : case de départ + 64 * case d'arrivée + 4096 * promotion.
+'''
+
+def encode_move(move):
+
+    return move.from_square + 64 * move.to_square + 4096 * (move.promotion or 0)
+
+
+def decode_move(code):
+
+    code = int(code)
+
+    return chess.Move(code % 64, (code // 64) % 64, (code // 4096) or None)
 
-    Cette classe correspond aux noeuds de l'arbre. Elle est caractérisée par 5 attributs :
 
-        - move : chess.Move, coup correspondant au noeud
-        - N : entier, nombre de fois où le noeud a été visité
-        - V : réel, somme des valuations de la position
-        - prob : réel, probabilité de choisir le coup correspondant au noeud sachant qu'on était dans la position précédente
-        - parent : le noeud correspondant à la position précédente
+class tree_nn():
+
+    '''
+    Classe tree_nn
+
+    Cette classe correspond à l'arbre de recherche, stocké sous forme de tableaux numpy (un indice par noeud).
+    Les enfants d'un noeud occupent un bloc contigu de ces tableaux. Elle est caractérisée par 11 attributs :
+
+        - N : entiers, nombre de fois où chaque noeud a été visité
+        - V : réels, somme des valuations de la position de chaque noeud
+        - prior : réels, probabilité du coup correspondant au noeud donnée par le réseau de neurones
+        - prob : réels, probabilité de choisir le coup correspondant au noeud sachant qu'on était dans la position précédente (prior bruité)
+        - first_child : entiers, indice du premier enfant de chaque noeud (-1 pour une feuille)
+        - nb_children : entiers, nombre d'enfants de chaque noeud
+        - move : entiers, coup correspondant à chaque noeud (cf encode_move)
+        - parent : entiers, indice du noeud correspondant à la position précédente (-1 pour la racine, -2 pour un
+                   noeud libre)
+        - size : entier, nombre de noeuds alloués (utilisés ou libres), les tableaux sont agrandis quand ils sont pleins
+        - max_nodes : entier ou None, nombre maximal de noeuds ; une fois atteint, les sous-arbres les moins visités
+                      sont élagués pour faire de la place (cf prune)
+        - free : dictionnaire, taille -> liste des débuts des blocs libres de cette taille, réutilisés en priorité
     '''
 
-    def __init__(self,move=None,parent=None,prob=0,V=0):
+    fields = (("N", np.int64, 0), ("V", np.float64, 0), ("prior", np.float64, 0), ("prob", np.float64, 0),
+              ("first_child", np.int64, -1), ("nb_children", np.int64, 0), ("move", np.int64, 0), ("parent", np.int64, -1))
+
+    def __init__(self, capacity=1024, max_nodes=None, max_bytes=None):
+
+        if max_bytes is not None: # limite de mémoire convertie en nombre de noeuds
+            max_nodes = min(max_nodes or max_bytes, max_bytes // tree_nn.node_bytes())
+
+        if max_nodes is not None:
+            capacity = max(min(capacity, max_nodes), 1)
 
-        self.move = move 
-        self.N = 0
-        self.V = V
-        self.prob = prob
-        self.parent = parent
+        for name, dtype, fill in self.fields:
+            setattr(self, name, np.full(capacity, fill, dtype=dtype))
+        self.size = 1 # le noeud 0 est la racine
+        self.max_nodes = max_nodes
+        self.free = {}
+        self.nb_free = 0
 
     '''
-    Fonction score(node_nn(), white_to_play)
+    Fonction grow(tree_nn(), nb)
 
     Argument :
+        - nb : entier, nombre de noeuds que l'on veut pouvoir ajouter
+
+    Description :
+        Double la taille des tableaux jusqu'à pouvoir accueillir nb noeuds supplémentaires.
+    '''
+
+    def grow(self, nb):
+
+        capacity = len(self.N)
+
+        if self.size + nb <= capacity:
+            return
+
+        while self.size + nb > capacity:
+            capacity *= 2
+
+        if self.max_nodes is not None:
+            capacity = max(min(capacity, self.max_nodes), self.size + nb)
+
+        for name, dtype, fill in self.fields:
+            old = getattr(self, name)
+            new = np.full(capacity, fill, dtype=dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+    '''
+    Fonction add_children(tree_nn(), node, moves, priors, probs)
+
+    Arguments :
+        - node : entier, noeud que l'on développe
+        - moves : liste de chess.Move(), coups légaux dans la position du noeud
+        - priors : tableau de réels, probabilités des coups données par le réseau de neurones
+        - probs : tableau de réels, probabilités bruitées associées aux coups
+
+    Description :
+        Alloue un bloc contigu de noeuds enfants pour node (cf allocate).
+    '''
+
+    def add_children(self, node, moves, priors, probs, keep=()):
+
+        nb = len(moves)
+        first = self.allocate(nb, [node, *keep])
+
+        self.prior[first:first+nb] = priors
+        self.prob[first:first+nb] = probs
+        self.move[first:first+nb] = [encode_move(move) for move in moves]
+        self.parent[first:first+nb] = node
+        self.first_child[node] = first
+        self.nb_children[node] = nb
+
+        return
+
+    '''
+    Fonction allocate(tree_nn(), nb, keep)
+
+    Arguments :
+        - nb : entier, taille du bloc de noeuds voulu
+        - keep : liste de noeuds dont les ancêtres ne doivent pas être élagués (feuilles en attente d'expansion)
+
+    Sortie :
+        - indice du premier noeud du bloc
+
+    Description :
+        Le bloc est pris dans les blocs libres (le plus petit bloc assez grand, dont le reste redevient libre), sinon
+        à la fin des tableaux. Si max_nodes est atteint, on élague l'arbre (cf prune) et on fusionne les blocs libres
+        voisins (cf merge_free) jusqu'à trouver un bloc libre assez grand.
+    '''
+
+    def allocate(self, nb, keep=()):
+
+        first = self.take_free(nb)
+
+        if first is not None:
+            return first
+
+        while self.max_nodes is not None and self.size + nb > self.max_nodes:
+            if self.prune(max(nb, self.max_nodes // 10), keep) == 0:
+                raise MemoryError(f"search tree is full ({self.max_nodes} nodes) and nothing can be pruned")
+            self.merge_free()
+            first = self.take_free(nb)
+            if first is not None:
+                return first
+
+        self.grow(nb)
+        first = self.size
+        self.size += nb
+
+        return first
+
+    def take_free(self, nb):
+
+        sizes = [size for size, starts in self.free.items() if size >= nb and starts]
+
+        if not sizes:
+            return None
+
+        size = min(sizes)
+        first = self.free[size].pop()
+        self.nb_free -= size
+
+        if size > nb: # le reste du bloc redevient libre
+            self.free.setdefault(size - nb, []).append(first + nb)
+            self.nb_free += size - nb
+
+        return first
+
+    def merge_free(self):
+
+        '''
+        Fusionne les blocs libres contigus ; un bloc libre qui termine les noeuds alloués est rendu à la fin des tableaux
+        '''
+
+        blocks = sorted((first, size) for size, starts in self.free.items() for first in starts)
+        merged = []
+
+        for first, size in blocks:
+            if merged and merged[-1][0] + merged[-1][1] == first:
+                merged[-1][1] += size
+            else:
+                merged.append([first, size])
+
+        if merged and merged[-1][0] + merged[-1][1] == self.size:
+            first, size = merged.pop()
+            self.size = first
+            self.nb_free -= size
+
+        self.free = {}
+        for first, size in merged:
+            self.free.setdefault(size, []).append(first)
+
+        return
+
+    '''
+    Fonction prune(tree_nn(), nb, keep)
+
+    Arguments :
+        - nb : entier, nombre de noeuds à libérer
+        - keep : liste de noeuds dont les ancêtres ne doivent pas être élagués
+
+    Sortie :
+        - nombre de noeuds libérés
+
+    Description :
+        Les noeuds développés les moins visités (hors racine et ancêtres de keep) redeviennent des feuilles, jusqu'à
+        libérer au moins nb noeuds : tous leurs descendants sont libérés et leurs blocs d'enfants rejoignent les blocs
+        libres. Le nombre de visites et la valuation des noeuds élagués ne changent pas, les statistiques de leurs
+        ancêtres restent donc exactes ; un noeud élagué est simplement redéveloppé s'il est sélectionné de nouveau.
+    '''
+
+    def prune(self, nb, keep=()):
+
+        protected = {0}
+        for node in keep:
+            protected.update(self.path(node))
+
+        used = self.used()
+        expanded = np.flatnonzero(used & (self.nb_children[:self.size] > 0))
+        freed = 0
+
+        for node in expanded[np.argsort(self.N[expanded], kind="stable")]:
+
+            if freed >= nb:
+                break
+
+            if node in protected or self.parent[node] == -2: # ancêtre d'une feuille en attente, ou déjà libéré
+                continue
+
+            freed += self.free_subtree(node)
+
+        return freed
+
+    def free_subtree(self, node):
+
+        blocks = [(self.first_child[node], self.nb_children[node])]
+        self.first_child[node] = -1
+        self.nb_children[node] = 0
+        freed = 0
+
+        while blocks:
+
+            first, nb = blocks.pop()
+            last = first + nb
+
+            for child in first + np.flatnonzero(self.nb_children[first:last] > 0):
+                blocks.append((self.first_child[child], self.nb_children[child]))
+
+            for name, dtype, fill in self.fields:
+                getattr(self, name)[first:last] = fill
+            self.parent[first:last] = -2
+            self.free.setdefault(int(nb), []).append(int(first))
+            freed += nb
+
+        self.nb_free += freed
+
+        return int(freed)
+
+    def used(self):
+
+        return self.parent[:self.size] != -2 # noeuds qui ne sont pas libres
+
+    @classmethod
+    def node_bytes(cls):
+
+        return sum(np.dtype(dtype).itemsize for name, dtype, fill in cls.fields) # mémoire d'un noeud
+
+    def nbytes(self):
+
+        return sum(getattr(self, name).nbytes for name, dtype, fill in self.fields) # mémoire allouée, noeuds libres compris
+
+    def is_leaf(self, node):
+
+        return self.nb_children[node] == 0
+
+    def children(self, node):
+
+        return np.arange(self.first_child[node], self.first_child[node] + self.nb_children[node])
+
+    def get_move(self, node):
+
+        return decode_move(self.move[node])
+
+    '''
+    Fonction score(tree_nn(), node, white_to_play)
+
+    Arguments :
+        - node : entier, noeud dont on veut scorer les enfants
         - white_to_play : booléen, vrai si c'est aux blancs de jouer
 
     Sortie :
-        - Score qui permet de choisir quel noeud choisir lors de la phase de sélection de l'algorithme MCTS
+        - Scores des enfants de node, calculés en une seule opération sur leur bloc contigu
     '''
 
-    def score(self,white_to_play):
+    def score(self, node, white_to_play):
+
+        first = self.first_child[node]
+        last = first + self.nb_children[node]
+        N = self.N[first:last]
 
         if white_to_play:
-            relative_V = self.V
+            relative_V = self.V[first:last]
 
         else:
-            relative_V = -self.V
+            relative_V = -self.V[first:last]
+
+        return relative_V/np.maximum(N, 1) + 1.5 * self.prob[first:last] * np.sqrt(self.N[node]) / (1 + N)
+
+    '''
+    Fonction path(tree_nn(), node)
+
+    Sortie :
+        - liste des noeuds entre node et la racine (node compris)
+    '''
+
+    def path(self, node):
+
+        path = []
+
+        while node != -1:
+            path.append(node)
+            node = self.parent[node]
+
+        return path
+
+    '''
+    Fonction subtree(tree_nn(), node)
+
+    Argument :
+        - node : entier, noeud qui devient la racine
+
+    Sortie :
+        - un nouvel arbre tree_nn() ne contenant que le sous-arbre de node, dont node est la racine (indice 0)
+
+    Description :
+        Le sous-arbre est recopié en largeur d'abord, ce qui conserve les blocs contigus d'enfants.
+        Le reste de l'arbre n'est plus référencé et est libéré.
+    '''
+
+    def subtree(self, node):
+
+        order = [node] # anciens indices, dans l'ordre des nouveaux
+        first_child = [-1]
+        parent = [-1]
+        k = 0
+
+        while k < len(order):
+
+            nb = self.nb_children[order[k]]
+
+            if nb > 0:
+                first = self.first_child[order[k]]
+                first_child[k] = len(order)
+                order.extend(range(first, first + nb))
+                first_child.extend([-1] * nb)
+                parent.extend([k] * nb)
+
+            k += 1
+
+        tree = tree_nn(capacity=max(1024, 2 * len(order)), max_nodes=self.max_nodes)
+        tree.grow(len(order) - 1)
+        tree.size = len(order)
+
+        for name in ("N", "V", "prior", "prob", "nb_children", "move"):
+            getattr(tree, name)[:tree.size] = getattr(self, name)[order]
+
+        tree.first_child[:tree.size] = first_child
+        tree.parent[:tree.size] = parent
+
+        return tree
 
-        return relative_V/(self.N or 1) + 1.5 * self.prob * np.sqrt(self.parent.N) / (1 + self.N)
-        
 
 
 
@@ -66,52 +400,79 @@ class mcts_nn():
     '''
     Classe mcts_nn
 
-    Cette classe correspond à l'arbre dans lequel on effectue MCTS. Elle est caractérisée par 6 attributs :
+    Cette classe correspond à l'arbre dans lequel on effectue MCTS. Elle est caractérisée par 10 attributs :
 
         - initial_position : chess.Board(), position dans laquelle on est réellement
         - current_position : chess.Board(), variable utilisé pour stocker les différentes positions courantes rencontrées dans MCTS
-        - root : node_nn(), noeud correspondant à la position initial_position
+        - tree : tree_nn(), l'arbre de recherche
+        - root : entier, noeud correspondant à la position initial_position
         - model : modèle keras, le réseau de neurone utilisé pour cacluler les valuations des positions et les probabilités conditionnelles
-        - moves_w : tous les coups jouables pour les blancs
-        - moves_b : tous les coups jouables pour les noirs
+        - batch_size : entier, nombre de feuilles évaluées ensemble par le réseau de neurones (cf simulate)
+        - virtual_loss : réel, perte virtuelle appliquée aux chemins déjà choisis dans un même lot
+        - cache : eval_cache() ou None, cache des évaluations du réseau de neurones
+        - digest : empreinte du modèle, qui identifie ses évaluations dans le cache (cf nn.model_digest, ou donnée
+                   explicitement pour un modèle hors du registre : PipeModel, SharedMemoryModel...) ; sans empreinte
+                   le cache n'est pas utilisé, les évaluations de modèles différents y seraient confondues
+        - profiler : search_profiler() ou None, mesure du temps passé dans chaque phase de la recherche (cf profiler.py)
+
+    max_nodes et max_bytes limitent la taille de l'arbre (cf tree_nn.prune).
     '''
 
-    def __init__(self,position):
+    def __init__(self,position,batch_size=1,virtual_loss=1,model=None,cache=None,profiler=None,max_nodes=None,max_bytes=None,
+                 digest=None):
 
-        self.initial_position = position.copy() 
+        self.initial_position = position.copy()
         self.current_position = position.copy()
-        self.root = node_nn()
-        self.model = load_model()
-        self.moves_w = [chess.Move.from_uci(move) for move in create_uci_labels()]
-        self.moves_b = [chess.Move.from_uci(move) for move in flipped_uci_labels()]
+        self.tree = tree_nn(max_nodes=max_nodes, max_bytes=max_bytes)
+        self.root = 0
+        self.model = model if model is not None else load_model() # modèle partagé, chargé une seule fois par processus
+        self.batch_size = batch_size
+        self.virtual_loss = virtual_loss
+        self.digest = digest if digest is not None else model_digest(self.model)
+        self.cache = cache if self.digest is not None else None
+
+        if cache is not None and self.digest is None:
+            warnings.warn("the model has no digest (pass digest=...), its evaluations are not cached")
+        self.profiler = profiler
+
+    def clock(self):
+
+        return time.perf_counter() if self.profiler is not None else 0. # pas d'appel à l'horloge sans profiler
 
     '''
-    Fonction selection(mcts_nn())
+    Fonction selection(mcts_nn(), position)
 
     Arguments :
+        - position : chess.Board() ou None, position parcourue (current_position par défaut)
 
     Sorties :
         - un noeud de l'arbre qui est une feuille
 
-    Description : 
-        Cette fonction permet, à partir de la racine de l'arbre, de sélectionner une feuille en parcourant les noeuds 
+    Description :
+        Cette fonction permet, à partir de la racine de l'arbre, de sélectionner une feuille en parcourant les noeuds
         ayant les scores les plus hauts. La variable current_position est parallèlement mise à jour en fonction des noeuds empruntés.
         On retourne finalement le noeud dans lequel on aboutit (c'est nécessairement une feuille).
     '''
-    
-    def selection(self): 
 
+    def selection(self, position=None):
+
+        start = self.clock()
+        tree = self.tree
         current_node = self.root
+        position = self.current_position if position is None else position
 
-        while current_node.is_leaf is not True: # tant qu'on est pas arrivé dans une feuille
+        while not tree.is_leaf(current_node): # tant qu'on est pas arrivé dans une feuille
 
-            white_to_play = self.current_position.turn
-            score = [child.score(white_to_play) for child in current_node.children] # calcul des scores des noeuds enfants du noeud courant
-            index = sample([i for i, j in enumerate(score) if j == max(score)],1)[0] # si plusieurs scores sont maximaux on en tire un au hasard parmi ces noeuds
-            current_node = current_node.children[index] # mise à jour du noeud courant
-            self.current_position.push(current_node.move) # mise à jour de la position courante 
+            white_to_play = position.turn
+            score = tree.score(current_node, white_to_play) # calcul des scores des noeuds enfants du noeud courant
+            index = choice(np.flatnonzero(score == score.max())) # si plusieurs scores sont maximaux on en tire un au hasard parmi ces noeuds
+            current_node = tree.first_child[current_node] + index # mise à jour du noeud courant
+            position.push(tree.get_move(current_node)) # mise à jour de la position courante
 
-        leaf = current_node 
+        leaf = current_node
+
+        if self.profiler is not None:
+            self.profiler.add("selection", start)
 
         return leaf
 
@@ -119,54 +480,450 @@ class mcts_nn():
     Fonction expansion_backprop(mcts_nn(), leaf)
 
     Arguments :
-        - leaf : node_nn(), noeud correspondant à la sortie de la fonction sélection(mcts_nn)
+        - leaf : entier, noeud correspondant à la sortie de la fonction sélection(mcts_nn)
 
     Sorties :
 
-    Description : 
+    Description :
         Cette fonction correspond à deux phases de l'algorithme MCTS : phase d'expansion/simulation et phase de rétropropagation.
-        EXPANSION/SIMULATION : 
+        EXPANSION/SIMULATION :
             Dans une feuille, on procède à la phase d'expansion. La position correspondant à cette feuille est évaluée par le réseau de neurones.
             On crée ensuite tous les noeuds enfants possibles (ceux correspondant à des coups légaux)
         RETROPROPAGATION :
 
     '''
 
-    def expansion_backprop(self,leaf): 
+    def expansion_backprop(self,leaf):
 
+        start = self.clock()
         outcome = self.current_position.outcome() # issue de la partie, None si la partie n'est pas finie
 
-        # EXPANSION
-
-        legal_moves = self.current_position.legal_moves # génération des coups légaux
+        if self.profiler is not None:
+            self.profiler.add("movegen", start)
 
         if outcome is None: # si la partie n'est pas terminée
 
-            dirichlet_noise, inc = dirichlet([0.03]*legal_moves.count()), 0 # bruit tiré selon une loi de dirichlet
-            p,v = evaluate_position(self.model, self.current_position) # évaluation de la position à l'aide du réseau de neurones
-            p = p[0]
-            v = v[0,0]
-            leaf.V += v # mise à jour de la valuation de la feuille
+            legal_moves, prior, v = self.evaluate([self.current_position])[0] # évaluation de la position à l'aide du réseau de neurones
+            self.expansion(leaf, legal_moves, prior)
+            self.backprop(leaf, v)
+
+        self.current_position = self.initial_position.copy() # on initialise la position courante
+
+        return
+
+    '''
+    Fonction evaluate(mcts_nn(), positions)
+
+    Argument :
+        - positions : liste de chess.Board(), positions à évaluer
+
+    Sortie :
+        - pour chaque position : (coups légaux, probabilités des coups légaux, valuation du point de vue des blancs)
+
+    Description :
+        Les positions présentes dans le cache ne sont pas réévaluées, les autres sont évaluées en un seul appel
+        au réseau de neurones puis ajoutées au cache. Les probabilités des coups légaux sont renormalisées (elles
+        somment à 1) ; si le modèle a une fonction predict_legal (numpy_model) elles sont les seules calculées.
+    '''
+
+    def evaluate(self, positions):
 
-            for move in legal_moves: # création des nouveaux noeuds correspondants aux coups légaux
+        results = [None] * len(positions)
+        missing = []
 
-                if self.current_position.turn : # si c'est aux blancs de jouer
-                    prob = p[self.moves_w.index(move)]
+        for i, position in enumerate(positions):
 
-                else : # si c'est aux noirs de jouer
-                    prob = p[self.moves_b.index(move)]
+            start = self.clock()
+            legal_moves = list(position.legal_moves) # génération des coups légaux
+            if self.profiler is not None:
+                self.profiler.add("movegen", start, nb=len(legal_moves))
+            cached = self.cache.get(position, self.digest) if self.cache is not None else None
 
-                prob = 0.75 * prob + 0.25 * dirichlet_noise[inc] # ajout du bruit
-                inc += 1
+            if cached is not None and len(cached[0]) == len(legal_moves):
+                results[i] = (legal_moves, cached[0], cached[1])
+                if self.profiler is not None:
+                    self.profiler.count("cache_hits")
 
-                node_nn(move=move,parent=leaf,prob=prob) # création des noeuds enfants
+            else:
+                results[i] = (legal_moves, None, None)
+                missing.append(i)
 
-            # RETROPROPAGATION
+        if len(missing) > 0:
+
+            start = self.clock()
+            indices = [policy_indices(positions[i], results[i][0]) for i in missing] # indices des coups légaux dans la politique
+            if self.profiler is not None:
+                self.profiler.add("encoding", start, nb=0) # les positions sont comptées par evaluate_positions
+
+            if hasattr(self.model, "predict_legal"): # seules les probabilités des coups légaux sont calculées
+                priors, v = evaluate_positions_legal(self.model, [positions[i] for i in missing], indices, self.profiler)
+
+            else:
+                p,v = evaluate_positions(self.model, [positions[i] for i in missing], self.profiler)
+                priors = [p[j][index] / p[j][index].sum() for j, index in enumerate(indices)] # renormalisées sur les coups légaux
+
+            for j, i in enumerate(missing):
+                legal_moves = results[i][0]
+                prior = priors[j]
+                results[i] = (legal_moves, prior, v[j,0])
+
+                if self.cache is not None:
+                    self.cache.put(positions[i], self.digest, prior, v[j,0])
+
+        return results
+
+    '''
+    Fonction expansion(mcts_nn(), leaf, legal_moves, prior)
+
+    Arguments :
+        - leaf : entier, feuille à développer
+        - legal_moves : liste de chess.Move(), coups légaux dans la position correspondant à leaf
+        - prior : tableau de réels, probabilités des coups légaux calculées par le réseau de neurones
+        - keep : liste des autres feuilles en attente d'expansion, que l'élagage de l'arbre doit épargner
+
+    Description :
+        Crée tous les noeuds enfants de leaf (ceux correspondant à des coups légaux), avec leurs probabilités bruitées.
+    '''
+
+    def expansion(self, leaf, legal_moves, prior, keep=()):
+
+        start = self.clock()
+        dirichlet_noise = dirichlet([0.03]*len(legal_moves)) # bruit tiré selon une loi de dirichlet
+        prob = 0.75 * prior + 0.25 * dirichlet_noise # ajout du bruit
+
+        self.tree.add_children(leaf, legal_moves, prior, prob, keep) # création des noeuds enfants
+
+        if self.profiler is not None:
+            self.profiler.add("expansion", start, nb=len(legal_moves))
+
+        return
+
+    '''
+    Fonction backprop(mcts_nn(), leaf, v)
+
+    Arguments :
+        - leaf : entier, feuille qui vient d'être évaluée
+        - v : réel, valuation de la feuille (perspective des blancs)
+    '''
+
+    def backprop(self, leaf, v):
+
+        start = self.clock()
+        tree = self.tree
+        tree.V[leaf] += v # mise à jour de la valuation de la feuille
+
+        path = tree.path(leaf)
+        tree.N[path] += 1 # mise à jour du nombre de visites des ancêtres
+        tree.V[path] += v # mise à jour des valuations des ancêtres
+
+        if self.profiler is not None:
+            self.profiler.add("backup", start, nb=len(path))
+
+        return
+
+    '''
+    Fonction virtual_loss_signs(mcts_nn(), path)
+
+    Argument :
+        - path : liste de noeuds, de la feuille à la racine
+
+    Sortie :
+        - +1 pour les noeuds choisis par les blancs, -1 pour ceux choisis par les noirs
+    '''
+
+    def virtual_loss_signs(self, path):
+
+        depth = np.arange(len(path) - 1, -1, -1) # profondeur de chaque noeud du chemin
+        chosen_by_white = (depth % 2 == 1) == self.initial_position.turn
+
+        return np.where(chosen_by_white, 1., -1.)
+
+    '''
+    Fonctions add_virtual_loss(mcts_nn(), leaf) et remove_virtual_loss(mcts_nn(), path, sign)
+
+    Description :
+        Chaque noeud du chemin de leaf compte une visite de plus et une valuation défavorable au joueur qui l'a choisi.
+        add_virtual_loss renvoie le chemin et les signes (cf virtual_loss_signs) à passer à remove_virtual_loss.
+    '''
+
+    def add_virtual_loss(self, leaf):
+
+        path = self.tree.path(leaf)
+        sign = self.virtual_loss_signs(path)
+        self.tree.N[path] += 1
+        self.tree.V[path] -= self.virtual_loss * sign
+
+        return path, sign
+
+    def remove_virtual_loss(self, path, sign):
+
+        self.tree.N[path] -= 1
+        self.tree.V[path] += self.virtual_loss * sign
+
+        return
+
+    '''
+    Fonction batch_simulation(mcts_nn(), nb)
+
+    Argument :
+        - nb : entier, nombre de feuilles à sélectionner
+
+    Description :
+        Sélectionne nb feuilles en appliquant une perte virtuelle sur chaque chemin choisi : chaque noeud du chemin
+        compte une visite de plus et une valuation défavorable au joueur qui l'a choisi, ce qui écarte les descentes
+        suivantes des chemins déjà pris. Les feuilles sont évaluées en un seul appel au réseau de neurones, puis on
+        retire la perte virtuelle avant de développer chaque feuille et de rétropropager sa valuation.
+    '''
+
+    def batch_simulation(self, nb):
+
+        leaves, positions = self.select_batch(nb)
+
+        if len(positions) > 0:
+            self.expand_batch(leaves, self.evaluate(positions)) # un seul appel au réseau de neurones pour tout le lot
+
+        return
+
+    '''
+    Fonctions select_batch(mcts_nn(), nb) et expand_batch(mcts_nn(), leaves, results)
+
+    Description :
+        Les deux moitiés de batch_simulation, séparées pour qu'un même appel au réseau de neurones puisse servir à
+        plusieurs recherches (cf selfplay.py). select_batch renvoie les feuilles distinctes et non terminales
+        sélectionnées et leurs positions (la perte virtuelle est déjà retirée), expand_batch les développe avec les
+        résultats de evaluate et rétropropage leurs valuations.
+    '''
+
+    def select_batch(self, nb):
+
+        leaves, positions, paths, signs = [], [], [], []
+
+        for i in range(nb):
+
+            leaf = self.selection()
+            path, sign = self.add_virtual_loss(leaf)
+
+            paths.append(path)
+            signs.append(sign)
+
+            start = self.clock()
+            if leaf not in leaves and self.current_position.outcome() is None: # une feuille choisie deux fois n'est évaluée qu'une fois
+                leaves.append(leaf)
+                positions.append(self.current_position)
+            if self.profiler is not None:
+                self.profiler.add("movegen", start)
+
+            self.current_position = self.initial_position.copy()
+
+        for path, sign in zip(paths, signs): # on retire la perte virtuelle
+            self.remove_virtual_loss(path, sign)
+
+        return leaves, positions
+
+    def expand_batch(self, leaves, results):
+
+        for k, (leaf, (legal_moves, prior, v)) in enumerate(zip(leaves, results)):
+            self.expansion(leaf, legal_moves, prior, leaves[k+1:])
+            self.backprop(leaf, v)
+
+        return
+
+    '''
+    Fonction simulate(mcts_nn(), nb_simul)
+
+    Argument :
+        - nb_simul : entier, nombre de simulations à effectuer
+
+    Description :
+        Effectue nb_simul simulations, une par une si batch_size vaut 1, par lots de batch_size feuilles sinon.
+        Avec un profiler, chaque simulation ou lot est compté et l'instantané périodique éventuel est envoyé (cf
+        search_profiler.tick).
+    '''
+
+    def simulate(self, nb_simul):
+
+        if self.batch_size == 1:
+
+            for i in range(nb_simul):
+                self.expansion_backprop(self.selection())
+                if self.profiler is not None:
+                    self.profiler.tick(self)
+
+        else:
+
+            for i in range(0, nb_simul, self.batch_size):
+                nb = min(self.batch_size, nb_simul - i)
+                self.batch_simulation(nb)
+                if self.profiler is not None:
+                    self.profiler.tick(self, nb)
+
+        return
+
+    '''
+    Fonction search(mcts_nn(), max_time, max_nodes, extension, stability, window)
+
+    Arguments :
+        - max_time : réel ou None, temps alloué à la recherche en secondes
+        - max_nodes : entier ou None, nombre maximal de simulations (au moins l'un des deux budgets est nécessaire)
+        - extension : réel, facteur par lequel les budgets peuvent être prolongés si le meilleur coup est instable
+        - stability : réel, variation maximale de la part des visites du meilleur coup pour le considérer stable
+        - window : réel, fraction des dernières simulations sur laquelle on mesure la stabilité
+
+    Sortie :
+        - dictionnaire : simulations effectuées, durée, raison de l'arrêt ("decided" : le coup le plus visité ne peut
+          plus être rattrapé, "budget" : budget épuisé, "extended" : budget prolongé épuisé), part des visites du
+          meilleur coup
+
+    Description :
+        Effectue des simulations (par lots de batch_size) jusqu'à épuisement du budget. Après chaque lot, on estime
+        le nombre de simulations restantes (budget de noeuds restant, et temps restant multiplié par la vitesse
+        observée) : si l'écart de visites entre les deux enfants les plus visités de la racine est plus grand, le
+        coup joué ne peut plus changer et on s'arrête. Quand le budget est épuisé alors que le meilleur coup a
+        changé ou que sa part des visites a varié de plus de stability pendant les window dernières simulations,
+        les budgets sont multipliés par extension et la recherche continue jusqu'à ce que le meilleur coup soit
+        stable.
+    '''
+
+    def search(self, max_time=None, max_nodes=None, extension=2., stability=0.05, window=0.2):
+
+        if max_time is None and max_nodes is None:
+            raise ValueError("search needs a time budget, a node budget or both")
+
+        start = time.perf_counter()
+        done = 0
+        history = [] # (simulations, meilleur enfant de la racine, part de ses visites)
+        extended = False
+        reason = "budget"
+
+        while self.initial_position.outcome() is None:
+
+            factor = extension if extended else 1.
+            nb = self.batch_size if max_nodes is None else max(1, min(self.batch_size, int(factor * max_nodes) - done))
+            self.simulate(nb)
+            done += nb
+            elapsed = time.perf_counter() - start
+
+            moves, N, V = self.root_stats()
+            N = np.asarray(N)
+            best = int(np.argmax(N))
+            history.append((done, best, float(N[best] / max(N.sum(), 1))))
+
+            remaining = float("inf") # estimation du nombre de simulations restantes
+            if max_nodes is not None:
+                remaining = factor * max_nodes - done
+            if max_time is not None:
+                remaining = min(remaining, done / elapsed * (factor * max_time - elapsed))
+
+            recent = [share for d, b, share in history if d >= (1 - window) * done]
+            stable = all(b == best for d, b, share in history if d >= (1 - window) * done) and max(recent) - min(recent) <= stability
+
+            if remaining <= 0: # budget épuisé
+                if extended or stable or extension <= 1:
+                    break
+                extended = True # meilleur coup instable : on prolonge la recherche
+                reason = "extended"
+
+            elif len(N) < 2 or N[best] - np.partition(N, -2)[-2] > remaining: # le meilleur coup ne peut plus être rattrapé
+                reason = "decided"
+                break
+
+            elif extended and stable:
+                break
+
+        return {"simulations": done, "seconds": time.perf_counter() - start, "stopped": reason,
+                "best_share": history[-1][2] if history else 0.}
+
+    '''
+    Fonction snapshot(mcts_nn())
+
+    Sortie :
+        - statistiques de l'arbre (cf profiler.tree_stats), avec les temps des phases de la recherche si elle a un
+          profiler (cf search_profiler.snapshot)
+    '''
+
+    def snapshot(self):
+
+        if self.profiler is not None:
+            return self.profiler.snapshot(self)
+
+        return {"tree": tree_stats(self)}
+
+    '''
+    Fonction update_root(mcts_nn(), position)
+
+    Argument :
+        - position : chess.Board(), nouvelle position dans laquelle on est réellement
+
+    Description :
+        Si position s'obtient en jouant des coups depuis initial_position (par exemple notre coup puis la réponse
+        de l'adversaire), le noeud correspondant devient la nouvelle racine : on conserve son sous-arbre et les
+        visites déjà effectuées, le reste de l'arbre est libéré. Sinon on repart d'un arbre vide.
+        Le bruit de Dirichlet est tiré à nouveau pour les enfants de la nouvelle racine.
+    '''
+
+    def update_root(self, position):
+
+        tree = self.tree
+        board = position.copy()
+        moves = []
+
+        while len(board.move_stack) > len(self.initial_position.move_stack): # coups joués depuis initial_position
+            moves.insert(0, board.pop())
+
+        node = self.root
+
+        if board != self.initial_position or board.move_stack != self.initial_position.move_stack:
+            node = None
+
+        for move in moves:
+
+            if node is None:
+                break
+
+            children = tree.children(node)
+            index = np.flatnonzero(tree.move[children] == encode_move(move))
+            node = children[index[0]] if len(index) > 0 else None # noeud correspondant au coup joué, s'il existe
+
+        if node is None:
+            self.tree = tree_nn(max_nodes=tree.max_nodes)
+
+        else:
+            self.tree = tree.subtree(node)
+
+        self.root = 0
+        self.initial_position = position.copy()
+        self.current_position = position.copy()
+        self.add_root_noise()
+
+        return
+
+    '''
+    Fonction add_root_noise(mcts_nn())
+
+    Description :
+        Tire un nouveau bruit de Dirichlet pour les enfants de la racine, à partir des probabilités du réseau de neurones.
+    '''
+
+    def add_root_noise(self):
+
+        tree = self.tree
+        children = tree.children(self.root)
+
+        if len(children) > 0:
+            dirichlet_noise = dirichlet([0.03]*len(children))
+            tree.prob[children] = 0.75 * tree.prior[children] + 0.25 * dirichlet_noise
+
+        return
+
+    '''
+    Fonction root_stats(mcts_nn())
+
+    Sorties :
+        - coups jouables à la racine, nombres de visites et sommes des valuations (perspective des blancs) correspondants
+    '''
 
-            for ancestor in leaf.iter_path_reverse(): # rétropropagation de la valuation
-                ancestor.N += 1 # mise à jour du nombre de visites des ancêtres
-                ancestor.V += v # mise à jour des valuations des ancêtres
+    def root_stats(self):
 
-        self.current_position = self.initial_position.copy() # on initialise la position courante 
+        children = self.tree.children(self.root)
 
-        return 
\ No newline at end of file
+        return [self.tree.get_move(child) for child in children], self.tree.N[children], self.tree.V[children]
@@ -0,0 +1,309 @@
+import threading
+import queue
+import time
+from MCTS_nn import * # recherche arborescente Monte Carlo guidée par le réseau de neurones
+
+
+'''
+MCTS_threads.py
+
+Contient les classes shared_evaluator et mcts_nn_threaded qui permettent à plusieurs threads de parcourir en même
+temps un même arbre tree_nn().
+
+Chaque thread sélectionne une feuille en appliquant une perte virtuelle sur son chemin, confie la position à
+l'évaluateur partagé puis développe la feuille et rétropropage sa valuation. Les lectures et écritures de l'arbre
+(sélection, perte virtuelle, expansion, rétropropagation) sont de courtes opérations numpy protégées par un seul
+verrou ; l'appel au réseau de neurones, qui libère le GIL, est fait en dehors du verrou par l'évaluateur, qui
+regroupe les positions de tous les threads en un seul lot.
+
+Le verrou est volontairement global et non par noeud : ces opérations sont du code python qui garde le GIL, des
+verrous plus fins ne les feraient pas s'exécuter en parallèle et ajouteraient le coût de leur acquisition à chaque
+noeud du chemin. La sélection ne peut pas non plus se passer de verrou car tree_nn.grow remplace les tableaux de
+l'arbre un par un pendant une expansion. Le gain des threads vient donc uniquement du recouvrement des appels au
+réseau de neurones et de leur regroupement en lots. Mesures (cf measure_scaling, 1600 simulations, milieu de jeu,
+1 / 2 / 4 / 8 / 16 threads, en simulations par seconde) :
+
+    - évaluateur factice sans latence (benchmark.stub_model) : 1645 / 1417 / 1620 / 1754 / 1957
+    - même évaluateur avec 2 ms de latence par appel, qui libère le GIL comme un GPU : 285 / 451 / 771 / 966 / 1482
+
+Avec 16 threads on atteint environ 90 % de la vitesse sans latence, qui est la limite du code python sur un coeur.
+'''
+
+
+class shared_evaluator():
+
+    '''
+    Classe shared_evaluator
+
+    Thread qui évalue les positions envoyées par les threads de recherche. Il ferme un lot dès qu'il contient
+    max_batch_size positions ou que timeout secondes se sont écoulées depuis la première, puis effectue un seul
+    appel au réseau de neurones (cf mcts_nn.evaluate, qui passe aussi par le cache).
+    '''
+
+    def __init__(self, search, max_batch_size, timeout=0.001):
+
+        self.search = search
+        self.max_batch_size = max_batch_size
+        self.timeout = timeout
+        self.requests = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+
+        self.thread.start()
+
+        return
+
+    def stop(self):
+
+        self.requests.put(None)
+        self.thread.join()
+
+        return
+
+    '''
+    Fonction evaluate(shared_evaluator(), position)
+
+    Sortie :
+        - (coups légaux, probabilités des coups légaux, valuation), dès que le lot contenant position a été évalué
+    '''
+
+    def evaluate(self, position):
+
+        request = {"position": position, "done": threading.Event()}
+        self.requests.put(request)
+        request["done"].wait()
+
+        return request["result"]
+
+    def run(self):
+
+        while True:
+
+            request = self.requests.get()
+
+            if request is None:
+                return
+
+            batch = [request]
+            deadline = time.perf_counter() + self.timeout
+
+            while len(batch) < self.max_batch_size: # on complète le lot jusqu'à la taille maximale ou l'expiration du délai
+
+                try:
+                    request = self.requests.get(timeout=max(0., deadline - time.perf_counter()))
+                except queue.Empty:
+                    break
+
+                if request is None:
+                    self.requests.put(None) # on termine après avoir évalué le lot en cours
+                    break
+
+                batch.append(request)
+
+            results = self.search.evaluate([request["position"] for request in batch])
+
+            for request, result in zip(batch, results):
+                request["result"] = result
+                request["done"].set()
+
+
+
+
+
+class mcts_nn_threaded(mcts_nn):
+
+    '''
+    Classe mcts_nn_threaded
+
+    Recherche de mcts_nn effectuée par nb_threads threads qui partagent le même arbre. En plus des attributs de
+    mcts_nn, elle est caractérisée par 4 attributs :
+
+        - nb_threads : entier, nombre de threads de recherche
+        - deterministic : booléen, si vrai les threads avancent à tour de rôle par rondes (pour le débogage) : les
+                          sélections se font dans l'ordre des threads, le dernier évalue le lot de la ronde, puis
+                          les rétropropagations se font dans le même ordre. Avec des graines fixées
+                          (random.seed, np.random.seed) deux recherches donnent alors le même arbre.
+        - timeout : réel, délai maximal (en secondes) d'attente de l'évaluateur partagé pour compléter un lot
+        - lock : verrou unique qui protège l'arbre (sélection et perte virtuelle, puis expansion et rétropropagation)
+    '''
+
+    def __init__(self,position,nb_threads=4,virtual_loss=1,deterministic=False,timeout=0.001,model=None,cache=None,digest=None):
+
+        super().__init__(position, batch_size=nb_threads, virtual_loss=virtual_loss, model=model, cache=cache, digest=digest)
+        self.nb_threads = nb_threads
+        self.deterministic = deterministic
+        self.timeout = timeout
+        self.lock = threading.Lock()
+
+    def simulate(self, nb_simul):
+
+        if self.deterministic:
+            self.turn = threading.Condition()
+            self.state = (0, "selection", 0) # (ronde, phase, thread dont c'est le tour)
+            self.round_requests = [None] * self.nb_threads
+            workers = [threading.Thread(target=self.deterministic_worker, args=(i, nb_simul)) for i in range(self.nb_threads)]
+
+        else:
+            self.remaining = nb_simul
+            evaluator = shared_evaluator(self, self.nb_threads, self.timeout)
+            evaluator.start()
+            workers = [threading.Thread(target=self.worker, args=(evaluator,)) for i in range(self.nb_threads)]
+
+        for worker in workers:
+            worker.start()
+
+        for worker in workers:
+            worker.join()
+
+        if not self.deterministic:
+            evaluator.stop()
+
+        return
+
+    '''
+    Fonctions select_leaf(mcts_nn_threaded(), position) et update_leaf(mcts_nn_threaded(), leaf, path, sign, result)
+
+    Description :
+        select_leaf sélectionne une feuille en parcourant position et applique la perte virtuelle sur son chemin.
+        update_leaf retire la perte virtuelle puis développe la feuille (si un autre thread ne l'a pas déjà fait)
+        et rétropropage sa valuation. Ces deux fonctions doivent être appelées avec le verrou.
+    '''
+
+    def select_leaf(self, position):
+
+        leaf = self.selection(position)
+        path, sign = self.add_virtual_loss(leaf)
+
+        return leaf, path, sign
+
+    def update_leaf(self, leaf, path, sign, result):
+
+        self.remove_virtual_loss(path, sign)
+
+        if result is not None:
+            legal_moves, prior, v = result
+            if self.tree.is_leaf(leaf):
+                self.expansion(leaf, legal_moves, prior)
+            self.backprop(leaf, v)
+
+        return
+
+    def reset_position(self, position):
+
+        while len(position.move_stack) > len(self.initial_position.move_stack):
+            position.pop()
+
+        return
+
+    def worker(self, evaluator):
+
+        position = self.initial_position.copy()
+
+        while True:
+
+            with self.lock:
+
+                if self.remaining == 0:
+                    return
+
+                self.remaining -= 1
+                leaf, path, sign = self.select_leaf(position)
+
+            if position.outcome() is None: # l'évaluation se fait sans le verrou
+                result = evaluator.evaluate(position)
+            else:
+                result = None
+
+            with self.lock:
+                self.update_leaf(leaf, path, sign, result)
+
+            self.reset_position(position)
+
+    '''
+    Fonctions wait_turn(mcts_nn_threaded(), state) et next_turn(mcts_nn_threaded(), nb_active)
+
+    Description :
+        wait_turn attend que ce soit le tour state = (ronde, phase, thread), next_turn passe au thread suivant
+        de la ronde une fois l'opération effectuée (cf deterministic_worker).
+    '''
+
+    def wait_turn(self, state):
+
+        with self.turn:
+            self.turn.wait_for(lambda: self.state == state)
+
+        return
+
+    def next_turn(self, nb_active):
+
+        with self.turn:
+
+            round_index, phase, thread = self.state
+
+            if thread + 1 < nb_active:
+                self.state = (round_index, phase, thread + 1)
+            elif phase == "selection":
+                self.state = (round_index, "backprop", 0)
+            else:
+                self.state = (round_index + 1, "selection", 0)
+
+            self.turn.notify_all()
+
+        return
+
+    def deterministic_worker(self, index, nb_simul):
+
+        position = self.initial_position.copy()
+        round_index = 0
+
+        while round_index * self.nb_threads + index < nb_simul: # ce thread participe à la ronde
+
+            nb_active = min(self.nb_threads, nb_simul - round_index * self.nb_threads)
+
+            self.wait_turn((round_index, "selection", index))
+            leaf, path, sign = self.select_leaf(position)
+            self.round_requests[index] = (leaf, path, sign, position if position.outcome() is None else None)
+
+            if index == nb_active - 1: # le dernier thread de la ronde évalue les positions de tous les threads
+                requests = self.round_requests[:nb_active]
+                positions = [request[3] for request in requests if request[3] is not None]
+                results = iter(self.evaluate(positions))
+                self.round_results = [next(results) if request[3] is not None else None for request in requests]
+
+            self.next_turn(nb_active)
+
+            self.wait_turn((round_index, "backprop", index))
+            self.update_leaf(leaf, path, sign, self.round_results[index])
+            self.reset_position(position)
+            self.next_turn(nb_active)
+
+            round_index += 1
+
+        return
+
+
+'''
+Fonction measure_scaling(position, nb_simul, threads, **options)
+
+Arguments :
+    - position : chess.Board(), position analysée
+    - nb_simul : entier, nombre de simulations de chaque recherche
+    - threads : nombres de threads à tester
+    - options : arguments supplémentaires de mcts_nn_threaded (model, cache, virtual_loss, ...)
+
+Sortie :
+    - dictionnaire nombre de threads -> simulations par seconde
+'''
+
+def measure_scaling(position, nb_simul=800, threads=(1, 2, 4, 8, 16), **options):
+
+    speeds = {}
+
+    for nb_threads in threads:
+        search = mcts_nn_threaded(position, nb_threads=nb_threads, **options)
+        start = time.perf_counter()
+        search.simulate(nb_simul)
+        speeds[nb_threads] = nb_simul / (time.perf_counter() - start)
+
+    return speeds
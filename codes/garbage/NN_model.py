@@ -16,7 +16,8 @@ from keras.layers.merge import Add
 from keras.layers.normalization import BatchNormalization
 from keras.regularizers import l2
 
-from chess_zero.agent.api_chess import ChessModelAPI
+from api_chess import ChessModelAPI
+from shm_transport import SharedMemoryModelAPI
 from chess_zero.config import Config
 
 # noinspection PyPep8Naming
@@ -34,12 +35,14 @@ class ChessModel:
         :ivar Model model: the Keras model to use for predictions
         :ivar digest: basically just a hash of the file containing the weights being used by this model
         :ivar ChessModelAPI api: the api to use to listen for and then return this models predictions (on a pipe).
+        :ivar SharedMemoryModelAPI shm_api: the api answering the workers that use shared memory
     """
     def __init__(self, config: Config):
         self.config = config
         self.model = None  # type: Model
         self.digest = None
         self.api = None
+        self.shm_api = None
 
     def get_pipes(self, num = 1):
         """
@@ -54,6 +57,20 @@ class ChessModel:
             self.api.start()
         return [self.api.create_pipe() for _ in range(num)]
 
+    def get_shared_memory_clients(self, num = 1, slots_per_worker = 64):
+        """
+        Same as get_pipes, but the planes, policies and values are exchanged through shared memory and only
+        slot numbers travel over the pipes.
+
+        :param int num: number of clients to create
+        :param int slots_per_worker: largest number of positions a client can send at once
+        :return list(SharedMemoryModel): models to hand to the self-play workers
+        """
+        if self.shm_api is None:
+            self.shm_api = SharedMemoryModelAPI(self, nb_workers=num, slots_per_worker=slots_per_worker)
+            self.shm_api.start()
+        return [self.shm_api.create_client() for _ in range(num)]
+
     def build(self):
         """
         Builds the full Keras model and stores it in self.model.
@@ -0,0 +1,201 @@
+"""
+Defines the process which will listen on the pipe for
+an observation of the game state and return the predictions from the policy and
+value networks.
+"""
+import time
+from collections import Counter, deque
+from logging import getLogger
+from multiprocessing import connection, Pipe
+from threading import Event, Lock, Thread
+
+import numpy as np
+
+logger = getLogger(__name__)
+
+
+class ChessModelAPI:
+    """
+    Answers prediction requests coming from many self-play workers with dynamic batches: a batch is closed
+    as soon as it holds max_batch_size requests or its oldest request has waited timeout seconds, then the
+    model is run once on the whole batch and every result is sent back on the pipe it came from.
+
+    A request is either an (18, 8, 8) array of input planes (see utils.format_input_NN), answered with a
+    (policy, value) tuple, or an (n, 18, 8, 8) array of n positions, answered with a (policies, values) tuple of
+    (n, 1968) and (n,) arrays. Batch sizes and thresholds are counted in positions.
+
+    Attributes:
+        :ivar ChessModel agent_model: ChessModel whose Keras model makes the predictions
+        :ivar int max_batch_size: largest number of requests predicted together
+        :ivar float timeout: longest time in seconds a request waits for its batch to fill up
+        :ivar list(Connection) pipes: server ends of the pipes created by create_pipe
+        :ivar deque pending: received requests waiting for a batch, as (pipe, planes, arrival time)
+        :ivar Counter batch_sizes: histogram of the sizes of the predicted batches
+        :ivar deque latencies: time between arrival and answer of the most recent requests
+        :ivar deque queue_depths: number of requests waiting when each of the most recent batches was closed
+    """
+    def __init__(self, agent_model, max_batch_size=256, timeout=0.005, history=10000):
+        self.agent_model = agent_model
+        self.max_batch_size = max_batch_size
+        self.timeout = timeout
+        self.pipes = []
+        self.pending = deque()
+        self.batch_sizes = Counter()
+        self.latencies = deque(maxlen=history)
+        self.queue_depths = deque(maxlen=history)
+        self.queue_depth = 0 # positions waiting in pending, recorded by the batching thread (only it touches pending)
+        self.pipes_lock = Lock()
+        self.stats_lock = Lock()
+        self.stopped = Event()
+        self.prediction_worker = None
+
+    def start(self):
+        """
+        Starts a thread to listen on the pipes and make predictions
+        """
+        self.prediction_worker = Thread(target=self._predict_batch_worker, name="prediction_worker")
+        self.prediction_worker.daemon = True
+        self.prediction_worker.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.prediction_worker is not None:
+            self.prediction_worker.join()
+
+    def create_pipe(self):
+        """
+        Creates a new two-way pipe and returns the connection to one end of it (the other will be used
+        by this class)
+        :return Connection: the other end of this pipe.
+        """
+        me, you = Pipe()
+        with self.pipes_lock:
+            self.pipes.append(me)
+        return you
+
+    def _collect(self, timeout):
+        """
+        Waits at most timeout seconds for requests and moves every available one to the pending queue.
+        """
+        with self.pipes_lock:
+            pipes = list(self.pipes)
+        if not pipes:
+            time.sleep(timeout)
+            return
+        for pipe in connection.wait(pipes, timeout=timeout):
+            try:
+                while pipe.poll():
+                    self.pending.append((pipe, pipe.recv(), time.perf_counter()))
+            except (EOFError, OSError): # the worker closed its end
+                with self.pipes_lock:
+                    self.pipes.remove(pipe)
+
+    def _predict_batch_worker(self):
+        """
+        Thread worker which listens on each pipe in self.pipes for an observation, and then outputs
+        the predictions for the policy and value networks when the observations come in. Repeats.
+        """
+        while not self.stopped.is_set():
+            if not self.pending:
+                self._collect(timeout=0.001)
+                self._record_queue_depth()
+                continue
+
+            deadline = self.pending[0][2] + self.timeout
+            while self._pending_size() < self.max_batch_size and time.perf_counter() < deadline:
+                self._collect(timeout=deadline - time.perf_counter())
+                self._record_queue_depth()
+
+            queue_depth = self._pending_size()
+            batch = [self.pending.popleft()]
+            while self.pending and self._size(batch) + self._size([self.pending[0]]) <= self.max_batch_size:
+                batch.append(self.pending.popleft())
+            self._record_queue_depth()
+
+            self._predict(batch)
+
+            done = time.perf_counter()
+            with self.stats_lock:
+                self.batch_sizes[self._size(batch)] += 1
+                self.queue_depths.append(queue_depth)
+                self.latencies.extend(done - arrival for pipe, request, arrival in batch)
+
+    def _size(self, requests):
+        """
+        :return int: number of positions to predict for these requests
+        """
+        return sum(1 if np.ndim(planes) == 3 else len(planes) for pipe, planes, arrival in requests)
+
+    def _pending_size(self):
+        return self._size(self.pending)
+
+    def _record_queue_depth(self):
+        """
+        Called by the batching thread after each change of pending, so that stats never iterates over the deque
+        """
+        depth = self._pending_size()
+        with self.stats_lock:
+            self.queue_depth = depth
+
+    def _predict(self, batch):
+        """
+        Runs the model once on the planes of every request of the batch and answers each request on its pipe.
+        """
+        data = np.concatenate([np.asarray(planes, dtype=np.float32).reshape(-1, 18, 8, 8) for pipe, planes, arrival in batch])
+        policy_ary, value_ary = self.agent_model.model.predict_on_batch(data)
+        value_ary = np.asarray(value_ary).reshape(-1)
+
+        start = 0
+        for pipe, planes, arrival in batch:
+            if np.ndim(planes) == 3:
+                self._send(pipe, (policy_ary[start], float(value_ary[start])))
+                start += 1
+            else:
+                self._send(pipe, (policy_ary[start:start + len(planes)], value_ary[start:start + len(planes)]))
+                start += len(planes)
+
+    def _send(self, pipe, message):
+        try:
+            pipe.send(message)
+        except (BrokenPipeError, OSError):
+            logger.debug("worker closed its pipe before receiving its prediction")
+
+    def stats(self):
+        """
+        :return dict: current queue depth (in positions), histogram of batch sizes, and percentiles of the queue depth
+            and of the latency (in milliseconds) over the most recent batches
+        """
+        with self.stats_lock:
+            latencies = np.array(self.latencies) * 1000
+            depths = np.array(self.queue_depths)
+            batch_sizes = dict(sorted(self.batch_sizes.items()))
+            queue_depth = self.queue_depth
+        percentiles = (50, 90, 99)
+        return {
+            "queue_depth": queue_depth, # in positions, like the batch thresholds
+            "batch_sizes": batch_sizes,
+            "mean_batch_size": sum(k * n for k, n in batch_sizes.items()) / max(1, sum(batch_sizes.values())),
+            "queue_depth_percentiles": {p: float(np.percentile(depths, p)) for p in percentiles} if len(depths) else {},
+            "latency_ms_percentiles": {p: float(np.percentile(latencies, p)) for p in percentiles} if len(latencies) else {},
+        }
+
+
+class PipeModel:
+    """
+    Stands for the Keras model inside a self-play worker process (for instance mcts_nn(position, model=PipeModel(pipe))):
+    predict sends all its inputs as a single request on a pipe returned by ChessModel.get_pipes and waits for the
+    answer. One message each way means the worker never blocks in send while the server blocks answering it,
+    whatever the number of positions compared to max_batch_size.
+
+    Attributes:
+        :ivar Connection pipe: worker end of a pipe created by ChessModelAPI.create_pipe
+    """
+    def __init__(self, pipe):
+        self.pipe = pipe
+
+    def predict(self, data):
+        if len(data) == 0:
+            return np.zeros((0, 1968), dtype=np.float32), np.zeros((0, 1), dtype=np.float32)
+        self.pipe.send(np.asarray(data, dtype=np.float32).reshape(-1, 18, 8, 8))
+        policy, value = self.pipe.recv()
+        return np.asarray(policy), np.asarray(value, dtype=np.float32).reshape(-1, 1)
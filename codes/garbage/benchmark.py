@@ -0,0 +1,273 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+import numpy as np
+import chess
+
+
+'''
+benchmark.py
+
+Mesure les performances des parties critiques du code sur un ensemble fixe de positions de test :
+
+    - encodage d'une position : utils.format_input_NN et chess_env.canon_input_planes (microsecondes par position)
+    - évaluation par le réseau de neurones : nn.evaluate_position / nn.evaluate_positions pour plusieurs tailles de
+      lots (positions par seconde)
+    - recherche : simulations par seconde de mcts_nn et de mcts (parties aléatoires), et mémoire maximale de l'arbre
+
+Les résultats sont écrits en json et peuvent être comparés à une référence (baseline) : si une mesure est moins
+bonne que la référence de plus de threshold (10 % par défaut), le programme se termine avec le code 1.
+
+Sans GPU ni poids du réseau, on utilise stub_model, un évaluateur factice qui a la même interface que le modèle
+keras : les mesures du réseau ne veulent alors rien dire mais tout le reste (encodage, recherche) est mesuré.
+
+    python benchmark.py --output results.json --baseline baseline.json
+    python benchmark.py --model numpy --config ../model_config.json --weights model_weights.h5
+'''
+
+test_positions = [
+    chess.STARTING_FEN,
+    "r1bqkbnr/pppp1ppp/2n5/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R w KQkq - 2 3", # ouverture
+    "r1bq1rk1/pp2bppp/2n1pn2/3p4/2PP4/2N1PN2/PP3PPP/R2QKB1R w KQ - 0 9", # milieu de jeu
+    "r2q1rk1/1b2bppp/p2ppn2/1p6/3NP3/1BN1B3/PPP2PPP/R2Q1RK1 b - - 0 12", # milieu de jeu, trait aux noirs
+    "rnbqkbnr/ppp1p1pp/8/3pPp2/8/8/PPPP1PPP/RNBQKBNR w KQkq f6 0 3", # prise en passant possible
+    "8/5pk1/6p1/8/3R4/6P1/5PK1/2r5 w - - 10 45", # finale de tours
+    "8/8/4k3/8/2P5/8/4K3/8 b - - 0 60", # finale de pions
+    "6k1/5ppp/8/8/8/8/5PPP/3Q2K1 w - - 0 30", # mat en un
+]
+
+
+class stub_model():
+
+    '''
+    Classe stub_model
+
+    Évaluateur factice : politique et valuation déterministes calculées à partir des plans d'entrée, en un temps
+    négligeable. Il a les fonctions predict et predict_on_batch du modèle keras.
+    '''
+
+    def predict(self, x, batch_size=None):
+
+        n = len(x)
+        s = np.asarray(x).reshape(n, -1).sum(axis=1)
+        p = np.abs(np.sin(np.arange(1968)[None, :] * (1 + s[:, None] % 7))) + 0.01
+        p = p / p.sum(axis=1, keepdims=True)
+        v = np.tanh(np.cos(s))[:, None]
+
+        return p.astype(np.float32), v.astype(np.float32)
+
+    def predict_on_batch(self, x):
+
+        return self.predict(x)
+
+
+def timed(function, repeat):
+
+    '''
+    Sortie : meilleur temps (en secondes) d'un appel de function sur repeat appels
+    '''
+
+    best = float("inf")
+
+    for i in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+
+    return best
+
+
+def bench_encoding(boards, repeat):
+
+    from utils import format_input_NN, format_inputs_NN
+    from chess_env import canon_input_planes
+
+    fens = [board.fen() for board in boards]
+    n = len(boards)
+
+    return {
+        "format_input_NN_us": (timed(lambda: [format_input_NN(board) for board in boards], repeat) / n * 1e6, "us/position", False),
+        "format_inputs_NN_batch_us": (timed(lambda: format_inputs_NN(boards), repeat) / n * 1e6, "us/position", False),
+        "canon_input_planes_us": (timed(lambda: [canon_input_planes(fen) for fen in fens], repeat) / n * 1e6, "us/position", False),
+    }
+
+
+def bench_evaluation(model, boards, batch_sizes, repeat):
+
+    from nn import evaluate_position, evaluate_positions
+
+    results = {}
+
+    for batch_size in batch_sizes:
+
+        batch = [boards[i % len(boards)] for i in range(batch_size)]
+
+        if batch_size == 1:
+            seconds = timed(lambda: evaluate_position(model, batch[0]), repeat)
+        else:
+            seconds = timed(lambda: evaluate_positions(model, batch), repeat)
+
+        results[f"evaluate_batch_{batch_size}_pos_per_s"] = (batch_size / seconds, "positions/s", True)
+
+    return results
+
+
+def bench_search(model, boards, nb_simul, nb_rollout_simul, batch_size):
+
+    from MCTS_nn import mcts_nn
+    from MCTS import mcts
+
+    results = {}
+    seconds, peak_bytes, nodes = 0., 0, 0
+
+    for board in boards:
+        if board.outcome() is not None:
+            continue
+        search = mcts_nn(board, batch_size=batch_size, model=model)
+        start = time.perf_counter()
+        search.simulate(nb_simul)
+        seconds += time.perf_counter() - start
+        peak_bytes = max(peak_bytes, search.tree.nbytes())
+        nodes = max(nodes, search.tree.size)
+
+    nb = sum(board.outcome() is None for board in boards)
+    results["mcts_nn_simul_per_s"] = (nb * nb_simul / seconds, "simulations/s", True)
+    results["mcts_nn_peak_tree_bytes"] = (peak_bytes, "bytes", False)
+    results["mcts_nn_peak_tree_nodes"] = (nodes, "nodes", None)
+
+    seconds = 0.
+    for board in boards:
+        if board.outcome() is not None:
+            continue
+        search = mcts(board)
+        start = time.perf_counter()
+        search.simulate(nb_rollout_simul)
+        seconds += time.perf_counter() - start
+
+    results["mcts_simul_per_s"] = (nb * nb_rollout_simul / seconds, "simulations/s", True)
+
+    # mémoire maximale de l'arbre de mcts (objets python) : mesurée à part, tracemalloc ralentit le code
+    tracemalloc.start()
+    search = mcts(boards[0])
+    search.simulate(nb_rollout_simul)
+    results["mcts_peak_tree_bytes"] = (tracemalloc.get_traced_memory()[1], "bytes", False)
+    tracemalloc.stop()
+
+    return results
+
+
+'''
+Fonction compare(results, baseline, threshold)
+
+Sortie :
+    - liste des régressions (nom, valeur, référence, écart relatif) : mesures moins bonnes que la référence de plus
+      de threshold (une mesure dont le sens n'est pas défini n'est pas comparée)
+'''
+
+def compare(results, baseline, threshold):
+
+    regressions = []
+
+    for name, entry in results["results"].items():
+
+        reference = baseline["results"].get(name)
+
+        if reference is None or entry["higher_is_better"] is None or reference["value"] == 0:
+            continue
+
+        change = (entry["value"] - reference["value"]) / abs(reference["value"])
+        if entry["higher_is_better"]:
+            change = -change
+
+        if change > threshold:
+            regressions.append((name, entry["value"], reference["value"], change))
+
+    return regressions
+
+
+def run(model_name="stub", config_path=None, weight_path=None, batch_sizes=(1, 8, 32, 128), nb_simul=200,
+        nb_rollout_simul=50, batch_size=8, repeat=5, skip=()):
+
+    if model_name == "stub":
+        model = stub_model()
+    else:
+        from nn import load_model
+        model = load_model(config_path, weight_path, engine=model_name)
+
+    boards = [chess.Board(fen) for fen in test_positions]
+    results = {}
+
+    if "encoding" not in skip:
+        results.update(bench_encoding(boards, repeat))
+    if "evaluation" not in skip:
+        results.update(bench_evaluation(model, boards, batch_sizes, repeat))
+    if "search" not in skip:
+        results.update(bench_search(model, boards, nb_simul, nb_rollout_simul, batch_size))
+
+    return {"meta": {"model": model_name, "python": sys.version.split()[0], "numpy": np.__version__,
+                     "platform": platform.platform(), "cpu_count": os.cpu_count(), "nb_simul": nb_simul,
+                     "nb_rollout_simul": nb_rollout_simul, "batch_size": batch_size,
+                     "time": time.strftime("%Y-%m-%d %H:%M:%S")},
+            "results": {name: {"value": float(value), "unit": unit, "higher_is_better": higher}
+                        for name, (value, unit, higher) in results.items()}}
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description="Mesures de performance (encodage, réseau, recherche)")
+    parser.add_argument("--model", choices=("stub", "keras", "numpy"), default="stub", help="stub : évaluateur factice, sans poids")
+    parser.add_argument("--config", default=None, help="model_config.json (modèles keras et numpy)")
+    parser.add_argument("--weights", default=None, help="fichier de poids (modèles keras et numpy)")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32, 128])
+    parser.add_argument("--simul", type=int, default=200, help="simulations de mcts_nn par position")
+    parser.add_argument("--rollout-simul", type=int, default=50, help="simulations de mcts par position")
+    parser.add_argument("--search-batch", type=int, default=8, help="batch_size de mcts_nn")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--skip", nargs="*", default=[], choices=("encoding", "evaluation", "search"))
+    parser.add_argument("--output", default=None, help="fichier json des résultats")
+    parser.add_argument("--baseline", default=None, help="résultats de référence (json)")
+    parser.add_argument("--threshold", type=float, default=0.10, help="régression relative tolérée")
+    parser.add_argument("--save-baseline", action="store_true", help="écrit les résultats dans --baseline")
+    args = parser.parse_args(argv)
+
+    if args.model != "stub" and (args.config is None or args.weights is None):
+        parser.error("--config et --weights sont nécessaires avec un vrai réseau")
+
+    results = run(args.model, args.config, args.weights, args.batch_sizes, args.simul, args.rollout_simul,
+                  args.search_batch, args.repeat, args.skip)
+
+    for name, entry in results["results"].items():
+        print(f"{name:32s} {entry['value']:14.2f} {entry['unit']}")
+
+    if args.output is not None:
+        with open(args.output, "wt") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline is not None and args.save_baseline:
+        with open(args.baseline, "wt") as f:
+            json.dump(results, f, indent=2)
+        return 0
+
+    if args.baseline is not None:
+
+        with open(args.baseline, "rt") as f:
+            baseline = json.load(f)
+
+        regressions = compare(results, baseline, args.threshold)
+
+        for name, value, reference, change in regressions:
+            print(f"REGRESSION {name}: {value:.2f} vs {reference:.2f} ({100 * change:.1f} % worse)")
+
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+
+    sys.exit(main())
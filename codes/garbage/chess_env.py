@@ -8,6 +8,7 @@ import numpy as np
 import copy
 
 from logging import getLogger
+from utils import format_input_NN
 
 logger = getLogger(__name__)
 
@@ -162,7 +163,7 @@ class ChessEnv:
 
         :return: a representation of the board using an (18, 8, 8) shape, good as input to a policy / value network
         """
-        return canon_input_planes(self.board.fen())
+        return format_input_NN(self.board) # same planes as canon_input_planes(self.board.fen()), read from the bitboards
 
     def testeval(self, absolute=False) -> float:
         return testeval(self.board.fen(), absolute)
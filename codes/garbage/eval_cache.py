@@ -0,0 +1,175 @@
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+import chess
+import chess.polyglot # hash de Zobrist des positions
+
+
+'''
+eval_cache.py
+
+Contient la classe eval_cache, un cache des évaluations du réseau de neurones. Une même position revient
+souvent (transpositions dans une recherche, d'un coup à l'autre et d'une partie à l'autre en self-play),
+on évite ainsi de la réévaluer.
+
+Une entrée est identifiée par le hash de Zobrist de la position et l'empreinte du modèle (cf nn.model_digest).
+Le hash ne tient compte ni du compteur des 50 coups ni de l'historique : deux positions qui ne diffèrent que par
+ces informations partagent la même évaluation.
+'''
+
+MAX_LEGAL_MOVES = 218 # nombre maximal de coups légaux dans une position d'échecs
+
+disk_record = np.dtype([("key", "<u8"), ("digest", "<u8"), ("value", "<f4"), ("nb", "<u2"),
+                        ("prior", "<f2", (MAX_LEGAL_MOVES,))])
+
+
+'''
+Fonction digest_key(digest)
+
+    Convertit l'empreinte hexadécimale d'un modèle en entier 64 bits (0 si le modèle n'a pas d'empreinte).
+'''
+
+def digest_key(digest):
+
+    return int(digest[:16], 16) if digest else 0
+
+
+class eval_cache():
+
+    '''
+    Classe eval_cache
+
+    Cache LRU des évaluations du réseau de neurones. Elle est caractérisée par 7 attributs :
+
+        - max_bytes : entier, mémoire maximale occupée par les entrées
+        - entries : OrderedDict, (hash, empreinte) -> (probabilités des coups légaux en float16, valuation),
+                    de la moins récemment utilisée à la plus récemment utilisée
+        - nbytes : entier, mémoire occupée par les entrées
+        - hits : entier, nombre d'évaluations trouvées dans le cache
+        - misses : entier, nombre d'évaluations absentes du cache
+        - disk : memmap numpy ou None, table sur disque qui survit au redémarrage du processus
+        - lock : verrou, le cache peut être partagé entre plusieurs threads
+
+    Les probabilités ne sont stockées que pour les coups légaux, dans l'ordre de position.legal_moves.
+    '''
+
+    entry_overhead = 200 # estimation de la mémoire occupée par une entrée en plus de ses probabilités
+
+    def __init__(self, max_bytes=256 * 2**20, path=None, nb_disk_slots=2**16):
+
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.disk = None
+        self.lock = threading.Lock()
+
+        if path is not None:
+            if os.path.exists(path):
+                self.disk = np.lib.format.open_memmap(path, mode="r+")
+                assert self.disk.dtype == disk_record, f"{path} is not an evaluation cache"
+            else:
+                self.disk = np.lib.format.open_memmap(path, mode="w+", dtype=disk_record, shape=(nb_disk_slots,))
+
+    '''
+    Fonction get(eval_cache(), position, digest)
+
+    Arguments :
+        - position : chess.Board()
+        - digest : empreinte du modèle
+
+    Sortie :
+        - (probabilités des coups légaux, valuation) ou None si la position n'est pas dans le cache
+    '''
+
+    def get(self, position, digest):
+
+        key = chess.polyglot.zobrist_hash(position)
+
+        with self.lock:
+
+            entry = self.entries.get((key, digest))
+
+            if entry is not None:
+                self.entries.move_to_end((key, digest)) # entrée la plus récemment utilisée
+
+            elif self.disk is not None:
+                record = self.disk[key % len(self.disk)]
+                if record["key"] == key and record["digest"] == digest_key(digest) and record["nb"] > 0:
+                    entry = (record["prior"][:record["nb"]].copy(), float(record["value"]))
+                    self.insert((key, digest), entry)
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+
+            return entry[0].astype(np.float64), entry[1]
+
+    '''
+    Fonction put(eval_cache(), position, digest, prior, v)
+
+    Arguments :
+        - position : chess.Board()
+        - digest : empreinte du modèle
+        - prior : probabilités des coups légaux de position, dans l'ordre de position.legal_moves
+        - v : réel, valuation de position
+    '''
+
+    def put(self, position, digest, prior, v):
+
+        key = chess.polyglot.zobrist_hash(position)
+        entry = (np.asarray(prior, dtype=np.float16), float(v))
+
+        with self.lock:
+
+            self.insert((key, digest), entry)
+
+            if self.disk is not None and len(prior) <= MAX_LEGAL_MOVES:
+                record = self.disk[key % len(self.disk)] # table à correspondance directe : on écrase l'ancienne entrée
+                record["key"] = key
+                record["digest"] = digest_key(digest)
+                record["value"] = v
+                record["nb"] = len(prior)
+                record["prior"][:len(prior)] = entry[0]
+
+        return
+
+    '''
+    Fonction insert(eval_cache(), key, entry)
+
+    Description :
+        Ajoute une entrée puis retire les entrées les moins récemment utilisées tant que la borne mémoire est dépassée.
+    '''
+
+    def insert(self, key, entry):
+
+        if key in self.entries:
+            self.nbytes -= self.entries[key][0].nbytes + self.entry_overhead
+
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        self.nbytes += entry[0].nbytes + self.entry_overhead
+
+        while self.nbytes > self.max_bytes and len(self.entries) > 0:
+            old_key, old_entry = self.entries.popitem(last=False)
+            self.nbytes -= old_entry[0].nbytes + self.entry_overhead
+
+        return
+
+    def flush(self):
+
+        if self.disk is not None:
+            self.disk.flush()
+
+        return
+
+    def stats(self):
+
+        total = self.hits + self.misses
+
+        return {"entries": len(self.entries), "bytes": self.nbytes, "hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / total if total > 0 else 0.}
@@ -0,0 +1,230 @@
+import queue
+import threading
+import time
+import numpy as np
+from records import record_dataset, decode_records, position_record, policy_entry
+
+
+'''
+loader.py
+
+Contient la classe record_loader qui fournit des lots d'entraînement (plans, politiques, valuations) tirés d'un
+jeu de données records.record_dataset, éventuellement beaucoup plus gros que la mémoire.
+
+Les positions sont lues sur le disque par blocs contigus (lecture séquentielle des memmaps), les blocs étant pris
+dans un ordre aléatoire. Elles passent ensuite par un tampon de mélange : chaque position lue prend la place d'une
+position du tampon tirée au hasard, qui part dans le lot en cours. Les lots bruts sont ensuite décodés (bitboards ->
+plans, politiques creuses -> politiques denses) par des threads en arrière-plan, jusqu'à prefetch lots d'avance.
+'''
+
+
+class record_loader():
+
+    '''
+    Classe record_loader
+
+    Itérateur sur des lots (plans (lot, 18, 8, 8), politiques (lot, 1968), valuations (lot,)). Elle est caractérisée
+    par 12 attributs :
+
+        - dataset : record_dataset(), jeu de données lu
+        - batch_size : entier, nombre de positions par lot
+        - shuffle_buffer : entier, taille du tampon de mélange
+        - block_size : entier, nombre de positions consécutives lues à la fois
+        - epochs : entier, nombre de passages sur le jeu de données (None pour ne jamais s'arrêter)
+        - raw : file des lots bruts (position_record, politiques) en attente de décodage
+        - batches : file des lots décodés
+        - samples : entier, nombre de positions fournies
+        - stall_time : réel, temps passé (en secondes) à attendre un lot qui n'était pas encore prêt
+        - stop_event : événement qui arrête les threads (cf close)
+        - nb_workers : entier, nombre de threads de décodage
+        - finished_workers : entier, nombre de threads de décodage dont le signal de fin a été reçu ; quand ils ont
+                             tous terminé, l'itération est finie et chaque appel de __next__ lève StopIteration
+    '''
+
+    def __init__(self, dataset, batch_size=256, shuffle_buffer=2**16, block_size=4096, nb_workers=2, prefetch=4,
+                 epochs=None, seed=None):
+
+        self.dataset = record_dataset(dataset) if isinstance(dataset, str) else dataset
+        if len(self.dataset) == 0: # aucun bloc à lire : sans limite d'époques le lecteur tournerait à vide
+            raise ValueError("the dataset has no records")
+        self.batch_size = batch_size
+        self.shuffle_buffer = max(shuffle_buffer, batch_size)
+        self.block_size = block_size
+        self.epochs = epochs
+        self.rng = np.random.default_rng(seed)
+        self.raw = queue.Queue(maxsize=prefetch)
+        self.batches = queue.Queue(maxsize=prefetch)
+        self.samples = 0
+        self.stall_time = 0.
+        self.start_time = None
+        self.stop_event = threading.Event()
+        self.nb_workers = nb_workers
+        self.finished_workers = 0
+
+        self.reader = threading.Thread(target=self.read_worker, daemon=True)
+        self.decoders = [threading.Thread(target=self.decode_worker, daemon=True) for i in range(nb_workers)]
+        self.reader.start()
+        for decoder in self.decoders:
+            decoder.start()
+
+    '''
+    Fonction blocks(record_loader())
+
+    Sortie :
+        - itérateur sur les blocs (début, fin) d'indices consécutifs du jeu de données, dans un ordre aléatoire
+          différent à chaque passage ; un bloc ne chevauche jamais deux fragments
+    '''
+
+    def blocks(self):
+
+        epoch = 0
+
+        while self.epochs is None or epoch < self.epochs:
+
+            blocks = [(start, min(start + self.block_size, end))
+                      for begin, end in zip(self.dataset.offsets[:-1], self.dataset.offsets[1:])
+                      for start in range(int(begin), int(end), self.block_size)]
+
+            if not blocks:
+                return
+
+            for k in self.rng.permutation(len(blocks)):
+                yield blocks[k]
+
+            epoch += 1
+
+    def put(self, target, item):
+
+        while not self.stop_event.is_set(): # on n'attend jamais indéfiniment, pour pouvoir s'arrêter
+            try:
+                target.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+
+        return False
+
+    def read_worker(self):
+
+        buffer_records = np.empty(self.shuffle_buffer, dtype=position_record)
+        buffer_policies = np.empty(self.shuffle_buffer, dtype=object)
+        filled = 0
+        pending_records = np.empty(0, dtype=position_record) # positions sorties du tampon, pas encore envoyées
+        pending_policies = np.empty(0, dtype=object)
+
+        for start, end in self.blocks():
+
+            if self.stop_event.is_set():
+                return
+
+            records, policy = self.dataset.read(np.arange(start, end))
+            policies = np.empty(len(records), dtype=object)
+            policies[:] = np.split(policy, np.cumsum(records["nb_moves"].astype(np.int64))[:-1])
+            order = self.rng.permutation(len(records))
+            records, policies = records[order], policies[order]
+
+            nb = min(len(records), self.shuffle_buffer - filled) # remplissage initial du tampon
+            buffer_records[filled:filled+nb] = records[:nb]
+            buffer_policies[filled:filled+nb] = policies[:nb]
+            filled += nb
+
+            for i in range(nb, len(records), self.shuffle_buffer):
+                # les nouvelles positions prennent la place de positions du tampon tirées au hasard, qui sortent
+                incoming = slice(i, min(i + self.shuffle_buffer, len(records)))
+                slots = self.rng.choice(self.shuffle_buffer, incoming.stop - incoming.start, replace=False)
+                pending_records = np.concatenate([pending_records, buffer_records[slots]])
+                pending_policies = np.concatenate([pending_policies, buffer_policies[slots]])
+                buffer_records[slots] = records[incoming]
+                buffer_policies[slots] = policies[incoming]
+
+            nb_batches = len(pending_records) // self.batch_size
+            for k in range(nb_batches):
+                if not self.send(pending_records[k*self.batch_size:(k+1)*self.batch_size],
+                                 pending_policies[k*self.batch_size:(k+1)*self.batch_size]):
+                    return
+            pending_records = pending_records[nb_batches*self.batch_size:]
+            pending_policies = pending_policies[nb_batches*self.batch_size:]
+
+        # fin des données : le tampon est vidé dans un ordre aléatoire
+        order = self.rng.permutation(filled)
+        pending_records = np.concatenate([pending_records, buffer_records[order]])
+        pending_policies = np.concatenate([pending_policies, buffer_policies[order]])
+
+        for i in range(0, len(pending_records), self.batch_size):
+            if not self.send(pending_records[i:i+self.batch_size], pending_policies[i:i+self.batch_size]):
+                return
+
+        for i in range(self.nb_workers):
+            self.put(self.raw, None) # un signal de fin par thread de décodage
+
+    def send(self, records, policies):
+
+        return self.put(self.raw, (records, np.concatenate(list(policies)) if len(policies) > 0 else np.zeros(0, dtype=policy_entry)))
+
+    def decode_worker(self):
+
+        while not self.stop_event.is_set():
+
+            try:
+                item = self.raw.get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+            if item is None:
+                self.put(self.batches, None)
+                return
+
+            if not self.put(self.batches, decode_records(*item)):
+                return
+
+    def __iter__(self):
+
+        return self
+
+    def __next__(self):
+
+        if self.start_time is None:
+            self.start_time = time.perf_counter()
+
+        while self.finished_workers < self.nb_workers:
+
+            start = time.perf_counter()
+            batch = self.batches.get()
+            self.stall_time += time.perf_counter() - start
+
+            if batch is not None:
+                self.samples += len(batch[0])
+                return batch
+
+            self.finished_workers += 1 # un thread de décodage a terminé
+
+        raise StopIteration # plus aucun lot ne viendra, y compris aux appels suivants
+
+    '''
+    Fonction keras_batches(record_loader())
+
+    Sortie :
+        - itérateur sur les lots au format de ChessModel.model.fit / train_on_batch : (plans, [politiques, valuations])
+    '''
+
+    def keras_batches(self):
+
+        for planes, policies, values in self:
+            yield planes, [policies, values[:, None]]
+
+    def stats(self):
+
+        elapsed = time.perf_counter() - self.start_time if self.start_time is not None else 0.
+
+        return {"samples": self.samples, "samples_per_second": self.samples / elapsed if elapsed > 0 else 0.,
+                "stall_seconds": self.stall_time, "stall_fraction": self.stall_time / elapsed if elapsed > 0 else 0.,
+                "prefetched_batches": self.batches.qsize()}
+
+    def close(self):
+
+        self.stop_event.set()
+        self.reader.join()
+        for decoder in self.decoders:
+            decoder.join()
+
+        return
@@ -1,28 +1,157 @@
-from keras.engine.training import Model
+import hashlib
 import json
+import os
+import threading
+import time
 import chess
 from utils import *
 
 
-def load_model():
+config_path = "/content/Reinforcement-Learning-AlphaZero/codes/model_config.json"
+weight_path = "/content/Reinforcement-Learning-AlphaZero/codes/model_weights.h5"
 
-    config_path = "/content/Reinforcement-Learning-AlphaZero/codes/model_config.json"
-    weight_path = "/content/Reinforcement-Learning-AlphaZero/codes/model_weights.h5"
 
-    with open(config_path, "rt") as f:
-        model = Model.from_config(json.load(f))
-        model.load_weights(weight_path)
+'''
+Registre des modèles
 
-    return model
+    Chaque modèle est chargé une seule fois par processus puis partagé entre toutes les recherches et toutes les parties.
+    Les modèles sont identifiés par l'empreinte sha256 de leur fichier de poids (la même que ChessModel.fetch_digest).
+'''
+
+models = {} # (empreinte, moteur) -> modèle keras ou numpy_model
+digests = {} # (fichier de poids, date de modification, taille) -> empreinte, pour ne pas relire le fichier à chaque appel
+pinned_digest = None # version imposée par pin_model
+registry_lock = threading.Lock()
+
+
+def fetch_digest(weight_path):
+
+    key = (weight_path, os.path.getmtime(weight_path), os.path.getsize(weight_path))
+
+    if key not in digests:
+        m = hashlib.sha256()
+        with open(weight_path, "rb") as f:
+            m.update(f.read())
+        digests[key] = m.hexdigest()
+
+    return digests[key]
+
+
+'''
+Fonction load_model(config_path, weight_path, digest, engine)
+
+    Renvoie le modèle correspondant au fichier de poids, en ne le chargeant que la première fois.
+    Si digest est donné (ou si une version a été imposée avec pin_model), on renvoie cette version précise :
+    elle doit déjà être dans le registre ou correspondre au fichier de poids.
+    engine vaut "keras" (GPU nécessaire) ou "numpy" (cf numpy_model, sur CPU) ; les deux moteurs donnent les mêmes
+    évaluations et partagent donc la même empreinte.
+'''
+
+def load_model(config_path=config_path, weight_path=weight_path, digest=None, engine="keras"):
+
+    with registry_lock:
+
+        digest = digest or pinned_digest
+
+        if (digest, engine) in models:
+            return models[(digest, engine)]
+
+        current_digest = fetch_digest(weight_path)
+
+        if digest is not None and digest != current_digest:
+            raise ValueError(f"model {digest} is not loaded and {weight_path} has digest {current_digest}")
+
+        if (current_digest, engine) not in models:
+            if engine == "numpy":
+                from numpy_model import numpy_model
+                model = numpy_model.load(config_path, weight_path)
+            else:
+                from keras.engine.training import Model
+                with open(config_path, "rt") as f:
+                    model = Model.from_config(json.load(f))
+                    model.load_weights(weight_path)
+            models[(current_digest, engine)] = model
+
+        return models[(current_digest, engine)]
+
+
+'''
+Fonctions pin_model(digest) et model_digest(model)
+
+    pin_model impose la version renvoyée par load_model (None pour revenir au fichier de poids courant).
+    model_digest renvoie l'empreinte d'un modèle du registre.
+'''
+
+def pin_model(digest):
+
+    global pinned_digest
+    pinned_digest = digest
+
+    return
+
+
+def model_digest(model):
+
+    for (digest, engine), registered in models.items():
+        if registered is model:
+            return digest
+
+    return None
 
 
 
 def evaluate_position(model, position):
 
-    input = np.array([format_input_NN(position)])
+    input = format_inputs_NN([position])
     p,v = model.predict(input)
 
     if not position.turn : # on prend toujours la perspective des blancs pour simplifier MCTS
         v = -v
 
-    return p, v
\ No newline at end of file
+    return p, v
+
+
+def evaluate_positions(model, positions, profiler=None):
+
+    start = time.perf_counter()
+    if hasattr(model, "input_buffer"): # les plans sont écrits directement dans la mémoire partagée (cf shm_transport)
+        input = format_inputs_NN(positions, out=model.input_buffer(len(positions)))
+    else:
+        input = format_inputs_NN(positions)
+    encoded = time.perf_counter()
+    p,v = model.predict(input)
+
+    if profiler is not None: # cf profiler.search_profiler
+        profiler.add("encoding", start, encoded, len(positions))
+        profiler.add("evaluation", encoded, nb=len(positions))
+
+    for i, position in enumerate(positions):
+        if not position.turn : # on prend toujours la perspective des blancs pour simplifier MCTS
+            v[i] = -v[i]
+
+    return p, v
+
+
+'''
+Fonction evaluate_positions_legal(model, positions, indices)
+
+    Comme evaluate_positions, mais seules les probabilités des coups légaux sont calculées (cf numpy_model.predict_legal) :
+    renvoie la liste des probabilités des coups légaux de chaque position et les valuations.
+'''
+
+def evaluate_positions_legal(model, positions, indices, profiler=None):
+
+    start = time.perf_counter()
+    input = format_inputs_NN(positions)
+    encoded = time.perf_counter()
+    priors, v = model.predict_legal(input, indices)
+
+    if profiler is not None:
+        profiler.add("encoding", start, encoded, len(positions))
+        profiler.add("evaluation", encoded, nb=len(positions))
+
+    for i, position in enumerate(positions):
+        if not position.turn : # on prend toujours la perspective des blancs pour simplifier MCTS
+            v[i] = -v[i]
+
+    return priors, v
@@ -0,0 +1,626 @@
+import copy
+import json
+import threading
+import time
+import numpy as np
+
+
+'''
+numpy_model.py
+
+Contient la classe numpy_model qui évalue sur CPU, avec numpy seulement, le réseau décrit par model_config.json
+(cf NN_model.ChessModel.build) : tour résiduelle, tête de politique et tête de valeur.
+
+Le modèle keras utilise des convolutions channels_first qui ne peuvent pas être évaluées sur CPU. Ici les tenseurs
+sont gardés au format (lot, ligne, colonne, canal) : une convolution 3x3 devient un seul produit matriciel entre
+la matrice des voisinages (im2col) et le noyau keras, dont l'ordre (ligne, colonne, canal d'entrée, canal de sortie)
+est justement celui des voisinages. Les BatchNormalization qui suivent une convolution sont intégrées à ses poids.
+
+Les poids peuvent être gardés en float16 ou en int8 (cf numpy_model.quantize), ce qui divise par 2 ou par 4 la
+mémoire qu'ils occupent. Numpy n'a de produit matriciel rapide (BLAS) qu'en float32 et float64 (un produit float16
+ou int8 est plusieurs centaines de fois plus lent) : chaque noyau réduit est converti, par blocs de colonnes, dans
+un petit tampon float32 réutilisé d'un produit à l'autre, et les produits sont calculés depuis ce tampon. En int8,
+l'accumulateur est ensuite multiplié par les échelles des poids (une par canal de sortie) et de l'entrée. Aucune
+copie float32 des noyaux n'est conservée. La conversion coûte un peu de temps à chaque produit, surtout pour les
+petits lots (cf compare_precisions, qui mesure le débit et la mémoire de chaque précision).
+
+Les poids sont lus dans le fichier .h5 de keras (il faut alors h5py) ou dans un fichier .npz dont les clés sont les
+noms keras des poids ("input_conv-3-256/kernel:0", ...), cf convert_weights.
+'''
+
+
+'''
+Fonction read_weights(weight_path)
+
+Sortie :
+    - dictionnaire nom de couche -> {nom court du poids ("kernel", "bias", "gamma", ...) -> tableau numpy}
+'''
+
+def read_weights(weight_path):
+
+    weights = {}
+
+    if weight_path.endswith(".npz"):
+        with np.load(weight_path) as f:
+            named = [(name, f[name]) for name in f.files]
+
+    else:
+        try:
+            import h5py
+        except ImportError:
+            raise ImportError(f"h5py is needed to read {weight_path}, or convert it to .npz with convert_weights")
+
+        named = []
+        with h5py.File(weight_path, "r") as f:
+            group = f["model_weights"] if "model_weights" in f else f # modèle complet ou save_weights
+            for layer in group.attrs["layer_names"]:
+                layer_group = group[layer.decode() if isinstance(layer, bytes) else layer]
+                for name in layer_group.attrs["weight_names"]:
+                    name = name.decode() if isinstance(name, bytes) else name
+                    named.append((name, layer_group[name][()]))
+
+    for name, array in named:
+        layer, short = name.split("/")[-2], name.split("/")[-1].split(":")[0]
+        weights.setdefault(layer, {})[short] = np.asarray(array)
+
+    return weights
+
+
+def convert_weights(weight_path, npz_path):
+
+    weights = read_weights(weight_path)
+    np.savez(npz_path, **{f"{layer}/{short}:0": array for layer, arrays in weights.items() for short, array in arrays.items()})
+
+    return
+
+
+def activation(x, name):
+
+    if name == "linear":
+        return x
+
+    if name == "relu":
+        return np.maximum(x, 0)
+
+    if name == "tanh":
+        return np.tanh(x)
+
+    if name == "sigmoid":
+        return 1 / (1 + np.exp(-x))
+
+    if name == "softmax":
+        e = np.exp(x - x.max(axis=-1, keepdims=True))
+        return e / e.sum(axis=-1, keepdims=True)
+
+    raise NotImplementedError(f"activation {name} is not supported")
+
+
+class numpy_model():
+
+    '''
+    Classe numpy_model
+
+    Réseau de model_config.json évalué avec numpy. Il a les mêmes fonctions predict et predict_on_batch que le modèle
+    keras (entrées (lot, 18, 8, 8), sorties [politiques (lot, 1968), valuations (lot, 1)]) et peut donc le remplacer
+    partout (nn.evaluate_positions, mcts_nn, ChessModelAPI). Elle est caractérisée par 8 attributs :
+
+        - ops : liste des opérations (nom, type, entrées, paramètres) dans l'ordre d'évaluation
+        - input_name : nom de la couche d'entrée
+        - output_names : noms des couches de sortie
+        - last_use : dictionnaire, nom d'un tenseur -> indice de la dernière opération qui le lit (il est libéré ensuite)
+        - dtype : type des calculs
+        - precision : "float32", "float16" ou "int8", format des noyaux des convolutions et des couches denses
+        - transposed : dictionnaire, id d'un noyau -> (noyau, noyau transposé), cf masked_dense
+        - scratch : tampon float32 de chaque thread dans lequel les noyaux réduits sont convertis (cf matmul)
+    '''
+
+    block_columns = 256 # colonnes d'un noyau réduit converties à la fois
+
+    def __init__(self, config, weights, dtype=np.float32):
+
+        self.dtype = dtype
+        self.precision = "float32"
+        self.transposed = {}
+        self.scratch = threading.local()
+        self.ops = []
+        layers = config["layers"]
+        inputs = {layer["name"]: [node[0] for node in layer["inbound_nodes"][0]] if layer["inbound_nodes"] else []
+                  for layer in layers}
+        consumers = {layer["name"]: [] for layer in layers}
+
+        for layer in layers:
+            for name in inputs[layer["name"]]:
+                consumers[name].append(layer)
+
+        self.input_name = config["input_layers"][0][0]
+        self.output_names = [output[0] for output in config["output_layers"]]
+        alias = {} # couche intégrée à la précédente -> opération qui la calcule
+
+        for layer in layers:
+
+            name, kind, c = layer["name"], layer["class_name"], layer["config"]
+            sources = [alias.get(source, source) for source in inputs[name]]
+            w = weights.get(name, {})
+
+            if kind == "InputLayer":
+                continue
+
+            if kind == "Conv2D":
+
+                if tuple(c["strides"]) != (1, 1) or tuple(c["dilation_rate"]) != (1, 1):
+                    raise NotImplementedError(f"{name}: only stride 1 and dilation 1 are supported")
+
+                kernel = w["kernel"].astype(np.float64)
+                bias = w["bias"].astype(np.float64) if c["use_bias"] else np.zeros(kernel.shape[-1])
+                after = consumers[name]
+
+                if c["activation"] == "linear" and len(after) == 1 and after[0]["class_name"] == "BatchNormalization": # BatchNormalization intégrée au noyau
+                    scale, shift = self.batchnorm_coefficients(after[0], weights[after[0]["name"]])
+                    kernel = kernel * scale
+                    bias = bias * scale + shift
+                    alias[after[0]["name"]] = name
+
+                size = kernel.shape[0]
+                if c["padding"] == "same" and size % 2 == 0:
+                    raise NotImplementedError(f"{name}: only odd kernels are supported with padding same")
+
+                self.ops.append((name, "conv", sources, {"kernel": kernel.reshape(-1, kernel.shape[-1]), "bias": bias,
+                                                          "size": size, "same": c["padding"] == "same"}))
+                if c["activation"] != "linear":
+                    self.ops.append((name, "activation", [name], {"name": c["activation"]}))
+
+            elif kind == "BatchNormalization":
+
+                if name in alias: # déjà intégrée à la convolution
+                    continue
+
+                if c["axis"] not in (1, -1, 3):
+                    raise NotImplementedError(f"{name}: only channel normalisation is supported")
+
+                scale, shift = self.batchnorm_coefficients(layer, w)
+                self.ops.append((name, "scale_shift", sources, {"scale": scale, "shift": shift}))
+
+            elif kind == "Activation":
+                self.ops.append((name, "activation", sources, {"name": c["activation"]}))
+
+            elif kind == "Add":
+                self.ops.append((name, "add", sources, {}))
+
+            elif kind == "Flatten":
+                # les tenseurs sont en (ligne, colonne, canal) : si la couche ne sert qu'à des Dense, on permute
+                # plutôt les lignes de leurs noyaux pour retrouver l'ordre (canal, ligne, colonne) de keras
+                self.ops.append((name, "flatten", sources, {"channels_first": any(after["class_name"] != "Dense" for after in consumers[name])}))
+
+            elif kind == "Dense":
+
+                kernel = w["kernel"].astype(np.float64)
+                source_layer = next(l for l in layers if l["name"] == inputs[name][0])
+
+                if source_layer["class_name"] == "Flatten" and not any(after["class_name"] != "Dense" for after in consumers[source_layer["name"]]):
+                    kernel = kernel[self.flatten_permutation(layers, inputs, weights, source_layer["name"])]
+
+                bias = w["bias"].astype(np.float64) if c["use_bias"] else np.zeros(kernel.shape[-1])
+                self.ops.append((name, "dense", sources, {"kernel": kernel, "bias": bias}))
+                if c["activation"] != "linear":
+                    self.ops.append((name, "activation", [name], {"name": c["activation"]}))
+
+            else:
+                raise NotImplementedError(f"layer {name} of type {kind} is not supported")
+
+        self.output_names = [alias.get(name, name) for name in self.output_names]
+        self.cast(dtype)
+
+    def cast(self, dtype):
+
+        self.dtype = dtype
+        self.ops = [(name, kind, sources, {key: value.astype(dtype) if isinstance(value, np.ndarray) else value
+                                           for key, value in params.items()})
+                    for name, kind, sources, params in self.ops]
+        self.last_use = {}
+
+        for index, (name, kind, sources, params) in enumerate(self.ops):
+            for source in sources:
+                self.last_use[source] = index
+
+        return self
+
+    '''
+    Fonction quantize(numpy_model(), precision, calibration)
+
+    Arguments :
+        - precision : "float32", "float16" ou "int8"
+        - calibration : (lot, 18, 8, 8), positions encodées utilisées pour fixer l'échelle des activations en int8
+
+    Sortie :
+        - un nouveau numpy_model dont les noyaux des convolutions et des couches denses sont gardés dans la précision
+          demandée (seuls ces noyaux sont réduits, ils font l'essentiel des poids)
+
+    Description :
+        En int8, chaque colonne du noyau (canal de sortie) a sa propre échelle, max |poids| / 127. L'entrée de chaque
+        produit matriciel est arrondie à des entiers avec une seule échelle, fixée sur les positions de calibration
+        (percentile 99.99 des valeurs absolues) : sur 8 bits non signés (0 à 255) si elle est toujours positive
+        (sortie d'une ReLU), sur 8 bits signés sinon. Le produit des deux échelles (output_scale) est appliqué à
+        l'accumulateur. Les couches qui lisent directement les plans d'entrée (des 0 et des 1 et le compteur des 50
+        coups) ne quantifient que leurs poids.
+
+        Mesures (cf compare_precisions, réseau de 7 blocs résiduels, 256 positions) :
+            - float16 est presque exact (divergence KL de la politique ~5e-6, erreur moyenne de la valuation ~3e-4),
+              occupe 57 % de la mémoire de float32 et a le même débit en lots de 128 (0.75x en lots de 8)
+            - int8 perd nettement en précision : divergence KL de la politique de 0.12 à 0.15, erreur moyenne de la
+              valuation de 0.05 à 0.08 et jusqu'à 0.3, assez pour changer le coup choisi dans certaines positions ;
+              il occupe 32 % de la mémoire de float32, pour un débit de 0.95x à 1x
+    '''
+
+    def quantize(self, precision, calibration=None):
+
+        if self.precision != "float32":
+            raise ValueError("only a float32 model can be quantized")
+
+        model = copy.copy(self)
+        model.precision = precision
+        model.transposed = {}
+        model.scratch = threading.local()
+
+        if precision == "float32":
+            return model
+
+        if precision == "float16":
+            model.ops = [(name, kind, sources, {**params, "kernel": params["kernel"].astype(np.float16)} if "kernel" in params else params)
+                         for name, kind, sources, params in self.ops]
+            return model
+
+        if precision != "int8":
+            raise ValueError(f"unknown precision {precision}")
+
+        if calibration is None:
+            raise ValueError("int8 quantization needs calibration positions")
+
+        input_ranges = self.calibrate(calibration)
+        model.ops = []
+
+        for index, (name, kind, sources, params) in enumerate(self.ops):
+
+            if "kernel" in params:
+                kernel = params["kernel"]
+                weight_scale = np.maximum(np.abs(kernel).max(axis=0), 1e-12) / 127 # une échelle par canal de sortie
+                input_range = None if sources[0] == self.input_name else input_ranges[index]
+                params = {**params, "kernel": np.rint(kernel / weight_scale).astype(np.int8),
+                          "output_scale": (weight_scale * (input_range[0] if input_range is not None else 1.)).astype(self.dtype),
+                          "input_range": input_range}
+
+            model.ops.append((name, kind, sources, params))
+
+        return model
+
+    def calibrate(self, x, percentile=99.99, batch_size=256):
+
+        '''
+        Sortie : dictionnaire indice d'opération -> (échelle, minimum, maximum) de la quantification de son entrée
+        '''
+
+        bounds = {}
+
+        def observer(index, kind, inputs):
+            if kind in ("conv", "dense"):
+                high, low = bounds.get(index, (0., 0.))
+                bounds[index] = (max(high, float(np.percentile(np.abs(inputs[0]), percentile))), min(low, float(inputs[0].min())))
+
+        for i in range(0, len(x), batch_size):
+            self.predict_on_batch(x[i:i+batch_size], observer)
+
+        return {index: (max(high, 1e-12) / 255, 0, 255) if low >= 0 else (max(high, 1e-12) / 127, -127, 127)
+                for index, (high, low) in bounds.items()}
+
+    def weight_bytes(self):
+
+        '''
+        Sortie : mémoire des noyaux des convolutions et des couches denses (et de leurs échelles en int8)
+        '''
+
+        return sum(params["kernel"].nbytes + (params["output_scale"].nbytes if "output_scale" in params else 0)
+                   for name, kind, sources, params in self.ops if "kernel" in params)
+
+    def resident_bytes(self):
+
+        '''
+        Sortie : mémoire réellement occupée par le modèle : tous les paramètres, les noyaux transposés de masked_dense
+        et le tampon de conversion du thread courant
+        '''
+
+        params = sum(value.nbytes for name, kind, sources, params in self.ops for value in params.values() if isinstance(value, np.ndarray))
+        transposed = sum(kernel_t.nbytes for kernel, kernel_t in self.transposed.values())
+
+        return params + transposed + getattr(self.scratch, "buffer", np.zeros(0)).nbytes
+
+    @staticmethod
+    def batchnorm_coefficients(layer, w):
+
+        c = layer["config"]
+        gamma = w["gamma"].astype(np.float64) if c["scale"] else 1.
+        beta = w["beta"].astype(np.float64) if c["center"] else 0.
+        scale = gamma / np.sqrt(w["moving_variance"].astype(np.float64) + c["epsilon"])
+
+        return scale, beta - w["moving_mean"].astype(np.float64) * scale
+
+    @staticmethod
+    def flatten_permutation(layers, inputs, weights, flatten_name):
+
+        '''
+        Indices des lignes du noyau d'une Dense qui suit flatten_name : ligne keras de chaque entrée (ligne, colonne, canal)
+        '''
+
+        source = inputs[flatten_name][0]
+        channels = None
+        while channels is None: # nombre de canaux de la dernière convolution avant la couche Flatten
+            layer = next(l for l in layers if l["name"] == source)
+            if layer["class_name"] == "Conv2D":
+                channels = layer["config"]["filters"]
+            else:
+                source = inputs[source][0]
+
+        input_shape = next(l for l in layers if l["class_name"] == "InputLayer")["config"]["batch_input_shape"]
+        height, width = input_shape[2], input_shape[3] # convolutions same : la taille du plateau ne change pas
+
+        return np.arange(channels * height * width).reshape(channels, height, width).transpose(1, 2, 0).ravel()
+
+    @classmethod
+    def load(cls, config_path, weight_path, dtype=np.float32):
+
+        with open(config_path, "rt") as f:
+            config = json.load(f)
+
+        return cls(config, read_weights(weight_path), dtype)
+
+    '''
+    Opérations, sur des tenseurs (lot, ligne, colonne, canal)
+    '''
+
+    '''
+    Fonctions round_input(numpy_model(), x, input_range), buffer(numpy_model(), shape) et
+    matmul(numpy_model(), x, kernel, output_scale)
+
+    Description :
+        round_input arrondit l'entrée aux entiers sur 8 bits (cf quantize), buffer renvoie le tampon de conversion du
+        thread courant, agrandi si besoin, et matmul calcule le produit x @ kernel : directement pour un noyau float32,
+        bloc de colonnes par bloc de colonnes depuis ce tampon pour un noyau float16 ou int8, puis multiplie
+        l'accumulateur par output_scale (int8).
+    '''
+
+    def round_input(self, x, input_range):
+
+        if input_range is None:
+            return x
+
+        scale, low, high = input_range
+        rounded = x * (1 / scale)
+        np.rint(rounded, out=rounded)
+        np.clip(rounded, low, high, out=rounded)
+
+        return rounded
+
+    def buffer(self, shape):
+
+        size = shape[0] * shape[1]
+        if getattr(self.scratch, "buffer", np.zeros(0)).size < size:
+            self.scratch.buffer = np.empty(size, dtype=self.dtype)
+
+        return self.scratch.buffer[:size].reshape(shape)
+
+    def matmul(self, x, kernel, output_scale=None):
+
+        if kernel.dtype == x.dtype:
+            y = x @ kernel
+
+        else:
+            y = np.empty((len(x), kernel.shape[1]), dtype=x.dtype)
+            for j in range(0, kernel.shape[1], self.block_columns):
+                block = kernel[:, j:j+self.block_columns]
+                converted = self.buffer(block.shape)
+                converted[...] = block
+                np.matmul(x, converted, out=y[:, j:j+block.shape[1]])
+
+        if output_scale is not None:
+            y *= output_scale
+
+        return y
+
+    def conv(self, x, kernel, bias, size, same, input_range=None, output_scale=None):
+
+        x = self.round_input(x, input_range) # avant im2col, qui recopie chaque entrée size * size fois
+        batch, height, width, channels = x.shape
+
+        if size == 1:
+            cols = x.reshape(-1, channels)
+
+        else:
+            pad = size // 2 if same else 0
+            padded = np.zeros((batch, height + 2 * pad, width + 2 * pad, channels), dtype=x.dtype)
+            padded[:, pad:pad+height, pad:pad+width] = x
+            height, width = height + 2 * pad - size + 1, width + 2 * pad - size + 1
+            cols = np.empty((batch, height, width, size, size, channels), dtype=x.dtype) # matrice des voisinages (im2col)
+            for i in range(size):
+                for j in range(size):
+                    cols[:, :, :, i, j] = padded[:, i:i+height, j:j+width]
+            cols = cols.reshape(-1, size * size * channels)
+
+        y = self.matmul(cols, kernel, output_scale)
+        y += bias
+
+        return y.reshape(batch, height, width, -1)
+
+    def scale_shift(self, x, scale, shift):
+
+        return x * scale + shift
+
+    def activation(self, x, name):
+
+        return activation(x, name)
+
+    def add(self, *xs):
+
+        return sum(xs[1:], xs[0])
+
+    def flatten(self, x, channels_first):
+
+        if channels_first and x.ndim == 4:
+            x = x.transpose(0, 3, 1, 2)
+
+        return x.reshape(len(x), -1)
+
+    def dense(self, x, kernel, bias, input_range=None, output_scale=None):
+
+        return self.matmul(self.round_input(x, input_range), kernel, output_scale) + bias
+
+    '''
+    Fonctions predict_on_batch(numpy_model(), x, observer) et predict(numpy_model(), x, batch_size)
+
+    Arguments :
+        - x : (lot, 18, 8, 8), cf utils.format_inputs_NN
+        - observer : fonction facultative appelée avec (indice, type, entrées) avant chaque opération (cf calibrate)
+        - batch_size : entier, taille maximale des lots évalués en une fois (limite la mémoire de im2col)
+
+    Sortie :
+        - [politiques (lot, 1968), valuations (lot, 1)], en float32
+    '''
+
+    def run(self, x, observer=None, skip=None):
+
+        tensors = {self.input_name: np.ascontiguousarray(np.asarray(x).transpose(0, 2, 3, 1), dtype=self.dtype)}
+
+        for index, (name, kind, sources, params) in enumerate(self.ops):
+
+            if name == skip:
+                continue
+
+            inputs = [tensors[source] for source in sources]
+            if observer is not None:
+                observer(index, kind, inputs)
+            tensors[name] = getattr(self, kind)(*inputs, **params)
+
+            for source in sources: # les tenseurs qui ne servent plus sont libérés
+                if self.last_use[source] == index and source not in self.output_names and source != name:
+                    del tensors[source]
+
+        return tensors
+
+    def predict_on_batch(self, x, observer=None):
+
+        tensors = self.run(x, observer)
+
+        return [tensors[name].astype(np.float32) for name in self.output_names]
+
+    '''
+    Fonction predict_legal(numpy_model(), x, indices)
+
+    Arguments :
+        - x : (lot, 18, 8, 8), cf utils.format_inputs_NN
+        - indices : pour chaque position, tableau des indices de ses coups légaux dans la politique (cf utils.policy_indices)
+
+    Sortie :
+        - (liste des probabilités des coups légaux de chaque position, valuations (lot, 1))
+
+    Description :
+        Seules les colonnes de la couche dense de la politique qui correspondent aux coups légaux sont calculées
+        (une trentaine sur 1968), et le softmax est pris sur ces coups seulement : les probabilités des coups légaux
+        d'une position somment à 1. Les ensembles de coups de tailles différentes sont mis bout à bout et le softmax
+        est calculé par segments (np.maximum.reduceat, np.add.reduceat).
+    '''
+
+    def predict_legal(self, x, indices):
+
+        policy_name = self.output_names[0]
+        name, kind, sources, params = next(op for op in self.ops if op[0] == policy_name and op[1] == "dense")
+        if not any(op[0] == policy_name and op[1] == "activation" and op[3]["name"] == "softmax" for op in self.ops):
+            raise NotImplementedError(f"{policy_name} is not a dense layer followed by a softmax")
+
+        tensors = self.run(x, skip=policy_name)
+        lengths = np.array([len(index) for index in indices], dtype=np.int64)
+        columns = np.concatenate([np.asarray(index, dtype=np.int64) for index in indices]) if len(indices) > 0 else np.zeros(0, dtype=np.int64)
+        rows = np.repeat(np.arange(len(indices)), lengths)
+
+        logits = self.masked_dense(tensors[sources[0]], rows, columns, **params)
+
+        starts = (np.cumsum(lengths) - lengths)[lengths > 0] # segments non vides
+        maxima = np.zeros(len(indices), dtype=logits.dtype)
+        if len(starts) > 0:
+            maxima[lengths > 0] = np.maximum.reduceat(logits, starts)
+        e = np.exp(logits - maxima[rows])
+        sums = np.ones(len(indices), dtype=logits.dtype)
+        if len(starts) > 0:
+            sums[lengths > 0] = np.add.reduceat(e, starts)
+        probs = (e / sums[rows]).astype(np.float32)
+
+        return np.split(probs, np.cumsum(lengths)[:-1]), tensors[self.output_names[1]].astype(np.float32)
+
+    def masked_dense(self, x, rows, columns, kernel, bias, input_range=None, output_scale=None):
+
+        x = self.round_input(x, input_range)
+
+        if id(kernel) not in self.transposed: # noyau transposé une fois pour toutes : une ligne contiguë par coup
+            self.transposed[id(kernel)] = (kernel, np.ascontiguousarray(kernel.T))
+        weights = self.transposed[id(kernel)][1][columns].astype(x.dtype, copy=False) # lignes des coups légaux seulement
+
+        logits = np.einsum("ij,ij->i", x[rows], weights)
+        if output_scale is not None:
+            logits *= output_scale[columns]
+
+        return logits + bias[columns]
+
+    def predict(self, x, batch_size=256):
+
+        x = np.asarray(x)
+        results = [self.predict_on_batch(x[i:i+batch_size]) for i in range(0, len(x), batch_size)]
+
+        return [np.concatenate([result[k] for result in results]) for k in range(len(self.output_names))]
+
+
+'''
+Fonction compare_precisions(model, x, calibration, precisions, batch_size, repeat)
+
+Arguments :
+    - model : numpy_model() en float32, la référence
+    - x : (lot, 18, 8, 8), positions encodées de comparaison
+    - calibration : (lot, 18, 8, 8), positions encodées de calibration pour int8 (différentes de x de préférence)
+    - precisions : précisions à comparer
+    - repeat : nombre d'évaluations chronométrées de x, on garde la plus rapide
+
+Sortie :
+    - dictionnaire précision -> {"policy_kl" : divergence de Kullback-Leibler moyenne de la politique par rapport à
+      float32, "value_mae" et "value_max_error" : erreur absolue moyenne et maximale de la valuation,
+      "positions_per_second" : débit mesuré (après une première évaluation de x), "speedup" : débit relatif à
+      float32, "weight_bytes" : mémoire des noyaux (cf weight_bytes), "resident_bytes" : mémoire réellement occupée
+      par le modèle après l'évaluation (cf resident_bytes), "memory_ratio" : resident_bytes relatif à float32}
+'''
+
+def compare_precisions(model, x, calibration, precisions=("float32", "float16", "int8"), batch_size=256, repeat=3):
+
+    def speed(quantized):
+        best = float("inf")
+        for i in range(repeat):
+            start = time.perf_counter()
+            quantized.predict(x, batch_size)
+            best = min(best, time.perf_counter() - start)
+        return len(x) / best
+
+    results = {}
+    reference = model.quantize("float32")
+    p_ref, v_ref = reference.predict(x, batch_size)
+    reference_speed = speed(reference)
+
+    for precision in precisions:
+
+        if precision == "float32":
+            quantized, p, v, positions_per_second = reference, p_ref, v_ref, reference_speed
+        else:
+            quantized = model.quantize(precision, calibration)
+            p, v = quantized.predict(x, batch_size)
+            positions_per_second = speed(quantized)
+
+        kl = np.sum(p_ref * (np.log(np.maximum(p_ref, 1e-12)) - np.log(np.maximum(p, 1e-12))), axis=1)
+        results[precision] = {"policy_kl": float(kl.mean()), "value_mae": float(np.abs(v - v_ref).mean()),
+                              "value_max_error": float(np.abs(v - v_ref).max()), "positions_per_second": positions_per_second,
+                              "speedup": positions_per_second / reference_speed, "weight_bytes": quantized.weight_bytes(),
+                              "resident_bytes": quantized.resident_bytes(),
+                              "memory_ratio": quantized.resident_bytes() / reference.resident_bytes()}
+
+    return results
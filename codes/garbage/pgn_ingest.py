@@ -0,0 +1,350 @@
+import argparse
+import json
+import os
+import re
+import time
+from multiprocessing import Pool
+import chess
+from chess_env import ChessEnv
+from records import record_writer, encode_position, read_index, write_index
+
+
+'''
+pgn_ingest.py
+
+Transforme des archives de parties (fichiers PGN) en données d'entraînement supervisé au format de records.py :
+pour chaque position d'une partie, (position, coup joué, résultat de la partie).
+
+Chaque fichier est découpé en morceaux (chunks) à des positions en octets qui tombent au début d'une partie, et les
+morceaux sont traités en parallèle par un pool de processus. Chaque morceau écrit ses propres fragments
+(prefix-chunk-00000-00000.records.npy, ...) et son propre index, marqué complete une fois le morceau terminé ; l'index
+global prefix.index.json est reconstruit à la fin à partir des morceaux terminés. Une ingestion interrompue reprend
+donc là où elle s'était arrêtée (les morceaux incomplets sont recommencés).
+
+Pour aller plus vite que chess.pgn.read_game, les parties sont découpées à la main : les en-têtes sont lus avec une
+expression régulière (les filtres sur le classement Elo et la cadence sont appliqués avant de lire les coups), les
+commentaires, variantes et annotations sont retirés du texte des coups, puis chaque coup SAN est rejoué avec
+ChessEnv.step.
+'''
+
+header_pattern = re.compile(r'\[(\w+)\s+"((?:[^"\\]|\\.)*)"\]')
+comment_pattern = re.compile(r"\{[^}]*\}|;[^\n]*")
+# numéros de coups, annotations ($1, !?), résultats, puis coups SAN (groupe 1) sans les annotations qui les suivent
+token_pattern = re.compile(r"\d+\.(?:\.\.)?|\$\d+|[!?]+|1-0|0-1|1/2-1/2|\*|([^\s.!?$]+)")
+
+results = {"1-0": 1, "0-1": -1, "1/2-1/2": 0}
+
+
+'''
+Fonction split_offsets(path, nb_chunks)
+
+Sortie :
+    - liste de (début, fin) en octets qui découpe le fichier en nb_chunks morceaux au plus, chacun commençant au
+      début d'une partie (ligne "[Event ...")
+'''
+
+def split_offsets(path, nb_chunks):
+
+    size = os.path.getsize(path)
+    starts = [0]
+
+    with open(path, "rb") as f:
+
+        for k in range(1, nb_chunks):
+
+            f.seek(max(k * size // nb_chunks, starts[-1]))
+            f.readline() # on termine la ligne commencée
+
+            while True:
+                position = f.tell()
+                line = f.readline()
+                if not line: # fin du fichier
+                    position = size
+                    break
+                if line.startswith(b"[Event "):
+                    break
+
+            if position > starts[-1] and position < size:
+                starts.append(position)
+
+    return list(zip(starts, starts[1:] + [size]))
+
+
+'''
+Fonction read_games(path, start, end)
+
+Sortie :
+    - itérateur sur les (en-têtes, texte des coups) des parties qui commencent entre start et end
+'''
+
+def read_games(path, start, end):
+
+    with open(path, "rb") as f:
+
+        f.seek(start)
+        headers, moves = {}, []
+        position = start
+
+        while True:
+
+            line = f.readline()
+            at_header = line.startswith(b"[")
+
+            if not line or (at_header and moves) or (at_header and line.startswith(b"[Event ") and headers):
+                if headers or moves:
+                    yield headers, " ".join(moves)
+                headers, moves = {}, []
+                if not line or position >= end: # la partie suivante appartient au morceau suivant
+                    return
+
+            position += len(line)
+            line = line.decode("utf-8", errors="replace").strip()
+
+            if line.startswith("["):
+                match = header_pattern.match(line)
+                if match:
+                    headers[match.group(1)] = match.group(2)
+            elif line and not line.startswith("%"):
+                moves.append(line)
+
+
+def strip_variations(text):
+
+    '''
+    Retire les commentaires et les variantes (éventuellement imbriquées) du texte des coups
+    '''
+
+    text = comment_pattern.sub(" ", text)
+
+    if "(" not in text:
+        return text
+
+    kept, depth = [], 0
+
+    for c in text:
+        if c == "(":
+            depth += 1
+        elif c == ")":
+            depth = max(depth - 1, 0)
+        elif depth == 0:
+            kept.append(c)
+
+    return "".join(kept)
+
+
+'''
+Fonction accept(headers, min_elo, max_elo, time_controls, min_seconds)
+
+Sortie :
+    - True si la partie passe les filtres : classement Elo des deux joueurs entre min_elo et max_elo, cadence parmi
+      time_controls (valeurs de l'en-tête TimeControl, par exemple "600+0"), durée estimée (temps de base + 40
+      incréments, en secondes) d'au moins min_seconds
+'''
+
+def accept(headers, min_elo=None, max_elo=None, time_controls=None, min_seconds=None):
+
+    if headers.get("Result") not in results:
+        return False
+
+    if headers.get("SetUp") == "1" or "FEN" in headers: # les parties qui ne partent pas de la position initiale sont ignorées
+        return False
+
+    if min_elo is not None or max_elo is not None:
+        try:
+            elos = [int(headers["WhiteElo"]), int(headers["BlackElo"])]
+        except (KeyError, ValueError):
+            return False
+        if min_elo is not None and min(elos) < min_elo:
+            return False
+        if max_elo is not None and max(elos) > max_elo:
+            return False
+
+    time_control = headers.get("TimeControl", "-")
+
+    if time_controls is not None and time_control not in time_controls:
+        return False
+
+    if min_seconds is not None:
+        try:
+            base, increment = (time_control.split("+") + ["0"])[:2]
+            if int(base) + 40 * int(increment) < min_seconds:
+                return False
+        except ValueError:
+            return False
+
+    return True
+
+
+'''
+Fonction replay(headers, text)
+
+Sortie :
+    - liste des positions encodées (cf records.encode_position) de la partie, None si un coup est illégal ou est un
+      coup nul ("--", "Z0" : parse_san les accepte mais ils n'ont pas d'indice dans la politique)
+'''
+
+def replay(headers, text):
+
+    env = ChessEnv().reset()
+    outcome = results[headers["Result"]]
+    encoded = []
+
+    for match in token_pattern.finditer(strip_variations(text)):
+
+        token = match.group(1) # coup SAN ("e4", "O-O", "0-0"...), None pour les autres éléments
+        if token is None:
+            continue
+
+        try:
+            move = env.board.parse_san(token)
+        except ValueError:
+            return None
+
+        if move == chess.Move.null():
+            return None
+
+        encoded.append(encode_position(env.board, [move], [1], outcome))
+        env.step(move.uci(), check_over=False)
+
+    return encoded
+
+
+'''
+Fonction ingest_chunk(task)
+
+Arguments :
+    - task : dictionnaire (fichier, début, fin, préfixe du morceau, filtres)
+
+Sortie :
+    - statistiques du morceau : parties lues, parties gardées, positions écrites, octets lus, durée
+'''
+
+def ingest_chunk(task):
+
+    start_time = time.perf_counter()
+    stats = {"chunk": task["prefix"], "games": 0, "accepted": 0, "rejected_illegal": 0, "positions": 0,
+             "bytes": task["end"] - task["start"]}
+
+    if os.path.exists(task["prefix"] + ".index.json"): # morceau interrompu : on recommence
+        os.remove(task["prefix"] + ".index.json")
+
+    writer = record_writer(task["prefix"], shard_size=task["shard_size"])
+
+    for headers, text in read_games(task["path"], task["start"], task["end"]):
+
+        stats["games"] += 1
+
+        if not accept(headers, **task["filters"]):
+            continue
+
+        encoded = replay(headers, text)
+
+        if encoded is None:
+            stats["rejected_illegal"] += 1
+            continue
+
+        writer.add_records(encoded)
+        stats["accepted"] += 1
+        stats["positions"] += len(encoded)
+
+    writer.close()
+    index = read_index(task["prefix"]) if os.path.exists(task["prefix"] + ".index.json") else {"shards": []}
+    index["complete"] = True
+    index["stats"] = stats
+    write_index(task["prefix"], index)
+    stats["seconds"] = time.perf_counter() - start_time
+
+    return stats
+
+
+def chunk_complete(prefix):
+
+    return os.path.exists(prefix + ".index.json") and read_index(prefix).get("complete", False)
+
+
+'''
+Fonction ingest(prefix, paths, nb_workers, chunk_bytes, shard_size, report, **filters)
+
+Arguments :
+    - prefix : chemin du jeu de données produit (lisible ensuite par records.record_dataset(prefix))
+    - paths : fichiers PGN
+    - nb_workers : nombre de processus
+    - chunk_bytes : taille approximative des morceaux en octets
+    - shard_size : nombre de positions par fragment
+    - report : fonction appelée avec les statistiques cumulées après chaque morceau (None pour ne rien afficher)
+    - filters : min_elo, max_elo, time_controls, min_seconds (cf accept)
+
+Sortie :
+    - statistiques cumulées (parties, positions, octets, parties et positions par seconde)
+'''
+
+def ingest(prefix, paths, nb_workers=os.cpu_count(), chunk_bytes=64 * 2**20, shard_size=2**20, report=print, **filters):
+
+    manifest_path = prefix + ".ingest.json"
+
+    if os.path.exists(manifest_path): # reprise : même découpage qu'à la première exécution
+        with open(manifest_path, "rt") as f:
+            manifest = json.load(f)
+    else:
+        manifest = {"chunks": [(path, start, end) for path in paths
+                               for start, end in split_offsets(path, max(1, os.path.getsize(path) // chunk_bytes))]}
+        with open(manifest_path, "wt") as f:
+            json.dump(manifest, f)
+
+    tasks = [{"path": path, "start": start, "end": end, "prefix": f"{prefix}-chunk-{k:05d}", "shard_size": shard_size,
+              "filters": filters}
+             for k, (path, start, end) in enumerate(manifest["chunks"])]
+    todo = [task for task in tasks if not chunk_complete(task["prefix"])]
+
+    total = {"chunks": len(tasks), "chunks_done": len(tasks) - len(todo), "games": 0, "accepted": 0,
+             "rejected_illegal": 0, "positions": 0, "bytes": 0}
+    start_time = time.perf_counter()
+
+    with Pool(nb_workers) as pool:
+
+        for stats in pool.imap_unordered(ingest_chunk, todo):
+
+            total["chunks_done"] += 1
+            for key in ("games", "accepted", "rejected_illegal", "positions", "bytes"):
+                total[key] += stats[key]
+
+            elapsed = time.perf_counter() - start_time
+            total["seconds"] = elapsed
+            total["games_per_second"] = total["games"] / elapsed
+            total["positions_per_second"] = total["positions"] / elapsed
+            total["megabytes_per_second"] = total["bytes"] / elapsed / 2**20
+
+            if report is not None:
+                report(dict(total))
+
+    # index global : les fragments de tous les morceaux, dans l'ordre des morceaux
+    directory = os.path.dirname(prefix)
+    shards = []
+
+    for task in tasks:
+        chunk_directory = os.path.dirname(task["prefix"])
+        for shard in read_index(task["prefix"])["shards"]:
+            shards.append({key: os.path.relpath(os.path.join(chunk_directory, value), directory or ".") if key != "count" else value
+                           for key, value in shard.items()})
+
+    write_index(prefix, {"shards": shards})
+
+    return total
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Ingestion de fichiers PGN en données d'entraînement (cf records.py)")
+    parser.add_argument("prefix", help="chemin du jeu de données produit, sans extension")
+    parser.add_argument("pgn", nargs="+", help="fichiers PGN")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--chunk-mb", type=int, default=64)
+    parser.add_argument("--shard-size", type=int, default=2**20)
+    parser.add_argument("--min-elo", type=int)
+    parser.add_argument("--max-elo", type=int)
+    parser.add_argument("--time-control", action="append", dest="time_controls", help="cadence acceptée, par exemple 600+0 (répétable)")
+    parser.add_argument("--min-seconds", type=int)
+    args = parser.parse_args()
+
+    ingest(args.prefix, args.pgn, nb_workers=args.workers, chunk_bytes=args.chunk_mb * 2**20, shard_size=args.shard_size,
+           min_elo=args.min_elo, max_elo=args.max_elo, time_controls=args.time_controls, min_seconds=args.min_seconds)
@@ -1,18 +1,27 @@
+import threading
 import chess
 from MCTS_nn import *
+from MCTS_dag import mcts_nn_dag
+from root_parallel import root_parallel_search
 from nn import *
 from IPython.display import display
 
 class game():
 
 
-    def __init__(self):
+    def __init__(self, cache=None):
 
         self.board = chess.Board()
+        self.MCTS = None # arbre de recherche conservé d'un coup à l'autre
+        self.cache = cache # cache des évaluations, qui peut être partagé entre plusieurs parties
+        self.ponder_thread = None # recherche pendant le temps de réflexion de l'adversaire (cf start_pondering)
+        self.ponder_stop = threading.Event()
+        self.pondered = 0 # nombre de simulations effectuées pendant la dernière réflexion
 
 
     def play_random(self):
 
+        self.stop_pondering()
         random_move = sample(list(self.board.legal_moves),1)[0]
         self.board.push(random_move)
 
@@ -21,18 +30,136 @@ class game():
         return
 
 
-    def play_mcts_nn(self, nb_simul):
+    def play_mcts_nn(self, nb_simul=None, batch_size=1, virtual_loss=1, reuse_tree=True, transpositions=False, max_time=None,
+                     ponder=False, extension=2.):
+
+        '''
+        Sans max_time, nb_simul est obligatoire et on effectue exactement nb_simul simulations.
+        Avec max_time (en secondes), la recherche s'arrête quand le budget de temps ou de simulations (nb_simul, sans
+        limite si None) est épuisé, ou plus tôt si le coup joué ne peut plus changer (cf mcts_nn.search). Si le
+        meilleur coup est encore instable à la fin du budget, celui-ci est multiplié par extension : la recherche peut
+        alors durer jusqu'à extension fois max_time et effectuer jusqu'à extension fois nb_simul simulations (le double
+        par défaut ; extension=1 pour un budget strict).
+        Avec ponder, la recherche continue en arrière-plan après notre coup, pendant la réflexion de l'adversaire
+        (cf start_pondering).
+        '''
+
+        if nb_simul is None and max_time is None:
+            raise ValueError("play_mcts_nn needs nb_simul, max_time or both")
+
+        if self.board.outcome() is not None:
+            raise ValueError("the game is over, there is no move to play")
+
+        self.stop_pondering()
+
+        if self.MCTS is None or not reuse_tree or transpositions != isinstance(self.MCTS, mcts_nn_dag):
+            if transpositions: # recherche dans un graphe qui fusionne les transpositions
+                self.MCTS = mcts_nn_dag(self.board, cache=self.cache)
+            else:
+                self.MCTS = mcts_nn(self.board, batch_size=batch_size, virtual_loss=virtual_loss, cache=self.cache)
+
+        else: # on repart du sous-arbre correspondant aux coups joués depuis la dernière recherche
+            if self.MCTS.initial_position.move_stack != self.board.move_stack: # racine déjà à jour après opponent_move
+                self.MCTS.update_root(self.board)
+            self.MCTS.batch_size = batch_size
+            self.MCTS.virtual_loss = virtual_loss
+
+        MCTS = self.MCTS
+        if max_time is not None:
+            MCTS.search(max_time=max_time, max_nodes=nb_simul, extension=extension)
+        else:
+            MCTS.simulate(nb_simul)
+
+        moves, N, V = MCTS.root_stats()
+        index = choice(np.flatnonzero(N == N.max()))
+        move = moves[index]
+        self.board.push(move)
+
+        display(self.board)
+
+        if ponder:
+            self.start_pondering()
+
+        return 
+
+
+    def start_pondering(self, max_simul=None):
+
+        '''
+        Réflexion pendant le temps de l'adversaire : l'arbre est réenraciné sur la position après notre coup et un
+        thread continue les simulations (par lots de batch_size) jusqu'à stop_pondering ou jusqu'à max_simul
+        simulations. Les visites accumulées dans le sous-arbre du coup que joue réellement l'adversaire sont
+        conservées pour la recherche suivante (cf opponent_move et mcts_nn.update_root).
+        '''
+
+        self.stop_pondering()
+
+        if self.MCTS is None or self.board.outcome() is not None:
+            return
+
+        self.MCTS.update_root(self.board)
+        self.ponder_stop.clear()
+        self.pondered = 0
+        self.ponder_thread = threading.Thread(target=self.ponder_worker, args=(max_simul,), daemon=True)
+        self.ponder_thread.start()
+
+        return
+
+
+    def ponder_worker(self, max_simul):
+
+        MCTS = self.MCTS
+
+        while not self.ponder_stop.is_set() and (max_simul is None or self.pondered < max_simul):
+            MCTS.simulate(MCTS.batch_size)
+            self.pondered += MCTS.batch_size
+
+        return
 
-        MCTS = mcts_nn(self.board)
 
-        for i in range(nb_simul):
-            MCTS.expansion_backprop(MCTS.selection())
+    def stop_pondering(self):
+
+        '''
+        Arrête (ou annule) la réflexion en cours, après le lot de simulations en cours ; l'arbre reste utilisable.
+        Renvoie le nombre de simulations effectuées pendant la réflexion.
+        '''
+
+        if self.ponder_thread is not None:
+            self.ponder_stop.set()
+            self.ponder_thread.join()
+            self.ponder_thread = None
+
+        return self.pondered
+
+
+    def opponent_move(self, move):
+
+        '''
+        Joue le coup de l'adversaire (chess.Move ou chaîne uci) : la réflexion est arrêtée et le sous-arbre de ce coup
+        devient la racine de la prochaine recherche.
+        '''
+
+        self.stop_pondering()
+
+        if isinstance(move, str):
+            move = chess.Move.from_uci(move)
 
-        N = [child.N for child in MCTS.root.children]
-        index = sample([i for i, j in enumerate(N) if j == max(N)],1)[0] 
-        move = [child.move for child in MCTS.root.children][index]
         self.board.push(move)
 
+        if self.MCTS is not None:
+            self.MCTS.update_root(self.board)
+
         display(self.board)
 
-        return 
+        return
+
+
+    def play_root_parallel(self, nb_simul, nb_workers=4, engine="mcts_nn", pool=None):
+
+        self.stop_pondering()
+        move, stats = root_parallel_search(self.board, nb_workers=nb_workers, nb_simul=nb_simul, engine=engine, pool=pool)
+        self.board.push(move)
+
+        display(self.board)
+
+        return
@@ -0,0 +1,236 @@
+import time
+import numpy as np
+
+
+'''
+profiler.py
+
+Contient la classe search_profiler qui mesure où passe le temps d'une recherche mcts_nn, phase par phase :
+
+    - selection : descente de la racine à une feuille
+    - movegen : génération des coups légaux et détection des fins de partie
+    - encoding : calcul des plans d'entrée du réseau de neurones (cf utils.format_inputs_NN)
+    - evaluation : appel au réseau de neurones
+    - expansion : création des noeuds enfants
+    - backup : rétropropagation des valuations
+
+Pour chaque phase on cumule le temps passé, le nombre d'appels et le nombre d'éléments traités (positions encodées
+ou évaluées, noeuds créés...). La mesure est facultative : sans profiler (mcts_nn(profiler=None), le défaut), la
+recherche ne fait aucun appel à l'horloge en plus.
+'''
+
+phases = ("selection", "movegen", "encoding", "evaluation", "expansion", "backup")
+
+
+class search_profiler():
+
+    '''
+    Classe search_profiler
+
+    Elle est caractérisée par 8 attributs :
+
+        - seconds : dictionnaire, temps cumulé (en secondes) de chaque phase
+        - calls : dictionnaire, nombre d'appels de chaque phase
+        - items : dictionnaire, nombre d'éléments traités par chaque phase
+        - counters : dictionnaire, autres compteurs (évaluations trouvées dans le cache...)
+        - simulations : entier, nombre de simulations effectuées
+        - callback : fonction appelée avec un instantané (cf snapshot) toutes les interval secondes pendant la recherche,
+                     ou None
+        - interval : réel, période des appels à callback
+        - start_time, last_report : dates du début de la mesure et du dernier appel à callback
+    '''
+
+    def __init__(self, callback=None, interval=1.):
+
+        self.callback = callback
+        self.interval = interval
+        self.reset()
+
+    def reset(self):
+
+        self.seconds = {phase: 0. for phase in phases}
+        self.calls = {phase: 0 for phase in phases}
+        self.items = {phase: 0 for phase in phases}
+        self.counters = {"cache_hits": 0}
+        self.simulations = 0
+        self.start_time = time.perf_counter()
+        self.last_report = self.start_time
+
+        return
+
+    '''
+    Fonction add(search_profiler(), phase, start, end, nb)
+
+    Arguments :
+        - phase : nom de la phase
+        - start : date de début de la phase (time.perf_counter())
+        - end : date de fin de la phase, maintenant par défaut
+        - nb : nombre d'éléments traités
+    '''
+
+    def add(self, phase, start, end=None, nb=1):
+
+        end = time.perf_counter() if end is None else end
+        self.seconds[phase] += end - start
+        self.calls[phase] += 1
+        self.items[phase] += nb
+
+        return end
+
+    def count(self, name, nb=1):
+
+        self.counters[name] = self.counters.get(name, 0) + nb
+
+        return
+
+    '''
+    Fonction tick(search_profiler(), search, nb)
+
+    Description :
+        Appelée par la recherche après nb simulations ; appelle callback avec un instantané de la recherche si interval
+        secondes se sont écoulées depuis le dernier appel.
+    '''
+
+    def tick(self, search, nb=1):
+
+        self.simulations += nb
+
+        if self.callback is not None and time.perf_counter() - self.last_report >= self.interval:
+            self.last_report = time.perf_counter()
+            self.callback(self.snapshot(search))
+
+        return
+
+    '''
+    Fonction snapshot(search_profiler(), search)
+
+    Sortie :
+        - dictionnaire : durée de la mesure, simulations et simulations par seconde, pour chaque phase temps cumulé,
+          appels, éléments et part du temps total, compteurs, et statistiques de l'arbre de search (cf tree_stats)
+    '''
+
+    def snapshot(self, search=None):
+
+        elapsed = time.perf_counter() - self.start_time
+        measured = sum(self.seconds.values())
+        snapshot = {"elapsed": elapsed, "simulations": self.simulations,
+                    "simulations_per_second": self.simulations / elapsed if elapsed > 0 else 0.,
+                    "phases": {phase: {"seconds": self.seconds[phase], "calls": self.calls[phase], "items": self.items[phase],
+                                       "share": self.seconds[phase] / measured if measured > 0 else 0.}
+                               for phase in phases},
+                    "counters": dict(self.counters)}
+
+        if search is not None:
+            snapshot["tree"] = tree_stats(search)
+
+        return snapshot
+
+
+'''
+Fonction tree_stats(search)
+
+Argument :
+    - search : mcts_nn() (pour un graphe, mcts_nn_dag(), cf graph_stats)
+
+Sortie :
+    - dictionnaire :
+        - nodes : nombre de noeuds de l'arbre (noeuds créés, visités ou non)
+        - free_nodes : nombre de noeuds libérés par l'élagage, en attente de réutilisation (cf tree_nn.prune)
+        - visited_nodes : nombre de noeuds visités au moins une fois
+        - max_depth, mean_depth : profondeur maximale et moyenne des noeuds visités (la racine est à la profondeur 0)
+        - mean_children : nombre moyen d'enfants des noeuds développés
+        - effective_branching_factor : b tel que visited_nodes = b ** max_depth, mesure de la sélectivité de la recherche
+        - bytes, bytes_per_node : mémoire allouée par l'arbre (cf tree_nn.nbytes), totale et par noeud utilisé
+        - node_bytes : mémoire d'un noeud (cf tree_nn.node_bytes)
+        - root_visits : liste (coup uci, visites, part des visites) des enfants de la racine, par visites décroissantes
+'''
+
+def tree_stats(search):
+
+    if hasattr(search.tree, "edge_N"): # graphe de MCTS_dag
+        return graph_stats(search)
+
+    tree = search.tree
+    size = tree.size
+    parent = tree.parent[:size]
+    used = tree.used()
+    nb_used = int(used.sum())
+
+    # profondeur de chaque noeud : un passage par niveau de l'arbre, chacun vectorisé
+    depth = np.zeros(size, dtype=np.int64)
+    known = (parent == -1) | ~used
+    while not known.all():
+        ready = ~known & known[np.maximum(parent, 0)]
+        depth[ready] = depth[parent[ready]] + 1
+        known |= ready
+
+    visited = used & (tree.N[:size] > 0)
+    nb_visited = int(visited.sum())
+    max_depth = int(depth[visited].max()) if nb_visited > 0 else 0
+    expanded = used & (tree.nb_children[:size] > 0)
+
+    moves, N, V = search.root_stats()
+    total = max(int(N.sum()), 1)
+    order = np.argsort(-N, kind="stable")
+
+    return {"nodes": nb_used, "free_nodes": size - nb_used, "visited_nodes": nb_visited, "max_depth": max_depth,
+            "mean_depth": float(depth[visited].mean()) if nb_visited > 0 else 0.,
+            "mean_children": float(tree.nb_children[:size][expanded].mean()) if expanded.any() else 0.,
+            "effective_branching_factor": nb_visited ** (1 / max_depth) if max_depth > 0 else 0.,
+            "bytes": tree.nbytes(), "bytes_per_node": tree.nbytes() / nb_used, "node_bytes": tree.node_bytes(),
+            "root_visits": [(moves[k].uci(), int(N[k]), float(N[k] / total)) for k in order]}
+
+
+'''
+Fonction graph_stats(search)
+
+Argument :
+    - search : mcts_nn_dag()
+
+Sortie :
+    - dictionnaire avec les mêmes clés que tree_stats, calculées sur le graphe graph_nn : la profondeur d'un noeud est
+      celle de son plus court chemin depuis la racine, free_nodes vaut 0 (le graphe n'est pas élagué), bytes comprend
+      les arêtes et node_bytes non. S'y ajoutent :
+        - edges : nombre d'arêtes du graphe, edge_bytes : mémoire d'une arête
+        - transpositions : nombre d'arêtes qui rejoignent un noeud déjà atteint par une autre arête
+'''
+
+def graph_stats(search):
+
+    graph = search.tree
+    size = graph.nb_nodes
+
+    # profondeur de chaque noeud : parcours en largeur depuis la racine, un niveau à la fois
+    depth = np.full(size, -1, dtype=np.int64)
+    depth[search.root] = 0
+    frontier = np.array([search.root])
+    level = 0
+    while len(frontier) > 0:
+        counts = graph.nb_edges[frontier]
+        edges = np.repeat(graph.first_edge[frontier] - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        children = graph.child[edges]
+        children = np.unique(children[children != -1])
+        frontier = children[depth[children] == -1]
+        level += 1
+        depth[frontier] = level
+
+    reached = depth >= 0
+    visited = reached & (graph.N[:size] > 0)
+    nb_visited = int(visited.sum())
+    max_depth = int(depth[visited].max()) if nb_visited > 0 else 0
+    expanded = reached & (graph.nb_edges[:size] > 0)
+    links = graph.child[:graph.nb_edges_used]
+    links = links[links != -1]
+
+    moves, N, W = search.root_stats()
+    total = max(int(N.sum()), 1)
+    order = np.argsort(-N, kind="stable")
+
+    return {"nodes": size, "free_nodes": 0, "visited_nodes": nb_visited, "max_depth": max_depth,
+            "mean_depth": float(depth[visited].mean()) if nb_visited > 0 else 0.,
+            "mean_children": float(graph.nb_edges[:size][expanded].mean()) if expanded.any() else 0.,
+            "effective_branching_factor": nb_visited ** (1 / max_depth) if max_depth > 0 else 0.,
+            "bytes": graph.nbytes(), "bytes_per_node": graph.nbytes() / size, "node_bytes": graph.node_bytes(),
+            "edges": graph.nb_edges_used, "edge_bytes": graph.edge_bytes(),
+            "transpositions": len(links) - len(np.unique(links)),
+            "root_visits": [(moves[k].uci(), int(N[k]), float(N[k] / total)) for k in order]}
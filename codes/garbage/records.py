@@ -0,0 +1,280 @@
+import json
+import os
+import numpy as np
+import chess
+from utils import board_bitboards, bitboards_to_planes, policy_indices
+
+
+'''
+records.py
+
+Contient le format des données d'entraînement (self-play ou parties annotées) sur disque.
+
+Une position n'est pas stockée sous forme de plans (18 x 8 x 8 float32, 4.6 ko) mais sous forme de bitboards : un
+enregistrement de taille fixe (position_record, 112 octets) contient les 12 bitboards des pièces, les droits de roque,
+la case de prise en passant, le compteur des 50 coups, le trait, le résultat de la partie et la position de sa
+politique. La politique est creuse : seuls les coups légaux visités sont stockés, sous forme de couples (indice du coup
+dans la politique du réseau, nombre de visites) de 4 octets, mis bout à bout dans un second tableau.
+
+Les enregistrements sont regroupés en fragments (shards) : deux fichiers .npy lus en memmap, un pour les positions et
+un pour les politiques. Un index json (prefix.index.json) donne la liste des fragments et leur nombre de positions.
+'''
+
+position_record = np.dtype([("bitboards", "<u8", (12,)), # ordre 'KQRBNPkqrbnp', cf utils.board_bitboards
+                            ("turn", "u1"), # 1 si les blancs ont le trait
+                            ("castling", "u1"), # droits de roque, un bit par droit dans l'ordre 'KQkq'
+                            ("ep_square", "i1"), # case de prise en passant, -1 s'il n'y en a pas
+                            ("fifty_move", "<u2"), # compteur des 50 coups
+                            ("outcome", "i1"), # résultat de la partie (perspective des blancs) : 1, 0 ou -1
+                            ("nb_moves", "<u2"), # nombre de coups de la politique
+                            ("policy_start", "<u8")]) # indice de la politique dans le tableau des politiques du fragment
+
+policy_entry = np.dtype([("label", "<u2"), ("visits", "<u2")])
+
+N_LABELS = 1968 # taille de la politique du réseau (cf utils.create_uci_labels)
+
+
+'''
+Fonction encode_position(position, moves, visits, outcome)
+
+Arguments :
+    - position : chess.Board()
+    - moves : liste de chess.Move(), coups de la politique (coups légaux visités, ou coup joué)
+    - visits : nombres de visites de ces coups (1 pour le coup joué d'une partie annotée)
+    - outcome : résultat de la partie, perspective des blancs
+
+Sortie :
+    - (enregistrement position_record sans policy_start, tableau policy_entry)
+'''
+
+def encode_position(position, moves, visits, outcome):
+
+    record = np.zeros((), dtype=position_record)
+    bitboards, castling, ep_square, fifty_move = board_bitboards(position)
+
+    record["bitboards"] = bitboards
+    record["turn"] = position.turn
+    record["castling"] = sum(1 << i for i, right in enumerate(castling) if right)
+    record["ep_square"] = ep_square
+    record["fifty_move"] = min(fifty_move, 2**16 - 1)
+    record["outcome"] = outcome
+    record["nb_moves"] = len(moves)
+
+    policy = np.zeros(len(moves), dtype=policy_entry)
+    policy["label"] = policy_indices(position, moves)
+    policy["visits"] = np.minimum(visits, 2**16 - 1)
+
+    return record, policy
+
+
+'''
+Fonction decode_records(records, policy_entries, out)
+
+Arguments :
+    - records : tableau de position_record
+    - policy_entries : tableau policy_entry, politiques des positions de records mises bout à bout dans le même ordre
+    - out : tableau (lot, 18, 8, 8) float32 facultatif, rempli par les plans
+
+Sortie :
+    - (plans (lot, 18, 8, 8) float32, politiques denses (lot, 1968) float32 normalisées, valuations (lot,) float32
+       du point de vue du joueur qui a le trait)
+'''
+
+def decode_records(records, policy_entries, out=None):
+
+    n = len(records)
+    castling = (records["castling"][:, None] >> np.arange(4, dtype=np.uint8)) & 1
+    planes = bitboards_to_planes(records["bitboards"], records["turn"].astype(bool), castling,
+                                 records["ep_square"].astype(np.int64), records["fifty_move"], out)
+
+    lengths = records["nb_moves"].astype(np.int64)
+    rows = np.repeat(np.arange(n), lengths)
+    visits = policy_entries["visits"].astype(np.float32)
+    totals = np.bincount(rows, weights=visits, minlength=n)
+    policies = np.zeros((n, N_LABELS), dtype=np.float32)
+    policies[rows, policy_entries["label"]] = visits / np.maximum(totals[rows], 1)
+
+    values = np.where(records["turn"] == 1, records["outcome"], -records["outcome"]).astype(np.float32)
+
+    return planes, policies, values
+
+
+class record_writer():
+
+    '''
+    Classe record_writer
+
+    Ajoute des positions à un jeu de données prefix : elles sont gardées en mémoire puis écrites par fragments de
+    shard_size positions. Si l'index existe déjà, les nouveaux fragments sont ajoutés à la suite. Elle est
+    caractérisée par 5 attributs :
+
+        - prefix : chemin du jeu de données, sans extension
+        - shard_size : entier, nombre de positions par fragment
+        - records : liste des position_record en attente
+        - policies : liste des politiques en attente
+        - index : dictionnaire, contenu de l'index (liste des fragments)
+    '''
+
+    def __init__(self, prefix, shard_size=2**20):
+
+        self.prefix = prefix
+        self.shard_size = shard_size
+        self.records = []
+        self.policies = []
+        self.index = read_index(prefix) if os.path.exists(prefix + ".index.json") else {"shards": []}
+
+    def add(self, position, moves, visits, outcome):
+
+        self.add_records([encode_position(position, moves, visits, outcome)])
+
+        return
+
+    def add_records(self, encoded):
+
+        '''
+        Ajoute des positions déjà encodées, liste de (position_record, politique) (cf encode_position)
+        '''
+
+        for record, policy in encoded:
+            self.records.append(record)
+            self.policies.append(policy)
+
+            if len(self.records) >= self.shard_size:
+                self.flush()
+
+        return
+
+    def add_game(self, positions, moves, visits, outcome):
+
+        for position, position_moves, position_visits in zip(positions, moves, visits):
+            self.add(position, position_moves, position_visits, outcome)
+
+        return
+
+    '''
+    Fonction flush(record_writer())
+
+    Description :
+        Écrit les positions en attente dans un nouveau fragment puis met à jour l'index (écrit en dernier, pour qu'un
+        fragment n'y figure qu'une fois complet).
+    '''
+
+    def flush(self):
+
+        if len(self.records) == 0:
+            return
+
+        records = np.array(self.records, dtype=position_record)
+        policy = np.concatenate(self.policies) if self.policies else np.zeros(0, dtype=policy_entry)
+        records["policy_start"] = np.cumsum(records["nb_moves"], dtype=np.uint64) - records["nb_moves"]
+
+        name = f"{os.path.basename(self.prefix)}-{len(self.index['shards']):05d}"
+        directory = os.path.dirname(self.prefix)
+        np.save(os.path.join(directory, name + ".records.npy"), records)
+        np.save(os.path.join(directory, name + ".policy.npy"), policy)
+
+        self.index["shards"].append({"records": name + ".records.npy", "policy": name + ".policy.npy", "count": len(records)})
+        write_index(self.prefix, self.index)
+        self.records = []
+        self.policies = []
+
+        return
+
+    def close(self):
+
+        self.flush()
+
+        return
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, *exc):
+
+        self.close()
+
+        return False
+
+
+def read_index(prefix):
+
+    with open(prefix + ".index.json", "rt") as f:
+        return json.load(f)
+
+
+def write_index(prefix, index):
+
+    with open(prefix + ".index.json.tmp", "wt") as f:
+        json.dump(index, f)
+    os.replace(prefix + ".index.json.tmp", prefix + ".index.json") # remplacement atomique
+
+    return
+
+
+class record_dataset():
+
+    '''
+    Classe record_dataset
+
+    Jeu de données écrit par record_writer, lu en memmap : seules les positions demandées sont lues sur le disque.
+    Elle est caractérisée par 4 attributs :
+
+        - shards : liste des (positions, politiques) de chaque fragment, en memmap
+        - offsets : entiers, indice global de la première position de chaque fragment
+        - size : entier, nombre total de positions
+        - index : dictionnaire, contenu de l'index
+    '''
+
+    def __init__(self, prefix):
+
+        self.index = read_index(prefix)
+        directory = os.path.dirname(prefix)
+        self.shards = [(np.load(os.path.join(directory, shard["records"]), mmap_mode="r"),
+                        np.load(os.path.join(directory, shard["policy"]), mmap_mode="r"))
+                       for shard in self.index["shards"]]
+        counts = [shard["count"] for shard in self.index["shards"]]
+        self.offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        self.size = int(self.offsets[-1])
+
+    def __len__(self):
+
+        return self.size
+
+    '''
+    Fonction read(record_dataset(), indices)
+
+    Sortie :
+        - (position_record des indices demandés, leurs politiques policy_entry mises bout à bout dans le même ordre)
+    '''
+
+    def read(self, indices):
+
+        indices = np.asarray(indices, dtype=np.int64)
+        shard_ids = np.searchsorted(self.offsets, indices, side="right") - 1
+        records = np.empty(len(indices), dtype=position_record)
+
+        for shard_id in np.unique(shard_ids):
+            where = np.flatnonzero(shard_ids == shard_id)
+            records[where] = self.shards[shard_id][0][indices[where] - self.offsets[shard_id]]
+
+        # la politique de chaque position est une tranche contiguë de son fragment : indices de toutes les entrées
+        lengths = records["nb_moves"].astype(np.int64)
+        rows = np.repeat(np.arange(len(indices)), lengths)
+        within = np.arange(len(rows)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        sources = records["policy_start"].astype(np.int64)[rows] + within
+        policy = np.empty(len(rows), dtype=policy_entry)
+
+        for shard_id in np.unique(shard_ids):
+            where = np.flatnonzero(shard_ids[rows] == shard_id)
+            policy[where] = self.shards[shard_id][1][sources[where]]
+
+        return records, policy
+
+    def batch(self, indices, out=None):
+
+        return decode_records(*self.read(indices), out=out)
+
+    def nbytes(self):
+
+        return sum(records.nbytes + policy.nbytes for records, policy in self.shards)
@@ -0,0 +1,95 @@
+import multiprocessing
+import random
+import numpy as np
+import chess
+
+
+'''
+root_parallel.py
+
+Recherche parallélisée à la racine : plusieurs processus effectuent des recherches indépendantes de la même position,
+avec des graines différentes (donc des tirages aléatoires et des bruits de Dirichlet différents). On additionne ensuite
+les nombres de visites et les valuations des enfants de la racine et on choisit le coup à partir de ces statistiques.
+Fonctionne avec la recherche à simulations aléatoires (mcts) et avec la recherche guidée par le réseau de neurones (mcts_nn).
+'''
+
+
+'''
+Fonction search_worker(position, engine, nb_simul, seed, options)
+
+Arguments :
+    - position : chess.Board(), position à analyser
+    - engine : "mcts" ou "mcts_nn"
+    - nb_simul : entier, nombre de simulations effectuées par ce processus
+    - seed : entier, graine des générateurs aléatoires du processus
+    - options : dictionnaire, arguments supplémentaires passés au constructeur de la recherche
+
+Sortie :
+    - coups de la racine (format uci), nombres de visites et sommes des valuations correspondants
+'''
+
+def search_worker(position, engine, nb_simul, seed, options):
+
+    random.seed(seed)
+    np.random.seed(seed % 2**32)
+
+    if engine == "mcts":
+        from MCTS import mcts
+        search = mcts(position, **options)
+
+    else: # le modèle est chargé une seule fois par processus (cf nn.load_model)
+        from MCTS_nn import mcts_nn
+        search = mcts_nn(position, **options)
+
+    search.simulate(nb_simul)
+    moves, N, W = search.root_stats()
+
+    return [move.uci() for move in moves], np.asarray(N), np.asarray(W)
+
+
+'''
+Fonction root_parallel_search(position, nb_workers, nb_simul, engine, seed, pool, **options)
+
+Arguments :
+    - position : chess.Board(), position à analyser
+    - nb_workers : entier, nombre de recherches indépendantes
+    - nb_simul : entier, nombre de simulations de chaque recherche
+    - engine : "mcts" ou "mcts_nn"
+    - seed : entier ou None, graine à partir de laquelle sont tirées les graines des recherches
+    - pool : multiprocessing.Pool() ou None, à fournir pour garder les processus (et leurs modèles) d'un coup à l'autre
+
+Sorties :
+    - le coup choisi (le plus visité au total, tirage au hasard en cas d'égalité)
+    - dictionnaire coup uci -> (nombre de visites, somme des valuations) fusionné sur toutes les recherches
+
+ValueError si la partie est finie dans position (aucun coup à chercher).
+'''
+
+def root_parallel_search(position, nb_workers=4, nb_simul=100, engine="mcts_nn", seed=None, pool=None, **options):
+
+    if position.outcome() is not None: # mat, pat... : aucun processus n'est lancé
+        raise ValueError("the game is over, there is no move to search")
+
+    seeds = np.random.default_rng(seed).integers(0, 2**63, size=nb_workers)
+    tasks = [(position, engine, nb_simul, int(s), options) for s in seeds]
+
+    if pool is None:
+        with multiprocessing.Pool(nb_workers) as pool:
+            results = pool.starmap(search_worker, tasks)
+
+    else:
+        results = pool.starmap(search_worker, tasks)
+
+    stats = {}
+
+    for moves, N, W in results: # fusion des statistiques de la racine
+
+        for move, n, w in zip(moves, N, W):
+            total = stats.get(move, (0, 0.))
+            stats[move] = (total[0] + int(n), total[1] + float(w))
+
+    N = np.array([n for n, w in stats.values()])
+    moves = list(stats.keys())
+    move = moves[random.choice(np.flatnonzero(N == N.max()))]
+
+    return chess.Move.from_uci(move), stats
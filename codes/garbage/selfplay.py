@@ -0,0 +1,197 @@
+import time
+import numpy as np
+import chess
+from MCTS_nn import * # recherche arborescente Monte Carlo guidée par le réseau de neurones
+
+
+'''
+selfplay.py
+
+Contient la classe selfplay qui joue nb_games parties de self-play en même temps dans un seul processus.
+
+Chaque partie a sa propre recherche mcts_nn. À chaque étape, chaque recherche sélectionne un petit lot de feuilles
+(cf mcts_nn.select_batch), les positions de toutes les parties sont évaluées en un seul appel au réseau de neurones,
+puis les résultats sont rendus à chaque recherche (cf mcts_nn.expand_batch). Les lots restent donc pleins même sans
+serveur d'inférence. Quand une recherche a fait nb_simul simulations, sa partie joue un coup ; une partie terminée
+est enregistrée et une nouvelle partie prend sa place.
+'''
+
+
+class selfplay():
+
+    '''
+    Classe selfplay
+
+    Elle est caractérisée par 14 attributs :
+
+        - nb_games : entier, nombre de parties jouées en même temps
+        - nb_simul : entier, nombre de simulations par coup
+        - leaves_per_step : entier, nombre de feuilles sélectionnées par chaque recherche à chaque étape
+        - virtual_loss : réel, perte virtuelle de chaque recherche (cf mcts_nn.batch_simulation)
+        - temperature_moves : entier, nombre de demi-coups joués au hasard proportionnellement aux visites (ensuite on
+                              joue le coup le plus visité)
+        - max_moves : entier, nombre maximal de demi-coups d'une partie (au-delà la partie est déclarée nulle)
+        - writer : records.record_writer() ou None, où sont écrites les parties terminées
+        - games : liste des parties en cours, None pour une place libre
+        - finished : liste des parties terminées (coups uci, résultat) si writer est None, avec leurs enregistrements
+        - model, cache, digest : réseau de neurones, cache partagés par toutes les recherches et empreinte du réseau
+                                 (cf mcts_nn)
+        - nb_total, started : nombre de parties à jouer (None pour ne jamais s'arrêter) et nombre de parties commencées
+        - stats : dictionnaire, nombres de parties, de coups, d'appels au réseau et de positions évaluées
+    '''
+
+    def __init__(self, nb_games=16, nb_simul=100, leaves_per_step=8, virtual_loss=1, temperature_moves=30, max_moves=512,
+                 model=None, cache=None, writer=None, digest=None):
+
+        self.nb_games = nb_games
+        self.nb_simul = nb_simul
+        self.leaves_per_step = leaves_per_step
+        self.virtual_loss = virtual_loss
+        self.temperature_moves = temperature_moves
+        self.max_moves = max_moves
+        self.model = model if model is not None else load_model()
+        self.cache = cache
+        self.digest = digest
+        self.writer = writer
+        self.games = [None] * nb_games
+        self.finished = []
+        self.nb_total = None
+        self.started = 0
+        self.stats = {"games": 0, "moves": 0, "evaluations": 0, "positions": 0, "seconds": 0.}
+
+    def new_game(self):
+
+        position = chess.Board()
+        search = mcts_nn(position, batch_size=self.leaves_per_step, virtual_loss=self.virtual_loss, model=self.model, cache=self.cache,
+                        digest=self.digest)
+
+        return {"position": position, "search": search, "simulations": 0, "positions": [], "moves": [], "visits": []}
+
+    '''
+    Fonction step(selfplay())
+
+    Description :
+        Une étape : sélection dans toutes les recherches, un seul appel au réseau de neurones, expansion et
+        rétropropagation dans chaque recherche, puis un coup joué dans les parties dont la recherche est finie.
+    '''
+
+    def step(self):
+
+        batches = []
+
+        for game in self.games:
+
+            if game is None:
+                batches.append(([], []))
+                continue
+
+            nb = min(self.leaves_per_step, self.nb_simul - game["simulations"])
+            batches.append(game["search"].select_batch(nb))
+            game["simulations"] += nb
+
+        positions = [position for leaves, batch_positions in batches for position in batch_positions]
+
+        if len(positions) > 0:
+
+            searches = [game["search"] for game in self.games if game is not None]
+            results = searches[0].evaluate(positions) # même modèle et même cache pour toutes les recherches
+            self.stats["evaluations"] += 1
+            self.stats["positions"] += len(positions)
+            k = 0
+
+            for game, (leaves, batch_positions) in zip(self.games, batches):
+                if game is not None:
+                    game["search"].expand_batch(leaves, results[k:k+len(leaves)])
+                    k += len(leaves)
+
+        for slot, game in enumerate(self.games):
+            if game is not None and game["simulations"] >= self.nb_simul:
+                self.play_move(slot)
+
+        return
+
+    def play_move(self, slot):
+
+        game = self.games[slot]
+        search, position = game["search"], game["position"]
+        moves, N, V = search.root_stats()
+
+        if len(position.move_stack) < self.temperature_moves:
+            move = moves[np.random.choice(len(moves), p=N / N.sum())] if N.sum() > 0 else choice(moves)
+        else:
+            move = moves[int(np.argmax(N))]
+
+        game["positions"].append(position.copy())
+        game["moves"].append(moves)
+        game["visits"].append(N.copy())
+        position.push(move)
+        self.stats["moves"] += 1
+
+        outcome = position.outcome()
+
+        if outcome is not None or len(position.move_stack) >= self.max_moves:
+            self.finish_game(slot, 0 if outcome is None or outcome.winner is None else (1 if outcome.winner == chess.WHITE else -1))
+            return
+
+        search.update_root(position) # on garde le sous-arbre du coup joué
+        game["simulations"] = 0
+
+        return
+
+    def finish_game(self, slot, result):
+
+        game = self.games[slot]
+
+        if self.writer is not None:
+            self.writer.add_game(game["positions"], game["moves"], game["visits"], result)
+        else:
+            self.finished.append({"moves": [move.uci() for move in game["position"].move_stack], "result": result,
+                                  "positions": game["positions"], "policy_moves": game["moves"], "visits": game["visits"]})
+
+        self.stats["games"] += 1
+        self.games[slot] = self.new_game() if self.nb_total is None or self.started < self.nb_total else None
+        if self.games[slot] is not None:
+            self.started += 1
+
+        return
+
+    '''
+    Fonction play(selfplay(), nb_total)
+
+    Argument :
+        - nb_total : entier, nombre de parties à jouer (None pour ne jamais s'arrêter)
+
+    Sortie :
+        - statistiques (parties, coups, appels au réseau, taille moyenne des lots, coups et simulations par seconde)
+    '''
+
+    def play(self, nb_total=None):
+
+        self.nb_total = nb_total
+        self.started = 0
+
+        for slot in range(self.nb_games):
+            if nb_total is None or self.started < nb_total:
+                self.games[slot] = self.new_game()
+                self.started += 1
+
+        start = time.perf_counter()
+
+        while any(game is not None for game in self.games):
+            self.step()
+
+        self.stats["seconds"] += time.perf_counter() - start
+
+        if self.writer is not None:
+            self.writer.flush()
+
+        return self.summary()
+
+    def summary(self):
+
+        stats = dict(self.stats)
+        stats["mean_batch_size"] = stats["positions"] / max(stats["evaluations"], 1)
+        stats["moves_per_second"] = stats["moves"] / stats["seconds"] if stats["seconds"] > 0 else 0.
+        stats["simulations_per_second"] = stats["moves"] * self.nb_simul / stats["seconds"] if stats["seconds"] > 0 else 0.
+
+        return stats
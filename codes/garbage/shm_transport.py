@@ -0,0 +1,181 @@
+"""
+Shared-memory transport between self-play workers and the prediction process: the input planes, the policies and
+the values live in multiprocessing.shared_memory blocks split into slots, and only slot numbers travel over the
+pipes. Nothing is pickled or copied between processes besides a (first slot, number of slots) tuple per request.
+"""
+from logging import getLogger
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from api_chess import ChessModelAPI
+
+logger = getLogger(__name__)
+
+PLANES_SHAPE = (18, 8, 8) # layout of utils.format_input_NN
+N_LABELS = 1968 # width of the policy output (see utils.create_uci_labels)
+
+
+def _attach(name):
+    """
+    Opens an existing shared memory block without asking the resource tracker to destroy it when this process
+    exits (Python >= 3.13). Older versions register it with the tracker of the server, which is shared by the
+    worker processes it starts, so the block is only destroyed once.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+
+def _views(blocks, nb_slots, n_labels):
+    planes, policy, value = blocks
+    return (np.ndarray((nb_slots,) + PLANES_SHAPE, dtype=np.float32, buffer=planes.buf),
+            np.ndarray((nb_slots, n_labels), dtype=np.float32, buffer=policy.buf),
+            np.ndarray((nb_slots,), dtype=np.float32, buffer=value.buf))
+
+
+class SharedMemoryModelAPI(ChessModelAPI):
+    """
+    ChessModelAPI whose requests and answers go through shared memory. Each worker gets a ring of slots_per_worker
+    slots with create_client: it writes the planes of its positions into consecutive slots of its ring, sends the
+    first slot and the number of slots on its pipe, and reads the policies and values back from the same slots
+    once the server acknowledges them. The dynamic batching and the statistics are those of ChessModelAPI, a batch
+    holding at most max_batch_size positions.
+
+    Attributes:
+        :ivar int nb_slots: total number of slots
+        :ivar int slots_per_worker: size of the ring of each worker, the largest batch a worker can send at once
+        :ivar int n_labels: width of the policy output
+        :ivar list(SharedMemory) blocks: shared memory blocks of the planes, policies and values
+        :ivar ndarray planes: (nb_slots, 18, 8, 8) float32 inputs
+        :ivar ndarray policy: (nb_slots, n_labels) float32 policies
+        :ivar ndarray value: (nb_slots,) float32 values
+        :ivar int nb_clients: number of rings already handed out
+    """
+    def __init__(self, agent_model, nb_workers=16, slots_per_worker=64, max_batch_size=256, timeout=0.005,
+                 history=10000, n_labels=N_LABELS):
+        super().__init__(agent_model, max_batch_size=max_batch_size, timeout=timeout, history=history)
+        self.nb_slots = nb_workers * slots_per_worker
+        self.slots_per_worker = slots_per_worker
+        self.n_labels = n_labels
+        sizes = (self.nb_slots * int(np.prod(PLANES_SHAPE)) * 4, self.nb_slots * n_labels * 4, self.nb_slots * 4)
+        self.blocks = [shared_memory.SharedMemory(create=True, size=size) for size in sizes]
+        self.planes, self.policy, self.value = _views(self.blocks, self.nb_slots, n_labels)
+        self.nb_clients = 0
+
+    def stop(self):
+        super().stop()
+        self.planes = self.policy = self.value = None
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+    def create_client(self):
+        """
+        Creates a new pipe and reserves the next ring of slots for the worker that will use it
+        :return SharedMemoryModel: model to send to the worker process (it can be pickled)
+        """
+        if self.nb_clients * self.slots_per_worker >= self.nb_slots:
+            raise ValueError(f"all the {self.nb_slots // self.slots_per_worker} rings of slots are already used")
+        first = self.nb_clients * self.slots_per_worker
+        self.nb_clients += 1
+        return SharedMemoryModel(self.create_pipe(), [block.name for block in self.blocks], self.nb_slots,
+                                 self.n_labels, first, self.slots_per_worker)
+
+    def _size(self, requests):
+        return sum(nb for pipe, (first, nb), arrival in requests)
+
+    def _predict(self, batch):
+        """
+        Runs the model once on the slots of every request of the batch, writes the results into the same slots
+        and acknowledges each request on its pipe.
+        """
+        slots = np.concatenate([np.arange(first, first + nb) for pipe, (first, nb), arrival in batch])
+        if len(batch) == 1: # a single request uses consecutive slots: no gather needed
+            first, nb = batch[0][1]
+            data = self.planes[first:first + nb]
+        else:
+            data = self.planes[slots]
+        policy_ary, value_ary = self.agent_model.model.predict_on_batch(data)
+        self.policy[slots] = policy_ary
+        self.value[slots] = np.asarray(value_ary).reshape(-1)
+
+        for pipe, request, arrival in batch:
+            self._send(pipe, request)
+
+
+class SharedMemoryModel:
+    """
+    Stands for the Keras model inside a self-play worker process, like api_chess.PipeModel, but the data stays in
+    the shared memory of a SharedMemoryModelAPI. nn.evaluate_positions asks input_buffer for the slots where
+    format_inputs_NN writes the planes, so predict only has to send the slot numbers.
+
+    The returned policies and values are views of the slots: they stay valid until the ring wraps around to them,
+    at least until the next call of predict.
+
+    Attributes:
+        :ivar Connection pipe: worker end of a pipe created by SharedMemoryModelAPI.create_client
+        :ivar int first_slot: first slot of the ring of this worker
+        :ivar int nb_slots: size of the ring
+        :ivar int cursor: next free slot of the ring
+    """
+    def __init__(self, pipe, names, total_slots, n_labels, first_slot, nb_slots):
+        self.pipe = pipe
+        self.names = names
+        self.total_slots = total_slots
+        self.n_labels = n_labels
+        self.first_slot = first_slot
+        self.nb_slots = nb_slots
+        self.cursor = first_slot
+        self.blocks = None
+        self.reserved = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["blocks"] = None # the shared memory is mapped again in the worker process
+        state["reserved"] = None
+        for name in ("planes", "policy", "value"):
+            state.pop(name, None)
+        return state
+
+    def _map(self):
+        if self.blocks is None:
+            self.blocks = [_attach(name) for name in self.names]
+            self.planes, self.policy, self.value = _views(self.blocks, self.total_slots, self.n_labels)
+
+    def input_buffer(self, n):
+        """
+        Reserves n consecutive slots of the ring
+        :return ndarray: (n, 18, 8, 8) float32 view of their planes, to be filled by format_inputs_NN(out=...)
+        """
+        if n > self.nb_slots:
+            raise ValueError(f"{n} positions do not fit in a ring of {self.nb_slots} slots")
+        self._map()
+        if self.cursor + n > self.first_slot + self.nb_slots:
+            self.cursor = self.first_slot
+        self.reserved = self.planes[self.cursor:self.cursor + n]
+        return self.reserved
+
+    def predict(self, data):
+        n = len(data)
+        if data is not self.reserved: # planes computed elsewhere: one copy into the ring
+            self.input_buffer(n)[...] = data
+        first = self.cursor
+        self.reserved = None
+        self.cursor += n
+        self.pipe.send((first, n))
+        self.pipe.recv()
+        return self.policy[first:first + n], self.value[first:first + n, None]
+
+    def close(self):
+        self.pipe.close()
+        if self.blocks is not None:
+            self.planes = self.policy = self.value = None
+            for block in self.blocks:
+                try:
+                    block.close()
+                except BufferError: # views returned by predict are still referenced
+                    pass
+            self.blocks = None
@@ -0,0 +1,105 @@
+import threading
+import numpy as np
+import pytest
+from api_chess import ChessModelAPI, PipeModel
+
+
+class fake_keras_model():
+
+    def predict_on_batch(self, x):
+
+        s = x.sum(axis=(1, 2, 3))
+        return np.repeat(s[:, None], 1968, axis=1).astype(np.float32), np.tanh(s)[:, None]
+
+
+class fake_agent_model():
+
+    model = fake_keras_model()
+
+
+def predict_with_timeout(model, data, timeout=10):
+
+    result = []
+    thread = threading.Thread(target=lambda: result.append(model.predict(data)), daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "predict is blocked"
+    return result[0]
+
+
+@pytest.mark.parametrize("nb_positions, max_batch_size", [(256, 256), (300, 64), (1, 64), (0, 8)])
+def test_predict_larger_than_max_batch_size(nb_positions, max_batch_size):
+
+    api = ChessModelAPI(fake_agent_model(), max_batch_size=max_batch_size, timeout=0.001)
+    api.start()
+
+    try:
+        data = np.random.default_rng(0).random((nb_positions, 18, 8, 8), dtype=np.float32)
+        policy, value = predict_with_timeout(PipeModel(api.create_pipe()), data)
+        expected_policy, expected_value = fake_keras_model().predict_on_batch(data)
+
+        assert policy.shape == (nb_positions, 1968)
+        assert value.shape == (nb_positions, 1)
+        np.testing.assert_allclose(policy, expected_policy)
+        np.testing.assert_allclose(value, expected_value, rtol=1e-6)
+    finally:
+        api.stop()
+
+
+def test_single_position_requests_still_answered():
+
+    api = ChessModelAPI(fake_agent_model(), max_batch_size=4, timeout=0.001)
+    api.start()
+
+    try:
+        pipe = api.create_pipe()
+        planes = np.ones((18, 8, 8), dtype=np.float32)
+        pipe.send(planes)
+        policy, value = pipe.recv()
+
+        assert policy.shape == (1968,)
+        assert value == pytest.approx(np.tanh(planes.sum()))
+    finally:
+        api.stop()
+
+
+def test_queue_depth_counts_positions():
+
+    api = ChessModelAPI(fake_agent_model(), max_batch_size=64)
+    api.pending.extend([(None, np.zeros((5, 18, 8, 8), dtype=np.float32), 0.), (None, np.zeros((18, 8, 8), dtype=np.float32), 0.)])
+    api._record_queue_depth()
+
+    assert api.stats()["queue_depth"] == 6
+
+
+def test_stats_while_serving():
+
+    api = ChessModelAPI(fake_agent_model(), max_batch_size=8, timeout=0.001)
+    api.start()
+    stop = threading.Event()
+    errors = []
+
+    def poll_stats():
+        while not stop.is_set():
+            try:
+                assert api.stats()["queue_depth"] >= 0
+            except Exception as error:
+                errors.append(error)
+                return
+
+    thread = threading.Thread(target=poll_stats, daemon=True)
+    thread.start()
+
+    try:
+        pipes = [PipeModel(api.create_pipe()) for i in range(4)]
+        data = np.ones((20, 18, 8, 8), dtype=np.float32)
+        for i in range(5):
+            for pipe in pipes:
+                predict_with_timeout(pipe, data)
+    finally:
+        stop.set()
+        thread.join()
+        api.stop()
+
+    assert not errors
+    assert api.stats()["queue_depth"] == 0
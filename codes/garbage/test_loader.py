@@ -0,0 +1,46 @@
+import threading
+import chess
+import pytest
+from records import record_writer, write_index
+from loader import record_loader
+
+
+def next_with_timeout(iterator, timeout=10):
+
+    result = []
+    thread = threading.Thread(target=lambda: result.append(next(iterator, None)), daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "__next__ is blocked"
+    return result[0]
+
+
+@pytest.mark.parametrize("nb_workers", [1, 3])
+def test_next_after_exhaustion_keeps_raising_stop_iteration(nb_workers, tmp_path):
+
+    prefix = str(tmp_path / "games")
+    board = chess.Board()
+    with record_writer(prefix) as writer:
+        for i in range(40):
+            move = next(iter(board.legal_moves))
+            writer.add(board, [move], [1], 0)
+            board.push(move)
+
+    loader = record_loader(prefix, batch_size=8, shuffle_buffer=16, block_size=8, nb_workers=nb_workers, epochs=1, seed=0)
+
+    try:
+        assert sum(len(planes) for planes, policies, values in loader) == 40
+        for i in range(3):
+            assert next_with_timeout(loader) is None
+        assert loader.finished_workers == loader.nb_workers == nb_workers
+    finally:
+        loader.close()
+
+
+def test_empty_dataset_is_rejected(tmp_path):
+
+    prefix = str(tmp_path / "empty")
+    write_index(prefix, {"shards": []}) # index d'un jeu de données sans aucune position
+
+    with pytest.raises(ValueError):
+        record_loader(prefix, epochs=None)
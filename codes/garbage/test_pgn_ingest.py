@@ -0,0 +1,101 @@
+import io
+import chess
+import chess.pgn
+import numpy as np
+import pytest
+from pgn_ingest import ingest_chunk, read_games, replay, results
+from records import encode_position
+
+
+annotated_games = [
+    # annotations collées aux coups, NAG, commentaires et variantes
+    """[Event "annotated"]
+[White "a"]
+[Black "b"]
+[Result "1-0"]
+
+1. e4!? e5 2. Nf3 Nc6?! 3. Bb5 $1 a6 4. Ba4 Nf6 5. O-O! Be7 {main line} 6. Re1 b5 7. Bb3 d6
+8. c3 O-O 9. h3 (9. d4 Bg4) 9... Nb8!! 10. d4 Nbd7 11. Nbd2 Bb7 12. Bc2 Re8 13. Nf1 Bf8 14. Ng3 g6
+15. a4 c5 16. d5 c4 17. Bg5 h6 18. Be3 Nc5 19. Qd2 h5? 20. Bg5 Be7 21. Nxe5?? dxe5 22. Bxf6 Bxf6 1-0
+""",
+    # roques notés avec des zéros, grand roque, annotations après un échec
+    """[Event "zeros"]
+[White "c"]
+[Black "d"]
+[Result "0-1"]
+
+1. d4 d5 2. c4 e6 3. Nc3 Nf6 4. Bg5 Be7 5. e3 0-0 6. Nf3 Nbd7 7. Qc2 c5 8. 0-0-0 $2 cxd4
+9. exd4 dxc4 10. Bxc4 Nb6 11. Bb3 Bd7 12. Bxf6 Bxf6 13. Ne4 Bc6 14. Nxf6+ Qxf6 15. Qe4 Bxe4 $19 0-1
+""",
+    # coups des noirs numérotés avec "...", annotations et NAG collées
+    """[Event "black numbers"]
+[White "e"]
+[Black "f"]
+[Result "1/2-1/2"]
+
+1. e4 c5 2. Nf3 d6 3. d4 cxd4 4. Nxd4 Nf6 5. Nc3 a6 6. Be3 e5 7. Nb3 Be6 8. f3 Be7 9. Qd2 O-O
+10. O-O-O Nbd7 11. g4 b5 12. g5 b4 13. Ne2 Ne8 14. f4 a5 15. f5 a4 16. Nbd4 exd4 17. Nxd4 b3
+18. Kb1 bxc2+ 19. Nxc2 Bb3! 20. axb3 axb3 21. Na3$10 Ra4 1/2-1/2
+""",
+]
+
+
+def reference_positions(pgn):
+
+    game = chess.pgn.read_game(io.StringIO(pgn))
+    outcome = results[game.headers["Result"]]
+    board = game.board()
+    encoded = []
+
+    for move in game.mainline_moves():
+        encoded.append(encode_position(board, [move], [1], outcome))
+        board.push(move)
+
+    return encoded
+
+
+@pytest.mark.parametrize("pgn", annotated_games)
+def test_replay_matches_python_chess(pgn, tmp_path):
+
+    path = tmp_path / "games.pgn"
+    path.write_text(pgn)
+    (headers, text), = list(read_games(str(path), 0, path.stat().st_size))
+
+    encoded = replay(headers, text)
+    expected = reference_positions(pgn)
+
+    assert encoded is not None
+    assert len(encoded) == len(expected)
+    for (record, policy), (expected_record, expected_policy) in zip(encoded, expected):
+        assert record.tobytes() == expected_record.tobytes()
+        np.testing.assert_array_equal(policy, expected_policy)
+
+
+@pytest.mark.parametrize("text, moves", [("1. e4!? e5?! 2. Nf3$1 Nc6 *", ["e2e4", "e7e5", "g1f3", "b8c6"]),
+                                         ("1. e4 e5 2. Nf3 Nf6 3. Bc4 Bc5 4. 0-0 0-0 *", ["e2e4", "e7e5", "g1f3", "g8f6", "f1c4", "f8c5", "e1g1", "e8g8"])])
+def test_replay_strips_annotations_and_reads_zero_castling(text, moves):
+
+    encoded = replay({"Result": "1/2-1/2"}, text)
+
+    board = chess.Board()
+    expected = []
+    for move in moves:
+        expected.append(encode_position(board, [chess.Move.from_uci(move)], [1], 0))
+        board.push_uci(move)
+
+    assert [policy.tobytes() for record, policy in encoded] == [policy.tobytes() for record, policy in expected]
+
+
+@pytest.mark.parametrize("null_move", ["--", "Z0"])
+def test_null_move_rejects_the_game(null_move, tmp_path):
+
+    assert replay({"Result": "1-0"}, f"1. e4 e5 2. {null_move} Nc6 3. Bc4 1-0") is None
+
+    path = tmp_path / "games.pgn"
+    path.write_text(f'[Event "null"]\n[Result "1-0"]\n\n1. e4 e5 2. {null_move} Nc6 3. Bc4 1-0\n\n' + annotated_games[0])
+    task = {"path": str(path), "start": 0, "end": path.stat().st_size, "prefix": str(tmp_path / "chunk"),
+            "shard_size": 1024, "filters": {}}
+    stats = ingest_chunk(task)
+
+    assert (stats["games"], stats["accepted"], stats["rejected_illegal"]) == (2, 1, 1)
+    assert stats["positions"] == len(reference_positions(annotated_games[0]))
@@ -3,6 +3,107 @@ import numpy as np
 import chess
 
 
+"""
+Function board_bitboards(Chess.Board()) :
+
+Raw description of a Chess.Board() object, read directly from its bitboards
+"""
+
+
+def board_bitboards(chess_board):
+    """
+    :return: (12 piece bitboards in 'KQRBNPkqrbnp' order, castling rights in 'KQkq' order,
+        en passant square or -1, fifty-move counter) exactly as the FEN of the board reports them
+    """
+    white = chess_board.occupied_co[chess.WHITE]
+    black = chess_board.occupied_co[chess.BLACK]
+    piece_masks = (chess_board.kings, chess_board.queens, chess_board.rooks,
+                   chess_board.bishops, chess_board.knights, chess_board.pawns) # chess_board.pieces_mask
+    bitboards = [mask & white for mask in piece_masks] + [mask & black for mask in piece_masks]
+
+    castling_fen = chess_board.castling_xfen()
+    castling = [c in castling_fen for c in 'KQkq']
+
+    ep_square = chess_board.ep_square if chess_board.has_legal_en_passant() else -1
+
+    return bitboards, castling, ep_square, chess_board.halfmove_clock
+
+
+"""
+Function bitboards_to_planes(bitboards, turn, castling, ep_square, fifty_move, out) :
+
+Vectorized construction of the input planes of a batch of positions
+"""
+
+
+def bitboards_to_planes(bitboards, turn, castling, ep_square, fifty_move, out=None):
+    """
+    Positions where black is to move are flipped vertically and their colours are swapped, so that the
+    player to move is always at the bottom of the planes. As in the FEN based encoder, the en passant
+    plane is never flipped.
+
+    :param bitboards: (N, 12) uint64, piece bitboards in 'KQRBNPkqrbnp' order
+    :param turn: (N,) True where white is to move
+    :param castling: (N, 4) castling rights in 'KQkq' order
+    :param ep_square: (N,) en passant square, -1 if none
+    :param fifty_move: (N,) fifty-move counter
+    :param out: optional preallocated (N, 18, 8, 8) float32 array
+    :return: (N, 18, 8, 8) representation of the game states
+    """
+    bitboards = np.ascontiguousarray(bitboards, dtype='<u8')
+    turn = np.asarray(turn, dtype=bool)
+    castling = np.asarray(castling, dtype=np.float32)
+    ep_square = np.asarray(ep_square, dtype=np.int64)
+    n = len(bitboards)
+
+    if out is None:
+        out = np.empty((n, 18, 8, 8), dtype=np.float32)
+
+    # byte k of a bitboard is rank k + 1, bit j of that byte is file j
+    squares = np.unpackbits(bitboards.view(np.uint8).reshape(n, 12, 8), axis=-1, bitorder='little')
+    squares = squares.reshape(n, 12, 8, 8)
+
+    black = ~turn
+    out[turn, :12] = squares[turn][:, :, ::-1] # rank 8 on the first row
+    out[black, :6] = squares[black][:, 6:] # flipped board : rank 1 on the first row, colours swapped
+    out[black, 6:12] = squares[black][:, :6]
+
+    out[:, 12:16] = np.where(turn[:, None], castling, castling[:, [2, 3, 0, 1]])[:, :, None, None]
+    out[:, 16] = np.asarray(fifty_move, dtype=np.float32)[:, None, None]
+
+    out[:, 17] = 0
+    with_ep = np.flatnonzero(ep_square >= 0)
+    out[with_ep, 17, 7 - ep_square[with_ep] // 8, ep_square[with_ep] % 8] = 1
+
+    return out
+
+
+"""
+Function format_inputs_NN([Chess.Board()], out) :
+
+Format a list of Chess.Board() objects as a batch of inputs for the Neural Network
+"""
+
+
+def format_inputs_NN(chess_boards, out=None):
+    """
+    :param out: optional preallocated (N, 18, 8, 8) float32 array, filled in place
+    :return: a representation of the boards using an (N, 18, 8, 8) shape, good as input to a policy / value network
+    """
+    n = len(chess_boards)
+    bitboards = np.empty((n, 12), dtype='<u8')
+    turn = np.empty(n, dtype=bool)
+    castling = np.empty((n, 4), dtype=bool)
+    ep_square = np.empty(n, dtype=np.int64)
+    fifty_move = np.empty(n, dtype=np.int64)
+
+    for i, chess_board in enumerate(chess_boards):
+        bitboards[i], castling[i], ep_square[i], fifty_move[i] = board_bitboards(chess_board)
+        turn[i] = chess_board.turn
+
+    return bitboards_to_planes(bitboards, turn, castling, ep_square, fifty_move, out)
+
+
 """
 Function format_input_NN(Chess.Board()) :
 
@@ -16,101 +117,7 @@ def format_input_NN(chess_board):
     :return: a representation of the board using an (18, 8, 8) shape, good as input to a policy / value network
     """
 
-    pieces_order = 'KQRBNPkqrbnp' # 12x8x8
-    castling_order = 'KQkq'       # 4x8x8
-    # fifty-move-rule             # 1x8x8
-    # en en_passant               # 1x8x8
-
-    ind = {pieces_order[i]: i for i in range(12)}
-
-    def canon_input_planes(fen):
-        """
-
-        :param fen:
-        :return : (18, 8, 8) representation of the game state
-        """
-        fen = maybe_flip_fen(fen, is_black_turn(fen))
-        return all_input_planes(fen)
-
-    def all_input_planes(fen):
-        current_aux_planes = aux_planes(fen)
-
-        history_both = to_planes(fen)
-
-        ret = np.vstack((history_both, current_aux_planes))
-        assert ret.shape == (18, 8, 8)
-        return ret
-
-    def to_planes(fen):
-        board_state = replace_tags_board(fen)
-        pieces_both = np.zeros(shape=(12, 8, 8), dtype=np.float32)
-        for rank in range(8):
-            for file in range(8):
-                v = board_state[rank * 8 + file]
-                if v.isalpha():
-                    pieces_both[ind[v]][rank][file] = 1
-        assert pieces_both.shape == (12, 8, 8)
-        return pieces_both
-
-    def aux_planes(fen):
-        foo = fen.split(' ')
-
-        en_passant = np.zeros((8, 8), dtype=np.float32)
-        if foo[3] != '-':
-            eps = alg_to_coord(foo[3])
-            en_passant[eps[0]][eps[1]] = 1
-
-        fifty_move_count = int(foo[4])
-        fifty_move = np.full((8, 8), fifty_move_count, dtype=np.float32)
-
-        castling = foo[2]
-        auxiliary_planes = [np.full((8, 8), int('K' in castling), dtype=np.float32),
-                            np.full((8, 8), int('Q' in castling), dtype=np.float32),
-                            np.full((8, 8), int('k' in castling), dtype=np.float32),
-                            np.full((8, 8), int('q' in castling), dtype=np.float32),
-                            fifty_move,
-                            en_passant]
-
-        ret = np.asarray(auxiliary_planes, dtype=np.float32)
-        assert ret.shape == (6, 8, 8)
-        return ret
-
-    def replace_tags_board(board_san):
-        board_san = board_san.split(" ")[0]
-        board_san = board_san.replace("2", "11")
-        board_san = board_san.replace("3", "111")
-        board_san = board_san.replace("4", "1111")
-        board_san = board_san.replace("5", "11111")
-        board_san = board_san.replace("6", "111111")
-        board_san = board_san.replace("7", "1111111")
-        board_san = board_san.replace("8", "11111111")
-        return board_san.replace("/", "")
-
-    def is_black_turn(fen):
-        return fen.split(" ")[1] == 'b'
-
-    def alg_to_coord(alg):
-        rank = 8 - int(alg[1])        # 0-7
-        file = ord(alg[0]) - ord('a') # 0-7
-        return rank, file
-
-    def maybe_flip_fen(fen, flip = False):
-        if not flip:
-            return fen
-        foo = fen.split(' ')
-        rows = foo[0].split('/')
-        def swapcase(a):
-            if a.isalpha():
-                return a.lower() if a.isupper() else a.upper()
-            return a
-        def swapall(aa):
-            return "".join([swapcase(a) for a in aa])
-        return "/".join([swapall(row) for row in reversed(rows)]) \
-            + " " + ('w' if foo[1] == 'b' else 'b') \
-            + " " + "".join(sorted(swapall(foo[2]))) \
-            + " " + foo[3] + " " + foo[4] + " " + foo[5]
-
-    return canon_input_planes(chess_board.fen())
+    return format_inputs_NN([chess_board])[0]
 
 
 
@@ -174,4 +181,47 @@ def create_uci_labels():
                 l_r = letters[l1 + 1]
                 labels_array.append(l + '2' + l_r + '1' + p)
                 labels_array.append(l + '7' + l_r + '8' + p)
-    return labels_array
\ No newline at end of file
+    return labels_array
+
+
+"""
+Table MOVE_INDEX :
+
+MOVE_INDEX[promotion, from_square, to_square] is the index of the move in create_uci_labels(), -1 if the move has no label.
+Built once when the module is imported.
+"""
+
+
+def create_move_index():
+    move_index = np.full((6, 64, 64), -1, dtype=np.int64)
+    for i, label in enumerate(create_uci_labels()):
+        move = chess.Move.from_uci(label)
+        move_index[move.promotion or 0, move.from_square, move.to_square] = i
+    return move_index
+
+
+MOVE_INDEX = create_move_index()
+
+
+"""
+Function policy_indices(Chess.Board(), moves) :
+
+Indices of moves (the legal moves of the board by default) in the policy output of the Neural Network
+"""
+
+
+def policy_indices(chess_board, moves=None):
+    """
+    The policy is expressed from the point of view of the player to move : black moves are mirrored
+    vertically, which is what indexing flipped_uci_labels() does.
+    :return: int array, one index per move
+    """
+    if moves is None:
+        moves = list(chess_board.legal_moves)
+    from_squares = np.fromiter((move.from_square for move in moves), dtype=np.int64, count=len(moves))
+    to_squares = np.fromiter((move.to_square for move in moves), dtype=np.int64, count=len(moves))
+    promotions = np.fromiter((move.promotion or 0 for move in moves), dtype=np.int64, count=len(moves))
+    if not chess_board.turn:
+        from_squares ^= 56 # chess.square_mirror
+        to_squares ^= 56
+    return MOVE_INDEX[promotions, from_squares, to_squares]